@@ -0,0 +1,107 @@
+import datetime
+import re
+
+BACKUPSTYLE_TIME = 0
+BACKUPSTYLE_OLD = 1
+BACKUPSTYLE_NOBACKUP = 2
+
+BACKUP_TIME_FORMAT = "%Y%m%d%H%M%S%f"
+
+# Grandfather-father-son retention for timestamped backups: the newest few
+# are always kept, then the newest backup of each recent day, week and month.
+KEEP_LAST_BACKUPS = 5
+KEEP_DAILY_BACKUPS = 7
+KEEP_WEEKLY_BACKUPS = 4
+KEEP_MONTHLY_BACKUPS = 6
+
+# Only the backup of the previous version is kept.
+KEEP_OLD_BACKUPS = 1
+
+# Matches names made by get_backup_file_name, e.g. world_20210101120000000000.db
+BACKUP_FILE_NAME_PATTERN = re.compile(r'^(.*)_(\d{20})(\.[^.]*)?$')
+
+
+def get_backup_time_string(time=None):
+    if time is None:
+        time = datetime.datetime.now()
+
+    return time.strftime(BACKUP_TIME_FORMAT)
+
+
+def parse_backup_file_name(backup_file_name):
+    # Returns (file name, backup time), or None if this is not a backup.
+    match = BACKUP_FILE_NAME_PATTERN.match(backup_file_name)
+    if match is None:
+        return None
+
+    try:
+        time = datetime.datetime.strptime(
+            match.group(2), BACKUP_TIME_FORMAT)
+    except ValueError:
+        return None
+
+    return match.group(1) + (match.group(3) or ''), time
+
+
+def get_kept_backups(backups, get_key, count):
+    # backups is sorted newest first; keeps the newest one of each of the
+    # latest count periods.
+    kept = []
+    keys = set()
+
+    for backup_file_name, time in backups:
+        key = get_key(time)
+        if key in keys:
+            continue
+
+        if len(keys) >= count:
+            break
+
+        keys.add(key)
+        kept.append(backup_file_name)
+
+    return kept
+
+
+def get_retained_backups(backups, backup_style):
+    if backup_style == BACKUPSTYLE_OLD:
+        return [backup_file_name
+                for backup_file_name, _ in backups[:KEEP_OLD_BACKUPS]]
+
+    retained = [backup_file_name
+                for backup_file_name, _ in backups[:KEEP_LAST_BACKUPS]]
+    retained += get_kept_backups(
+        backups, lambda time: time.date(), KEEP_DAILY_BACKUPS)
+    retained += get_kept_backups(
+        backups, lambda time: time.isocalendar()[:2], KEEP_WEEKLY_BACKUPS)
+    retained += get_kept_backups(
+        backups, lambda time: (time.year, time.month), KEEP_MONTHLY_BACKUPS)
+
+    return retained
+
+
+def get_expired_backups(backup_file_names, backup_style):
+    # Backups are never removed when backups are turned off, so switching
+    # the setting cannot throw away existing history.
+    if backup_style == BACKUPSTYLE_NOBACKUP:
+        return []
+
+    backups_by_file_name = {}
+    for backup_file_name in backup_file_names:
+        parsed = parse_backup_file_name(backup_file_name)
+        if parsed is None:
+            continue
+
+        file_name, time = parsed
+        backups_by_file_name.setdefault(file_name, []).append(
+            (backup_file_name, time))
+
+    expired = []
+    for backups in backups_by_file_name.values():
+        backups.sort(key=lambda backup: backup[1], reverse=True)
+
+        retained = set(get_retained_backups(backups, backup_style))
+        expired += [backup_file_name for backup_file_name, _ in backups
+                    if backup_file_name not in retained]
+
+    return expired
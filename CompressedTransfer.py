@@ -0,0 +1,118 @@
+import tempfile
+import zlib
+from abc import ABCMeta, abstractmethod
+
+from HashCache import HASH_CHUNK_SIZE
+from TransferStrategy import FullFileTransfer, get_upload_chunk_size, \
+    get_app_properties, get_content_md5, download_media, upload_media, \
+    open_atomic_file, create_upload_request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TRANSFER_FORMAT_ZSTD = 'zstd'
+TRANSFER_FORMAT_GZIP = 'gzip'
+
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+# zlib produces and accepts a gzip container with this window size.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class DecompressingWriter():
+    def __init__(self, decompressor, writer):
+        self._decompressor = decompressor
+        self._writer = writer
+
+    def write(self, data):
+        self._writer.write(self._decompressor.decompress(data))
+        return len(data)
+
+    def close(self):
+        self._writer.write(self._decompressor.flush())
+
+
+class CompressedTransfer(FullFileTransfer, metaclass=ABCMeta):
+    @abstractmethod
+    def get_compressor(self):
+        pass
+
+    @abstractmethod
+    def get_decompressor(self):
+        pass
+
+    def compress_to_file(self, file_path, compressed_file):
+        compressor = self.get_compressor()
+
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                compressed_file.write(compressor.compress(chunk))
+
+        compressed_file.write(compressor.flush())
+        compressed_file.seek(0)
+
+    def upload(self, updater, metadata, file_path, md5):
+        from googleapiclient.http import MediaIoBaseUpload
+
+        with tempfile.TemporaryFile() as compressed_file:
+            self.compress_to_file(file_path, compressed_file)
+
+            media = MediaIoBaseUpload(
+                compressed_file,
+                mimetype='application/octet-stream',
+                chunksize=get_upload_chunk_size(updater),
+                resumable=True)
+            body = dict(metadata)
+            body['appProperties'] = get_app_properties(
+                self.transfer_format, md5)
+
+            request = create_upload_request(updater, body, media)
+
+            return upload_media(
+                updater, request, media, idempotent='id' in body)
+
+    def download(self, updater, drive_file_info, file_path):
+        with open_atomic_file(file_path, updater._hash_cache) as writer:
+            decompressing_writer = DecompressingWriter(
+                self.get_decompressor(), writer)
+            download_media(updater, drive_file_info['id'], decompressing_writer)
+            decompressing_writer.close()
+
+            writer.check_md5(get_content_md5(drive_file_info), file_path)
+
+        return file_path
+
+
+class ZstdTransfer(CompressedTransfer):
+    transfer_format = TRANSFER_FORMAT_ZSTD
+
+    def __init__(self):
+        if zstandard is None:
+            raise RuntimeError(
+                "The zstandard package is required for zstd transfers")
+
+    def get_compressor(self):
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def get_decompressor(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+
+class GzipTransfer(CompressedTransfer):
+    transfer_format = TRANSFER_FORMAT_GZIP
+
+    def get_compressor(self):
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+
+    def get_decompressor(self):
+        return zlib.decompressobj(GZIP_WBITS)
+
+
+def get_compressed_transfer():
+    if zstandard is not None:
+        return ZstdTransfer()
+
+    return GzipTransfer()
@@ -0,0 +1,279 @@
+import datetime
+import hashlib
+import io
+import json
+import threading
+
+from RemoteManifest import list_drive_folder, list_drive_files
+from TransferStrategy import FullFileTransfer, TRANSFER_FORMAT_PROPERTY, \
+    get_app_properties, download_media, upload_media, open_atomic_file, \
+    create_upload_request
+
+TRANSFER_FORMAT_DELTA = 'delta'
+
+# Blocks are fixed-size and aligned, so a save that is rewritten in place
+# only sends the blocks whose contents changed.
+DELTA_BLOCK_SIZE = 1024 * 1024
+
+CHUNK_FOLDER_NAME = '.vdsu_chunks'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+MANIFEST_MIME_TYPE = 'application/json'
+
+# Chunks are looked up by name, a number of them per query, instead of
+# listing the whole chunk folder.
+CHUNK_LOOKUP_BATCH_SIZE = 50
+
+# A chunk this new may belong to an upload whose manifest is not written
+# yet, so pruning leaves it alone.
+CHUNK_PRUNE_GRACE_PERIOD = datetime.timedelta(days=1)
+
+
+def get_block_hash(block):
+    return hashlib.sha256(block).hexdigest()
+
+
+def read_blocks(file_path, block_size):
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            yield block
+
+
+def get_local_block_offsets(file_path, block_size):
+    block_offsets = {}
+
+    try:
+        for index, block in enumerate(read_blocks(file_path, block_size)):
+            block_offsets.setdefault(
+                get_block_hash(block), index * block_size)
+    except FileNotFoundError:
+        pass
+
+    return block_offsets
+
+
+def read_local_block(file_path, offset, block_size):
+    with open(file_path, "rb") as file:
+        file.seek(offset)
+        return file.read(block_size)
+
+
+def get_drive_time_string(time):
+    # In the form of modifiedTime, so the two compare as strings.
+    return time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class DeltaTransfer(FullFileTransfer):
+    transfer_format = TRANSFER_FORMAT_DELTA
+
+    def __init__(self, block_size=DELTA_BLOCK_SIZE):
+        self._block_size = block_size
+
+        # Files are transferred in parallel, and all of them must agree on a
+        # single chunk folder.
+        self._chunk_folder_lock = threading.Lock()
+
+    def get_chunk_folder_id(self, updater, create=False):
+        with self._chunk_folder_lock:
+            return self.find_chunk_folder_id(updater, create)
+
+    def find_chunk_folder_id(self, updater, create):
+        drive_service = updater.get_drive_service()
+
+        chunk_folders = updater.execute_request(drive_service.files().list(
+            q="'{}' in parents and name = '{}' and mimeType = '{}' "
+              "and trashed = false".format(
+                  updater._drive_folder_id, CHUNK_FOLDER_NAME,
+                  FOLDER_MIME_TYPE),
+            fields='files(id)'), idempotent=True).get('files', [])
+
+        if len(chunk_folders) > 0:
+            return chunk_folders[0]['id']
+
+        if not create:
+            return None
+
+        chunk_folder = updater.execute_request(drive_service.files().create(
+            body={
+                'name': CHUNK_FOLDER_NAME,
+                'mimeType': FOLDER_MIME_TYPE,
+                'parents': [updater._drive_folder_id]
+            },
+            fields='id'))
+
+        return chunk_folder['id']
+
+    def get_chunk_ids(self, updater, chunk_folder_id, block_hashes,
+                      include_trashed=False):
+        # Only the chunks asked for are looked up, so a transfer costs the
+        # same however many chunks the folder holds.
+        block_hashes = sorted(set(block_hashes))
+        chunk_ids = {}
+
+        for index in range(0, len(block_hashes), CHUNK_LOOKUP_BATCH_SIZE):
+            q = "'{}' in parents and ({})".format(
+                chunk_folder_id, " or ".join(
+                    "name = '{}'".format(block_hash) for block_hash in
+                    block_hashes[index:index + CHUNK_LOOKUP_BATCH_SIZE]))
+            if not include_trashed:
+                q += " and trashed = false"
+
+            for chunk in list_drive_files(
+                    updater.get_drive_service(), q, 'id, name',
+                    updater.get_request_executor()):
+                chunk_ids.setdefault(chunk['name'], chunk['id'])
+
+        return chunk_ids
+
+    def get_referenced_block_hashes(self, updater):
+        # Every delta save the account can see, wherever its folder, as
+        # worlds synced as directory trees share the chunk folder of the
+        # folder they live in.
+        manifests = list_drive_files(
+            updater.get_drive_service(),
+            "appProperties has {{ key='{}' and value='{}' }} "
+            "and trashed = false".format(
+                TRANSFER_FORMAT_PROPERTY, self.transfer_format),
+            'id', updater.get_request_executor())
+
+        block_hashes = set()
+        for manifest in manifests:
+            block_hashes.update(json.loads(
+                self.download_bytes(updater, manifest['id']))['blocks'])
+
+        return block_hashes
+
+    def prune_chunks(self, updater, now=None):
+        # Trashes the chunks no delta save or kept backup uses any more.
+        # Returns the number of chunks that were trashed.
+        chunk_folder_id = self.get_chunk_folder_id(updater)
+        if chunk_folder_id is None:
+            return 0
+
+        block_hashes = self.get_referenced_block_hashes(updater)
+
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        cutoff = get_drive_time_string(now - CHUNK_PRUNE_GRACE_PERIOD)
+
+        chunks = [chunk for chunk in list_drive_folder(
+                      updater.get_drive_service(), chunk_folder_id,
+                      'id, name, modifiedTime',
+                      updater.get_request_executor())
+                  if chunk['name'] not in block_hashes and
+                  chunk['modifiedTime'] < cutoff]
+
+        errors = updater._storage_backend.trash_files(updater, chunks)
+        for chunk in chunks:
+            if chunk['id'] in errors:
+                print("Could not trash chunk {}: {}".format(
+                    chunk['name'], errors[chunk['id']]))
+
+        return len(chunks) - len(errors)
+
+    def upload_chunk(self, updater, chunk_folder_id, block_hash, block):
+        from googleapiclient.http import MediaIoBaseUpload
+
+        media = MediaIoBaseUpload(
+            io.BytesIO(block), mimetype='application/octet-stream')
+
+        request = updater.get_drive_service().files().create(
+            body={'name': block_hash, 'parents': [chunk_folder_id]},
+            media_body=media,
+            fields='id')
+
+        return upload_media(updater, request, media)
+
+    def download_bytes(self, updater, file_id):
+        buffer = io.BytesIO()
+        download_media(updater, file_id, buffer)
+
+        return buffer.getvalue()
+
+    def upload(self, updater, metadata, file_path, md5):
+        from googleapiclient.http import MediaIoBaseUpload
+
+        chunk_folder_id = self.get_chunk_folder_id(updater, create=True)
+
+        block_hashes = []
+        block_offsets = {}
+        size = 0
+
+        for block in read_blocks(file_path, self._block_size):
+            block_hash = get_block_hash(block)
+            block_hashes.append(block_hash)
+            block_offsets.setdefault(block_hash, size)
+            size += len(block)
+
+        chunk_ids = self.get_chunk_ids(
+            updater, chunk_folder_id, block_offsets)
+
+        # Only the blocks Drive does not have yet are read a second time.
+        for block_hash, offset in block_offsets.items():
+            if block_hash in chunk_ids:
+                continue
+
+            block = read_local_block(file_path, offset, self._block_size)
+            if get_block_hash(block) != block_hash:
+                raise IOError("{} changed while it was uploaded".format(
+                    file_path))
+
+            self.upload_chunk(updater, chunk_folder_id, block_hash, block)
+
+        manifest = {
+            'size': size,
+            'md5': md5,
+            'block_size': self._block_size,
+            'blocks': block_hashes
+        }
+
+        media = MediaIoBaseUpload(
+            io.BytesIO(json.dumps(manifest).encode()),
+            mimetype=MANIFEST_MIME_TYPE)
+        body = dict(metadata)
+        body['mimeType'] = MANIFEST_MIME_TYPE
+        body['appProperties'] = get_app_properties(self.transfer_format, md5)
+
+        request = create_upload_request(updater, body, media)
+
+        return upload_media(
+            updater, request, media, idempotent='id' in body)
+
+    def download(self, updater, drive_file_info, file_path):
+        manifest = json.loads(
+            self.download_bytes(updater, drive_file_info['id']))
+        block_size = manifest['block_size']
+
+        # Blocks the local copy already has are read from disk instead of
+        # being fetched again.
+        local_block_offsets = get_local_block_offsets(file_path, block_size)
+
+        missing_block_hashes = [
+            block_hash for block_hash in manifest['blocks']
+            if block_hash not in local_block_offsets]
+        chunk_ids = {}
+
+        if len(missing_block_hashes) > 0:
+            chunk_folder_id = self.get_chunk_folder_id(updater)
+            chunk_ids = self.get_chunk_ids(
+                updater, chunk_folder_id, missing_block_hashes)
+
+            # A chunk pruned while the manifest was uploaded is still in the
+            # trash.
+            if len(chunk_ids) < len(set(missing_block_hashes)):
+                chunk_ids = self.get_chunk_ids(
+                    updater, chunk_folder_id, missing_block_hashes,
+                    include_trashed=True)
+
+        with open_atomic_file(file_path, updater._hash_cache) as writer:
+            for block_hash in manifest['blocks']:
+                if block_hash in local_block_offsets:
+                    block = read_local_block(
+                        file_path, local_block_offsets[block_hash], block_size)
+                else:
+                    block = self.download_bytes(updater, chunk_ids[block_hash])
+
+                writer.write(block)
+
+            writer.check_md5(manifest['md5'], file_path)
+
+        return file_path
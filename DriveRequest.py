@@ -0,0 +1,232 @@
+import json
+import random
+import socket
+import threading
+import time
+
+from SyncMetrics import COUNTER_REQUESTS, COUNTER_RETRIES, count_metric
+
+MAX_RETRIES = 6
+# Without any connection there is nothing to wait out for a minute; the
+# upload queue takes over after a few quick attempts.
+MAX_NETWORK_RETRIES = 3
+BACKOFF_BASE_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 32.0
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Drive reports some rate limiting as 403 with one of these reasons.
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+# Drive accepts at most 100 calls in one batch request.
+MAX_BATCH_SIZE = 100
+
+
+def get_error_status(exception):
+    resp = getattr(exception, 'resp', None)
+    if resp is None:
+        return None
+
+    return resp.status
+
+
+def get_error_reason(exception):
+    try:
+        content = json.loads(exception.content)
+        return content['error']['errors'][0]['reason']
+    except (AttributeError, ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def is_rate_limit_error(exception):
+    status = get_error_status(exception)
+    return status == 429 or \
+        (status == 403 and get_error_reason(exception) in RATE_LIMIT_REASONS)
+
+
+def is_connection_error(exception):
+    return isinstance(exception, (ConnectionError, socket.timeout))
+
+
+def is_unsent_error(exception):
+    # A refused connection means the request never reached Drive.
+    return isinstance(exception, ConnectionRefusedError)
+
+
+def is_retryable_error(exception, idempotent=True):
+    # A call that is not idempotent, such as a create or a copy, may have
+    # been carried out by Drive when it failed with a server error or a
+    # timeout, and sending it again would make a second file. It is only
+    # retried when Drive turned it away unread.
+    if not idempotent:
+        return is_rate_limit_error(exception) or is_unsent_error(exception)
+
+    if is_connection_error(exception):
+        return True
+
+    if get_error_status(exception) in RETRY_STATUSES:
+        return True
+
+    return is_rate_limit_error(exception)
+
+
+def get_retry_after_seconds(exception):
+    resp = getattr(exception, 'resp', None)
+    if resp is None:
+        return None
+
+    try:
+        return float(resp.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class DriveRequestExecutor():
+    def __init__(self, max_retries=MAX_RETRIES, sleep=time.sleep,
+                 max_network_retries=MAX_NETWORK_RETRIES):
+        self._max_retries = max_retries
+        self._max_network_retries = max_network_retries
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        # When Drive says we are sending too fast, every thread holds off
+        # until this time instead of each one finding out on its own.
+        self._rate_limited_until = 0.0
+
+        # Bytes per second of the last upload over this connection, which
+        # sizes the chunks of the next one.
+        self._upload_throughput = None
+
+        self.round_trip_count = 0
+        self.retry_count = 0
+        self.batched_request_count = 0
+
+    def get_backoff_seconds(self, attempt, exception):
+        retry_after = get_retry_after_seconds(exception)
+        if retry_after is not None:
+            return retry_after
+
+        # Full jitter keeps parallel transfers from retrying in lockstep.
+        ceiling = min(MAX_BACKOFF_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def wait_for_rate_limit(self):
+        with self._lock:
+            delay = self._rate_limited_until - time.monotonic()
+
+        if delay > 0:
+            self._sleep(delay)
+
+    def count_round_trip(self):
+        with self._lock:
+            self.round_trip_count += 1
+        count_metric(COUNTER_REQUESTS)
+
+    def back_off(self, attempt, exception):
+        delay = self.get_backoff_seconds(attempt, exception)
+
+        with self._lock:
+            self.retry_count += 1
+            if is_rate_limit_error(exception):
+                self._rate_limited_until = max(
+                    self._rate_limited_until, time.monotonic() + delay)
+        count_metric(COUNTER_RETRIES)
+
+        self._sleep(delay)
+
+    def record_upload_throughput(self, byte_count, seconds):
+        if byte_count > 0 and seconds > 0:
+            with self._lock:
+                self._upload_throughput = byte_count / seconds
+
+    def get_upload_throughput(self):
+        with self._lock:
+            return self._upload_throughput
+
+    def call(self, function, idempotent=False):
+        # Retrying server errors and timeouts is opt-in, for calls that
+        # can safely be carried out twice.
+        attempt = 0
+
+        while True:
+            self.wait_for_rate_limit()
+            self.count_round_trip()
+
+            try:
+                return function()
+            except Exception as exception:
+                if attempt >= self._max_retries or \
+                        not is_retryable_error(exception, idempotent):
+                    raise
+                if is_connection_error(exception) and \
+                        attempt >= self._max_network_retries:
+                    raise
+
+                self.back_off(attempt, exception)
+                attempt += 1
+
+    def execute(self, request, idempotent=False):
+        return self.call(request.execute, idempotent)
+
+    def next_chunk(self, request):
+        # Works for both resumable uploads and MediaIoBaseDownload, which
+        # pick up where the last successful chunk ended, so a chunk can
+        # always be sent again.
+        return self.call(request.next_chunk, idempotent=True)
+
+    def execute_batch(self, drive_service, requests, idempotent=False):
+        # Returns one (response, exception) pair per request. Sub-requests
+        # that fail with a retryable error are sent again in the next batch.
+        results = [None] * len(requests)
+        pending = list(range(len(requests)))
+        attempt = 0
+
+        while len(pending) > 0:
+            retry = []
+
+            for start in range(0, len(pending), MAX_BATCH_SIZE):
+                indices = pending[start:start + MAX_BATCH_SIZE]
+                self.send_batch(
+                    drive_service, requests, indices, results, idempotent)
+
+                retry.extend(index for index in indices
+                             if results[index][1] is not None and
+                             is_retryable_error(
+                                 results[index][1], idempotent))
+
+            if len(retry) == 0 or attempt >= self._max_retries:
+                break
+
+            self.back_off(attempt, results[retry[0]][1])
+            pending = retry
+            attempt += 1
+
+        return results
+
+    def send_batch(self, drive_service, requests, indices, results,
+                   idempotent=False):
+        def callback(request_id, response, exception):
+            results[int(request_id)] = (response, exception)
+
+        batch = drive_service.new_batch_http_request(callback=callback)
+        for index in indices:
+            batch.add(requests[index], request_id=str(index))
+
+        with self._lock:
+            self.batched_request_count += len(indices)
+
+        self.call(batch.execute, idempotent)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'round_trips': self.round_trip_count,
+                'retries': self.retry_count,
+                'batched_requests': self.batched_request_count
+            }
+
+
+def execute_request(request, request_executor=None, idempotent=False):
+    if request_executor is None:
+        return request.execute()
+
+    return request_executor.execute(request, idempotent)
@@ -0,0 +1,97 @@
+import pickle
+import os.path
+import threading
+
+import httplib2
+import google_auth_httplib2
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+# If modifying these scopes, delete the file token.pickle.
+SCOPES = ['https://www.googleapis.com/auth/drive']
+
+TOKEN_FILE_NAME = 'token.pickle'
+
+
+class AuthorizationRequiredError(Exception):
+    pass
+
+
+def save_credentials(creds, token_file_name=TOKEN_FILE_NAME):
+    with open(token_file_name, 'wb') as token:
+        pickle.dump(creds, token)
+
+
+def load_credentials(client_secret_file_name,
+                     token_file_name=TOKEN_FILE_NAME,
+                     interactive=True):
+    creds = None
+    # The file token.pickle stores the user's access and refresh tokens, and is
+    # created automatically when the authorization flow completes for the first
+    # time. Every Google account has a token file of its own.
+    if os.path.exists(token_file_name):
+        with open(token_file_name, 'rb') as token:
+            creds = pickle.load(token)
+    # An expired access token is renewed with the refresh token, which needs
+    # no user interaction.
+    if creds and creds.expired and creds.refresh_token:
+        try:
+            creds.refresh(Request())
+            save_credentials(creds, token_file_name)
+        except RefreshError:
+            creds = None
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.token or not creds.valid:
+        # Nobody would ever answer the browser under cron or systemd.
+        if not interactive:
+            raise AuthorizationRequiredError(
+                "{} holds no valid Google credentials and signing in "
+                "needs a browser".format(token_file_name))
+
+        flow = InstalledAppFlow.from_client_secrets_file(
+            client_secret_file_name, SCOPES)
+        creds = flow.run_local_server(port=0)
+        # Save the credentials for the next run
+        save_credentials(creds, token_file_name)
+
+    return creds
+
+
+class ThreadLocalHttpFactory():
+    # httplib2.Http is not thread-safe, so every thread that talks to Drive
+    # gets its own authorized connection, reused for all of its requests.
+    def __init__(self, credentials):
+        self._credentials = credentials
+        self._local = threading.local()
+
+    def get_http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self._credentials, http=httplib2.Http())
+            self._local.http = http
+
+        return http
+
+    def build_request(self, http, *args, **kwargs):
+        return HttpRequest(self.get_http(), *args, **kwargs)
+
+
+def get_google_drive_v3_service(client_secret_file_name,
+                                token_file_name=TOKEN_FILE_NAME,
+                                interactive=True):
+    creds = load_credentials(
+        client_secret_file_name, token_file_name, interactive)
+    http_factory = ThreadLocalHttpFactory(creds)
+    # The discovery document bundled with googleapiclient is read from disk
+    # instead of being fetched from Google on every launch.
+    service = build(
+        'drive', 'v3',
+        http=http_factory.get_http(),
+        requestBuilder=http_factory.build_request,
+        static_discovery=True)
+
+    return service
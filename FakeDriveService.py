@@ -0,0 +1,550 @@
+import datetime
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUploadProgress
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+FAKE_MEDIA_URI = 'https://fake.drive/download/{}'
+FAKE_UPLOAD_URI = 'https://fake.drive/upload/{}'
+
+
+def get_http_error(status, message):
+    resp = httplib2.Response({'status': status})
+    return HttpError(resp, message.encode(), uri='https://fake.drive')
+
+
+def matches_query(file, q):
+    if q is None:
+        return True
+
+    # The and inside the braces of an appProperties term is not a term of
+    # its own.
+    for term in re.split(r'\s+and\s+(?![^{]*\})', q.strip()):
+        match = re.fullmatch(
+            r"appProperties has \{ key='(.*)' and value='(.*)' \}", term)
+        if match is not None:
+            app_properties = file.get('appProperties') or {}
+            if app_properties.get(match.group(1)) != match.group(2):
+                return False
+            continue
+
+        match = re.fullmatch(r"\((.*)\)", term)
+        if match is not None:
+            if not any(matches_query(file, alternative) for alternative
+                       in re.split(r'\s+or\s+', match.group(1))):
+                return False
+            continue
+
+        match = re.fullmatch(r"'(.*)' in parents", term)
+        if match is not None:
+            if match.group(1) not in file.get('parents', []):
+                return False
+            continue
+
+        match = re.fullmatch(r"(\w+)\s*(=|!=)\s*'?(.*?)'?", term)
+        if match is None:
+            raise get_http_error(400, "Unsupported query term: " + term)
+
+        key, operator, value = match.groups()
+        actual = str(file.get(key, False)).lower() \
+            if key == 'trashed' else file.get(key)
+
+        if (actual == value) != (operator == '='):
+            return False
+
+    return True
+
+
+class FakeRequest():
+    def __init__(self, service, function):
+        self._service = service
+        self._function = function
+
+    def execute(self, num_retries=0):
+        self._service.wait_for_round_trip()
+
+        with self._service.lock:
+            self._service.request_count += 1
+            self._service.check_failure()
+            return self._function()
+
+
+class FakeBatchRequest():
+    def __init__(self, service, callback=None):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self._requests))
+        self._requests.append((request_id, request, callback))
+
+    def execute(self):
+        # The whole batch is one round trip; each call in it succeeds or
+        # fails on its own.
+        self._service.wait_for_round_trip()
+
+        with self._service.lock:
+            self._service.request_count += 1
+            self._service.check_failure()
+
+            results = []
+            for request_id, request, callback in self._requests:
+                try:
+                    self._service.check_failure()
+                    response, exception = request._function(), None
+                except HttpError as error:
+                    response, exception = None, error
+                results.append((request_id, response, exception, callback))
+
+        for request_id, response, exception, callback in results:
+            callback = callback or self._callback
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class FakeUploadHttp():
+    def __init__(self, service):
+        self._service = service
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        # Only answers the status query of an upload session.
+        match = re.fullmatch(
+            r'bytes \*/(\d+)', (headers or {}).get('Content-Range', ''))
+        if method != 'PUT' or match is None:
+            return httplib2.Response({'status': 400}), b''
+
+        self._service.wait_for_round_trip()
+
+        with self._service.lock:
+            self._service.request_count += 1
+            self._service.check_failure()
+
+            response = self._service.completed_upload_sessions.get(uri)
+            if response is not None:
+                return httplib2.Response({'status': 200}), \
+                    json.dumps(response).encode()
+
+            session = self._service.upload_sessions.get(uri)
+            if session is None:
+                return httplib2.Response({'status': 404}), b''
+
+            received = sum(len(chunk) for chunk in session)
+            headers = {'status': 308}
+            if received > 0:
+                headers['range'] = 'bytes=0-{}'.format(received - 1)
+
+            return httplib2.Response(headers), b''
+
+
+class FakeUploadRequest():
+    def __init__(self, service, media_body, function):
+        self._service = service
+        self._media_body = media_body
+        self._function = function
+        self.http = FakeUploadHttp(service)
+
+        # Mirrors the public attributes googleapiclient resumes a session
+        # with.
+        self.resumable_uri = None
+        self.resumable_progress = 0
+
+    def get_session(self):
+        if self.resumable_uri is None:
+            self.resumable_uri = FAKE_UPLOAD_URI.format(
+                next(self._service._ids))
+            self._service.upload_sessions[self.resumable_uri] = []
+
+        session = self._service.upload_sessions.get(self.resumable_uri)
+        if session is None:
+            raise get_http_error(404, "Upload session not found")
+
+        # A client that resumes without asking for the status of the session
+        # would send the wrong bytes.
+        if self.resumable_progress != sum(len(chunk) for chunk in session):
+            raise get_http_error(400, "Upload resumed at the wrong offset")
+
+        return session
+
+    def next_chunk(self, num_retries=0):
+        size = self._media_body.size()
+        chunk_size = size
+        if self._media_body.resumable():
+            chunk_size = self._media_body.chunksize()
+
+        self._service.wait_for_round_trip()
+        self._service.wait_for_transfer(
+            'upload', min(chunk_size, size - self.resumable_progress))
+
+        with self._service.lock:
+            self._service.request_count += 1
+            self._service.check_failure()
+            session = self.get_session()
+            self._service.check_interruption()
+
+            chunk = self._media_body.getbytes(
+                self.resumable_progress, chunk_size)
+            session.append(chunk)
+            self.resumable_progress += len(chunk)
+            self._service.bytes_uploaded += len(chunk)
+
+            if self.resumable_progress < size:
+                return MediaUploadProgress(
+                    self.resumable_progress, size), None
+
+            del self._service.upload_sessions[self.resumable_uri]
+            response = self._function(b''.join(session))
+            self._service.completed_upload_sessions[self.resumable_uri] = \
+                response
+            return None, response
+
+    def execute(self, num_retries=0):
+        response = None
+        while response is None:
+            status, response = self.next_chunk()
+
+        return response
+
+
+class FakeMediaHttp():
+    def __init__(self, service):
+        self._service = service
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        self._service.wait_for_round_trip()
+
+        with self._service.lock:
+            self._service.request_count += 1
+            self._service.check_failure()
+
+            file_id = uri.rsplit('/', 1)[1]
+            content = self._service.get_content(file_id)
+        total_size = len(content)
+
+        match = re.fullmatch(
+            r'bytes=(\d+)-(\d+)', (headers or {}).get('range', ''))
+        if match is None:
+            begin, end = 0, total_size - 1
+        else:
+            begin = int(match.group(1))
+            end = min(int(match.group(2)), total_size - 1)
+
+        if total_size == 0:
+            return httplib2.Response({
+                'status': 416,
+                'content-range': 'bytes */0'}), b''
+
+        chunk = content[begin:end + 1]
+        with self._service.lock:
+            self._service.bytes_downloaded += len(chunk)
+        self._service.wait_for_transfer('download', len(chunk))
+
+        return httplib2.Response({
+            'status': 206,
+            'content-range': 'bytes {}-{}/{}'.format(begin, end, total_size)
+        }), chunk
+
+
+class FakeMediaRequest():
+    def __init__(self, service, file_id):
+        self.uri = FAKE_MEDIA_URI.format(file_id)
+        self.headers = {}
+        self.http = FakeMediaHttp(service)
+
+    def execute(self, num_retries=0):
+        _, content = self.http.request(self.uri, headers=self.headers)
+        return content
+
+
+class FakeFilesResource():
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, q=None, fields=None, pageSize=100, pageToken=None,
+             **kwargs):
+        def function():
+            files = [file for file in self._service.get_files()
+                     if matches_query(file, q)]
+
+            offset = int(pageToken or 0)
+            results = {'files': files[offset:offset + pageSize]}
+            if offset + pageSize < len(files):
+                results['nextPageToken'] = str(offset + pageSize)
+
+            return results
+
+        return FakeRequest(self._service, function)
+
+    def get(self, fileId, fields=None, **kwargs):
+        return FakeRequest(
+            self._service, lambda: self._service.get_file(fileId))
+
+    def get_media(self, fileId, **kwargs):
+        self._service.get_file(fileId)
+        return FakeMediaRequest(self._service, fileId)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        if media_body is not None:
+            return FakeUploadRequest(
+                self._service, media_body,
+                lambda content: self._service.create_file(
+                    body or {}, content))
+
+        return FakeRequest(
+            self._service, lambda: self._service.create_file(body or {}))
+
+    def update(self, fileId, body=None, media_body=None, fields=None,
+               addParents=None, removeParents=None, **kwargs):
+        def function(content=None):
+            file_body = dict(body or {})
+            if addParents is not None or removeParents is not None:
+                parents = list(self._service.get_file(fileId)['parents'])
+                if removeParents is not None:
+                    parents = [parent for parent in parents
+                               if parent not in removeParents.split(',')]
+                if addParents is not None:
+                    parents.extend(addParents.split(','))
+                file_body['parents'] = parents
+
+            return self._service.update_file(fileId, file_body, content)
+
+        if media_body is not None:
+            return FakeUploadRequest(self._service, media_body, function)
+
+        return FakeRequest(self._service, function)
+
+    def copy(self, fileId, body=None, fields=None, **kwargs):
+        def function():
+            file = dict(self._service.get_file(fileId))
+            file.pop('id')
+            file.update(body or {})
+
+            return self._service.create_file(
+                file, self._service.get_content(fileId))
+
+        return FakeRequest(self._service, function)
+
+    def delete(self, fileId, **kwargs):
+        return FakeRequest(
+            self._service, lambda: self._service.delete_file(fileId))
+
+
+class FakeChangesResource():
+    def __init__(self, service):
+        self._service = service
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest(self._service, lambda: {
+            'startPageToken': str(len(self._service.change_log))})
+
+    def list(self, pageToken, pageSize=100, fields=None, **kwargs):
+        def function():
+            offset = int(pageToken)
+            if offset > len(self._service.change_log):
+                raise get_http_error(404, "Invalid page token")
+
+            changes = []
+            for file_id in self._service.change_log[offset:offset + pageSize]:
+                file = self._service.find_file(file_id)
+                if file is None:
+                    changes.append({'fileId': file_id, 'removed': True})
+                else:
+                    changes.append({
+                        'fileId': file_id, 'removed': False, 'file': file})
+
+            results = {'changes': changes}
+            next_offset = offset + len(changes)
+            if next_offset < len(self._service.change_log):
+                results['nextPageToken'] = str(next_offset)
+            else:
+                results['newStartPageToken'] = str(next_offset)
+
+            return results
+
+        return FakeRequest(self._service, function)
+
+
+# In-memory stand-in for the subset of the Drive v3 service VDSU uses, so the
+# sync code can be exercised without a Google account.
+class FakeDriveService():
+    def __init__(self):
+        self._files = {}
+        self._contents = {}
+        self._ids = itertools.count(1)
+        self._clock = datetime.datetime(2021, 1, 1)
+
+        # Requests may come from several transfer threads at once.
+        self.lock = threading.RLock()
+
+        self.change_log = []
+        self.upload_sessions = {}
+        self.completed_upload_sessions = {}
+        # Number of upload chunks to accept before simulating a dropped
+        # connection, or None to never fail.
+        self.interrupt_after_chunks = None
+        # HTTP statuses the next requests fail with, one per request, e.g.
+        # [503, 429] to exercise the retry logic. None lets a request through.
+        # Every call inside a batch counts as a request of its own.
+        self.fail_next_requests = []
+        # While True, every request fails as if there were no network.
+        self.offline = False
+        # Simulated network round-trip time. Requests wait for it in
+        # parallel, like they would on a real connection.
+        self.latency_seconds = 0.0
+        # Simulated bandwidth in bytes per second, or None for no limit.
+        # Uploads and downloads each have this much, shared by every request
+        # moving data in that direction.
+        self.bandwidth_bytes_per_second = None
+        self._link_lock = threading.Lock()
+        self._link_free_times = {'upload': 0.0, 'download': 0.0}
+
+        self.request_count = 0
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def files(self):
+        return FakeFilesResource(self)
+
+    def changes(self):
+        return FakeChangesResource(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self, callback)
+
+    def wait_for_round_trip(self):
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+    def wait_for_transfer(self, direction, byte_count):
+        # Requests queue for the link, so parallel transfers share the
+        # bandwidth instead of each getting all of it.
+        if not self.bandwidth_bytes_per_second or byte_count <= 0:
+            return
+
+        with self._link_lock:
+            now = time.monotonic()
+            start = max(now, self._link_free_times[direction])
+            self._link_free_times[direction] = \
+                start + byte_count / self.bandwidth_bytes_per_second
+            delay = self._link_free_times[direction] - now
+
+        time.sleep(delay)
+
+    def check_failure(self):
+        if self.offline:
+            raise ConnectionError("Simulated network outage")
+
+        if len(self.fail_next_requests) == 0:
+            return
+
+        status = self.fail_next_requests.pop(0)
+        if status is None:
+            return
+
+        raise get_http_error(status, "Simulated error {}".format(status))
+
+    def check_interruption(self):
+        if self.interrupt_after_chunks is None:
+            return
+
+        if self.interrupt_after_chunks <= 0:
+            self.interrupt_after_chunks = None
+            raise ConnectionError("Simulated network failure")
+
+        self.interrupt_after_chunks -= 1
+
+    def reset_counters(self):
+        self.request_count = 0
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def get_files(self):
+        return [dict(file) for file in self._files.values()]
+
+    def find_file(self, file_id):
+        file = self._files.get(file_id)
+        if file is None:
+            return None
+
+        return dict(file)
+
+    def get_file(self, file_id):
+        file = self.find_file(file_id)
+        if file is None:
+            raise get_http_error(404, "File not found: " + file_id)
+
+        return file
+
+    def get_content(self, file_id):
+        self.get_file(file_id)
+        return self._contents[file_id]
+
+    def get_modified_time(self):
+        self._clock += datetime.timedelta(seconds=1)
+        return self._clock.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def set_content(self, file_id, content):
+        self._contents[file_id] = content
+
+        file = self._files[file_id]
+        if file['mimeType'] != FOLDER_MIME_TYPE:
+            file['md5Checksum'] = hashlib.md5(content).hexdigest()
+            file['size'] = str(len(content))
+
+    def create_file(self, body, content=None):
+        file_id = 'fake{}'.format(next(self._ids))
+
+        file = {
+            'id': file_id,
+            'name': 'Untitled',
+            'mimeType': 'application/octet-stream',
+            'parents': [],
+            'trashed': False
+        }
+        file.update(body)
+        file['id'] = file_id
+        file['modifiedTime'] = self.get_modified_time()
+        self._files[file_id] = file
+
+        self.set_content(file_id, content or b'')
+        self.change_log.append(file_id)
+
+        return self.get_file(file_id)
+
+    def update_file(self, file_id, body, content=None):
+        file = self._files.get(file_id)
+        if file is None:
+            raise get_http_error(404, "File not found: " + file_id)
+
+        if 'appProperties' in body:
+            app_properties = dict(file.get('appProperties', {}))
+            app_properties.update(body['appProperties'])
+            body = dict(body, appProperties=app_properties)
+
+        file.update(body)
+        file['modifiedTime'] = self.get_modified_time()
+
+        if content is not None:
+            self.set_content(file_id, content)
+
+        self.change_log.append(file_id)
+
+        return self.get_file(file_id)
+
+    def delete_file(self, file_id):
+        if self._files.pop(file_id, None) is None:
+            raise get_http_error(404, "File not found: " + file_id)
+
+        del self._contents[file_id]
+        self.change_log.append(file_id)
+
+        return ''
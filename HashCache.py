@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import threading
+
+# Saves are hashed in fixed-size chunks so memory use stays bounded no matter
+# how large the world file is.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+HASH_CACHE_FILE_NAME = 'hash_cache.json'
+
+
+def get_md5_string(file_path, chunk_size=HASH_CHUNK_SIZE):
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+def get_file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class HashCache():
+    def __init__(self, cache_file_path=HASH_CACHE_FILE_NAME):
+        self._cache_file_path = cache_file_path
+        self._entries = {}
+        self._dirty = False
+        # Several transfer threads, and several worlds, may share one cache.
+        self._lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self._cache_file_path, "r", encoding="utf-8") as file:
+                self._entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+        self._dirty = False
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            temp_file_path = self._cache_file_path + '.tmp'
+            with open(temp_file_path, "w", encoding="utf-8") as file:
+                json.dump(self._entries, file)
+            os.replace(temp_file_path, self._cache_file_path)
+
+            self._dirty = False
+
+    def get_md5_string(self, file_path):
+        key = os.path.abspath(file_path)
+        signature = get_file_signature(file_path)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry['signature'] == signature:
+            return entry['md5']
+
+        md5 = get_md5_string(file_path)
+
+        # The file may have been written to while it was being hashed, in
+        # which case the digest belongs to neither version.
+        if get_file_signature(file_path) == signature:
+            with self._lock:
+                self._entries[key] = {'signature': signature, 'md5': md5}
+                self._dirty = True
+
+        return md5
+
+    def set_md5_string(self, file_path, md5):
+        # For files whose content is known without reading them, such as
+        # fresh copies of a hashed file.
+        with self._lock:
+            self._entries[os.path.abspath(file_path)] = {
+                'signature': get_file_signature(file_path),
+                'md5': md5
+            }
+            self._dirty = True
+
+    def invalidate(self, file_path):
+        with self._lock:
+            if self._entries.pop(
+                    os.path.abspath(file_path), None) is not None:
+                self._dirty = True
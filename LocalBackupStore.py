@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from BackupRetention import BACKUPSTYLE_TIME, BACKUPSTYLE_NOBACKUP, \
+    get_expired_backups, parse_backup_file_name
+
+BACKUP_FOLDER_NAME = 'vdsu_backups'
+BACKUP_INDEX_FILE_NAME = 'backups.json'
+
+# ioctl that makes a copy-on-write clone on btrfs, XFS and similar.
+FICLONE = 0x40049409
+
+COPY_METHOD_LINK = 'link'
+COPY_METHOD_REFLINK = 'reflink'
+COPY_METHOD_COPY_FILE_RANGE = 'copy_file_range'
+COPY_METHOD_SENDFILE = 'sendfile'
+COPY_METHOD_COPY = 'copy'
+
+
+def reflink_file(source_file, target_file):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+
+    fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+def copy_file_range_all(source_file, target_file):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError("copy_file_range is not supported on this platform")
+
+    size = os.fstat(source_file.fileno()).st_size
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(
+            source_file.fileno(), target_file.fileno(), size - offset,
+            offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+
+    if offset < size:
+        raise OSError("copy_file_range stopped early")
+
+
+def sendfile_all(source_file, target_file):
+    # Linux can sendfile between regular files, including across file
+    # systems where older kernels refuse copy_file_range.
+    if not sys.platform.startswith('linux'):
+        raise OSError("sendfile to a file is not supported on this platform")
+
+    size = os.fstat(source_file.fileno()).st_size
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(
+            target_file.fileno(), source_file.fileno(), offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+    if offset < size:
+        raise OSError("sendfile stopped early")
+
+
+def copy_file(source_path, target_path, temp_file_suffix='.tmp'):
+    # Tries the cheapest kernel-side copy first: a reflink shares the blocks,
+    # copy_file_range and sendfile keep the data out of user space. Returns
+    # the method that worked.
+    temp_file_path = target_path + temp_file_suffix
+
+    try:
+        with open(source_path, "rb") as source_file, \
+                open(temp_file_path, "wb") as target_file:
+            for method, copy in [
+                    (COPY_METHOD_REFLINK, reflink_file),
+                    (COPY_METHOD_COPY_FILE_RANGE, copy_file_range_all),
+                    (COPY_METHOD_SENDFILE, sendfile_all)]:
+                try:
+                    copy(source_file, target_file)
+                    break
+                except OSError:
+                    source_file.seek(0)
+                    target_file.seek(0)
+                    target_file.truncate()
+            else:
+                method = COPY_METHOD_COPY
+                shutil.copyfileobj(source_file, target_file)
+
+        shutil.copystat(source_path, temp_file_path)
+        os.replace(temp_file_path, target_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+    return method
+
+
+class LocalBackupStore():
+    def __init__(self, directory_path):
+        self._directory_path = directory_path
+        self._index_file_path = os.path.join(
+            directory_path, BACKUP_INDEX_FILE_NAME)
+        self._lock = threading.Lock()
+
+        # Backup file name -> MD5 of its content.
+        self._index = {}
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self._index_file_path, "r", encoding="utf-8") as file:
+                self._index = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self._index = {}
+
+        # Backups deleted by hand are forgotten.
+        self._index = {
+            backup_file_name: md5
+            for backup_file_name, md5 in self._index.items()
+            if os.path.exists(self.get_backup_file_path(backup_file_name))}
+
+    def save(self):
+        os.makedirs(self._directory_path, exist_ok=True)
+
+        temp_file_path = self._index_file_path + '.tmp'
+        with open(temp_file_path, "w", encoding="utf-8") as file:
+            json.dump(self._index, file)
+        os.replace(temp_file_path, self._index_file_path)
+
+    def get_directory_path(self):
+        return self._directory_path
+
+    def get_backup_file_path(self, backup_file_name):
+        return os.path.join(self._directory_path, backup_file_name)
+
+    def get_backup_file_names(self):
+        with self._lock:
+            return list(self._index)
+
+    def find_backup_file_name(self, md5):
+        for backup_file_name, backup_md5 in self._index.items():
+            if backup_md5 == md5:
+                return backup_file_name
+
+        return None
+
+    def add(self, file_path, md5, backup_file_name,
+            backup_style=BACKUPSTYLE_TIME):
+        # Returns how the backup was stored, or None when backups are off.
+        if backup_style == BACKUPSTYLE_NOBACKUP:
+            return None
+
+        with self._lock:
+            backup_file_path = self.get_backup_file_path(backup_file_name)
+            # Backups of files in subfolders keep their relative path.
+            os.makedirs(os.path.dirname(backup_file_path), exist_ok=True)
+
+            method = None
+            # Identical content is stored once; later backups of it are hard
+            # links to the same data.
+            existing_file_name = self.find_backup_file_name(md5)
+            if existing_file_name is not None:
+                try:
+                    os.link(self.get_backup_file_path(existing_file_name),
+                            backup_file_path)
+                    method = COPY_METHOD_LINK
+                except OSError:
+                    pass
+
+            if method is None:
+                method = copy_file(file_path, backup_file_path)
+
+            self._index[backup_file_name] = md5
+            self.prune(parse_backup_file_name(backup_file_name)[0],
+                       backup_style)
+            self.save()
+
+        return method
+
+    def prune(self, file_name, backup_style):
+        # Worlds in one directory may use different backup styles, so only
+        # the backups of file_name are considered.
+        backup_file_names = [
+            backup_file_name for backup_file_name in self._index
+            if parse_backup_file_name(backup_file_name)[0] == file_name]
+
+        for backup_file_name in get_expired_backups(
+                backup_file_names, backup_style):
+            try:
+                os.remove(self.get_backup_file_path(backup_file_name))
+            except FileNotFoundError:
+                pass
+
+            del self._index[backup_file_name]
+
+
+# Every updater of a directory must use the same store, or their indexes
+# would overwrite each other.
+backup_stores = {}
+backup_stores_lock = threading.Lock()
+
+
+def get_local_backup_store(directory_path):
+    key = os.path.abspath(directory_path)
+
+    with backup_stores_lock:
+        backup_store = backup_stores.get(key)
+        if backup_store is None:
+            backup_store = LocalBackupStore(directory_path)
+            backup_stores[key] = backup_store
+
+    return backup_store
@@ -0,0 +1,186 @@
+import datetime
+import os
+
+from HashCache import get_file_signature
+from LocalBackupStore import copy_file
+from RemoteManifest import RemoteManifest
+from TransferStrategy import TEMP_FILE_SUFFIX, get_content_md5
+from SyncMetrics import PHASE_LISTING, COUNTER_BYTES_UPLOADED, \
+    COUNTER_BYTES_DOWNLOADED, metric_span, count_metric
+
+STORAGE_LOCAL = 'local'
+
+
+def get_modified_time(stat):
+    # The RFC 3339 form Drive uses, so that string order is time order.
+    return datetime.datetime.fromtimestamp(
+        stat.st_mtime, datetime.timezone.utc).strftime(
+            '%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+# Keeps the saves in a directory, such as a NAS share or a second disk. The
+# updater's Drive folder id is the path of the directory, and a file's id is
+# its path relative to the updater's folder in it, like its name.
+#
+# Files are stored as plain copies whatever the transfer mode, moved with
+# the kernel-side copies of LocalBackupStore, and content the directory
+# already holds is hard linked instead of copied.
+class LocalStorageBackend():
+    storage_name = STORAGE_LOCAL
+
+    def get_folder_path(self, updater):
+        # An unmounted share must not be silently replaced by an empty
+        # directory on the local disk.
+        if not os.path.isdir(updater._drive_folder_id):
+            raise FileNotFoundError("Storage folder {} does not exist".format(
+                updater._drive_folder_id))
+
+        return updater.get_remote_folder_path()
+
+    def get_file_path(self, updater, file_id):
+        return os.path.join(
+            self.get_folder_path(updater), *file_id.split('/'))
+
+    def prepare(self, updater):
+        self.get_folder_path(updater)
+
+    def list_files(self, updater):
+        folder_path = self.get_folder_path(updater)
+        remote_manifest = RemoteManifest()
+
+        with metric_span(PHASE_LISTING):
+            for directory_path, directory_names, names in \
+                    os.walk(folder_path):
+                relative_path = os.path.relpath(directory_path, folder_path)
+
+                for name in names:
+                    if name.endswith(TEMP_FILE_SUFFIX):
+                        continue
+
+                    file_name = name if relative_path == os.curdir else \
+                        relative_path.replace(os.sep, '/') + '/' + name
+                    file_path = os.path.join(directory_path, name)
+
+                    try:
+                        stat = os.stat(file_path)
+                        md5 = updater._hash_cache.get_md5_string(file_path)
+                    except FileNotFoundError:
+                        continue
+
+                    remote_manifest.add({
+                        'id': file_name,
+                        'name': file_name,
+                        'md5Checksum': md5,
+                        'size': str(stat.st_size),
+                        'modifiedTime': get_modified_time(stat)
+                    })
+
+        return remote_manifest
+
+    def copy_checked(self, updater, source_path, target_path, md5):
+        # The hash cache only knows the content of a file as of its last
+        # stat, so the source must not change while it is copied.
+        signature = get_file_signature(source_path)
+        copy_file(source_path, target_path, TEMP_FILE_SUFFIX)
+        if get_file_signature(source_path) != signature:
+            os.remove(target_path)
+            raise IOError("{} changed while it was copied".format(
+                source_path))
+
+        updater._hash_cache.set_md5_string(target_path, md5)
+
+        size = signature[0]
+        updater.get_sync_progress().add_total_bytes(size)
+        updater.get_sync_progress().advance(size)
+
+        return size
+
+    def fetch_file(self, updater, file_info, file_path):
+        source_path = self.get_file_path(updater, file_info['id'])
+        md5 = get_content_md5(file_info)
+        if updater._hash_cache.get_md5_string(source_path) != md5:
+            raise IOError("{} changed since it was listed".format(
+                source_path))
+
+        # Always a copy: games write their saves in place, which would
+        # change the stored file through a hard link.
+        size = self.copy_checked(updater, source_path, file_path, md5)
+        count_metric(COUNTER_BYTES_DOWNLOADED, size)
+
+    def put_file(self, updater, local_file_info, file_info):
+        target_path = self.get_file_path(updater, local_file_info['name'])
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        size = self.copy_checked(
+            updater, local_file_info['path'], target_path,
+            local_file_info['md5'])
+        count_metric(COUNTER_BYTES_UPLOADED, size)
+
+    def copy_file(self, updater, source_file_info, file_name, file_info):
+        # Stored files are never written in place, so the same content can
+        # be shared by several names.
+        source_path = self.get_file_path(updater, source_file_info['id'])
+        target_path = self.get_file_path(updater, file_name)
+        temp_file_path = target_path + TEMP_FILE_SUFFIX
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+        try:
+            os.link(source_path, temp_file_path)
+        except FileNotFoundError:
+            # The manifest is out of date and the file is gone.
+            return False
+        except OSError:
+            # File systems without hard links get a copy.
+            try:
+                copy_file(source_path, target_path, TEMP_FILE_SUFFIX)
+            except FileNotFoundError:
+                return False
+        else:
+            os.replace(temp_file_path, target_path)
+
+        updater._hash_cache.set_md5_string(
+            target_path, get_content_md5(source_file_info))
+
+        return True
+
+    def rename_files(self, updater, renames):
+        errors = {}
+
+        for file_info, name in renames:
+            source_path = self.get_file_path(updater, file_info['id'])
+            target_path = self.get_file_path(updater, name)
+
+            try:
+                # Answered from the cache, which the listing just filled.
+                md5 = updater._hash_cache.get_md5_string(source_path)
+                os.replace(source_path, target_path)
+            except OSError as exception:
+                errors[file_info['id']] = exception
+                continue
+
+            # The backup keeps its content, so the next listing need not
+            # read it again.
+            updater._hash_cache.set_md5_string(target_path, md5)
+            updater._hash_cache.invalidate(source_path)
+
+        return errors
+
+    def get_renamed_file_info(self, file_info, name):
+        return dict(file_info, id=name, name=name)
+
+    def trash_files(self, updater, file_infos):
+        # A directory has no trash; expired backups are deleted.
+        errors = {}
+
+        for file_info in file_infos:
+            try:
+                os.remove(self.get_file_path(updater, file_info['id']))
+            except FileNotFoundError:
+                pass
+            except OSError as exception:
+                errors[file_info['id']] = exception
+
+        return errors
@@ -0,0 +1,197 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from TransferScheduler import get_failed_outcomes, \
+    get_conflicting_outcomes, get_queued_outcomes, is_cancelled
+
+# Worlds are synced side by side; each of them already transfers its files in
+# parallel, so a few at a time keep the connection busy.
+MAX_WORLD_WORKERS = 4
+
+WORLD_STATUS_OK = 'ok'
+WORLD_STATUS_FAILED = 'failed'
+WORLD_STATUS_CANCELLED = 'cancelled'
+WORLD_STATUS_CONFLICT = 'conflict'
+WORLD_STATUS_QUEUED = 'queued'
+
+
+def get_world_status(report):
+    if is_cancelled(report):
+        return WORLD_STATUS_CANCELLED
+    if len(get_failed_outcomes(report)) > 0:
+        return WORLD_STATUS_FAILED
+    if len(get_conflicting_outcomes(report)) > 0:
+        return WORLD_STATUS_CONFLICT
+    if len(get_queued_outcomes(report)) > 0:
+        return WORLD_STATUS_QUEUED
+
+    return WORLD_STATUS_OK
+
+
+def get_outcome_counts(report):
+    counts = {}
+    for outcome in report:
+        counts[outcome['status']] = counts.get(outcome['status'], 0) + 1
+
+    return counts
+
+
+class MultiWorldSync():
+    def __init__(self, save_file_updaters, max_workers=MAX_WORLD_WORKERS):
+        # save_file_updaters is a list of (world name, updater) pairs.
+        self._save_file_updaters = list(save_file_updaters)
+        # Kept for every sync, like the pools of the updaters.
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # The first updater of each folder owns its remote manifest; every
+        # other updater of the same Google account shares its Drive client
+        # and state with it. Worlds synced as directory trees have a manifest
+        # of their own, and worlds of other accounts only share the state
+        # files.
+        self._manifest_owners = {}
+        first_updater = None
+        account_owners = {}
+
+        for _, save_file_updater in self._save_file_updaters:
+            credentials_key = save_file_updater.get_credentials_key()
+            manifest_key = self.get_manifest_key(save_file_updater)
+            owner = self._manifest_owners.get(
+                manifest_key, account_owners.get(credentials_key))
+
+            if owner is not None:
+                save_file_updater.share_state_with(owner)
+            elif first_updater is not None:
+                save_file_updater.share_local_state_with(first_updater)
+
+            if first_updater is None:
+                first_updater = save_file_updater
+            account_owners.setdefault(credentials_key, save_file_updater)
+            self._manifest_owners.setdefault(manifest_key, save_file_updater)
+
+    def __len__(self):
+        return len(self._save_file_updaters)
+
+    def get_save_file_updaters(self):
+        return list(self._save_file_updaters)
+
+    def get_manifest_key(self, save_file_updater):
+        # The same folder id seen through another account is listed apart.
+        return (save_file_updater.get_credentials_key(),
+                save_file_updater.get_manifest_key())
+
+    def set_interactive_authorization(self, interactive_authorization):
+        for _, save_file_updater in self._save_file_updaters:
+            save_file_updater.set_interactive_authorization(
+                interactive_authorization)
+
+    def prepare_storage(self):
+        # Signs in to every account and storage up front. Errors other than
+        # a missing authorization are left for the sync to report, as a
+        # Drive that cannot be reached still lets the saves be queued.
+        from DriveService import AuthorizationRequiredError
+
+        for _, save_file_updater in self._save_file_updaters:
+            for updater in [save_file_updater] + [
+                    replica for _, replica
+                    in save_file_updater.get_replicas()]:
+                try:
+                    updater.prepare_storage()
+                except AuthorizationRequiredError:
+                    raise
+                except Exception:
+                    pass
+
+    def close(self):
+        self._executor.shutdown()
+
+        for _, save_file_updater in self._save_file_updaters:
+            save_file_updater.close()
+
+    def get_remote_manifest(self, manifest_key):
+        # A folder that cannot be listed only fails the worlds in it.
+        try:
+            return self._manifest_owners[manifest_key].get_remote_manifest()
+        except Exception as exception:
+            return exception
+
+    def get_remote_manifests(self):
+        # One listing per folder, however many worlds live in it.
+        manifest_keys = list(self._manifest_owners)
+
+        return dict(zip(
+            manifest_keys,
+            self._executor.map(self.get_remote_manifest, manifest_keys)))
+
+    def run(self, sync, on_manifest_error=None):
+        # sync(updater, remote_manifest) returns the report of one world.
+        # on_manifest_error(updater, exception), if given, returns it instead
+        # when the folder could not be listed. Returns one summary per world,
+        # in configuration order.
+        if len(self._save_file_updaters) == 0:
+            return []
+
+        remote_manifests = self.get_remote_manifests()
+
+        def run_world(world):
+            world_name, save_file_updater = world
+            remote_manifest = \
+                remote_manifests[self.get_manifest_key(save_file_updater)]
+
+            start = time.perf_counter()
+            try:
+                if isinstance(remote_manifest, Exception):
+                    if on_manifest_error is None:
+                        raise remote_manifest
+                    report = on_manifest_error(
+                        save_file_updater, remote_manifest)
+                else:
+                    report = sync(save_file_updater, remote_manifest)
+                status = get_world_status(report)
+                error = None
+            except Exception as exception:
+                report = []
+                status = WORLD_STATUS_FAILED
+                error = exception
+
+            return {
+                'name': world_name,
+                'status': status,
+                'error': error,
+                'counts': get_outcome_counts(report),
+                'report': report,
+                'elapsed': time.perf_counter() - start
+            }
+
+        return list(self._executor.map(run_world, self._save_file_updaters))
+
+    def update_local(self):
+        return self.run(
+            lambda save_file_updater, remote_manifest:
+                save_file_updater.update_local(remote_manifest))
+
+    def update_drive(self):
+        # Worlds whose folder cannot be reached are queued for later; their
+        # replicas are still pushed to.
+        return self.run(
+            lambda save_file_updater, remote_manifest:
+                save_file_updater.update_drive(remote_manifest),
+            lambda save_file_updater, exception:
+                save_file_updater.update_drive(manifest_error=exception))
+
+    def sync(self):
+        return self.run(
+            lambda save_file_updater, remote_manifest:
+                save_file_updater.sync(remote_manifest))
+
+    def get_sync_status(self):
+        return self.run(
+            lambda save_file_updater, remote_manifest:
+                save_file_updater.get_sync_status(remote_manifest))
+
+    def start_draining_upload_queues(self):
+        for _, save_file_updater in self._save_file_updaters:
+            save_file_updater.start_draining_upload_queue()
+
+    def wait_for_pruning(self):
+        for _, save_file_updater in self._save_file_updaters:
+            save_file_updater.wait_for_pruning()
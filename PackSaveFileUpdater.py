@@ -0,0 +1,156 @@
+import os
+
+from SaveFileUpdater import SaveFileUpdater, get_backup_file_name
+from PackTransfer import PackTransfer, PACK_FILE_EXTENSION, get_pack_md5
+from TransferStrategy import TEMP_FILE_SUFFIX, get_content_md5
+from StorageBackend import STORAGE_DRIVE
+from TransferScheduler import OUTCOME_UNCHANGED, OUTCOME_DOWNLOADED, \
+    OUTCOME_SKIPPED
+from SyncMetrics import PHASE_HASHING, PHASE_BACKUP, PHASE_TRANSFER, \
+    metric_span
+
+
+# Syncs a save made of many small files as one pack on Drive, named after
+# the world. Pushing uploads the whole pack in one request; pulling writes
+# only the members that differ from the local files.
+class PackSaveFileUpdater(SaveFileUpdater):
+    # Extensions of the files that belong to the save, or None for every
+    # file in the directory.
+    member_extensions = None
+
+    def __init__(self,
+                 client_secret_file_name,
+                 drive_folder_id,
+                 local_directory_path,
+                 world_name,
+                 drive_service=None):
+        super().__init__(
+            client_secret_file_name,
+            drive_folder_id,
+            local_directory_path,
+            drive_service)
+
+        self._world_name = world_name
+
+        self._file_names = [
+            self._world_name + PACK_FILE_EXTENSION
+        ]
+
+        self._transfer_strategy = PackTransfer()
+
+    def set_transfer_strategy(self, transfer_strategy):
+        # The pack is the transfer format; the configured mode does not apply.
+        pass
+
+    def set_storage_backend(self, storage_backend):
+        # Members are read from the pack with ranged Drive requests.
+        if storage_backend.storage_name != STORAGE_DRIVE:
+            raise ValueError("Packed saves can only be stored on Google Drive")
+
+        super().set_storage_backend(storage_backend)
+
+    def is_member(self, name):
+        if name.endswith(TEMP_FILE_SUFFIX):
+            return False
+        if self.member_extensions is None:
+            return True
+
+        return os.path.splitext(name)[1].lower() in self.member_extensions
+
+    def get_member_names(self):
+        try:
+            entries = list(os.scandir(self._local_directory_path))
+        except FileNotFoundError:
+            return []
+
+        return sorted(entry.name for entry in entries
+                      if entry.is_file() and self.is_member(entry.name))
+
+    def get_member_infos(self):
+        member_infos = []
+
+        for name in self.get_member_names():
+            file_path = self._local_directory_path + name
+
+            try:
+                size = os.path.getsize(file_path)
+                with metric_span(PHASE_HASHING):
+                    md5 = self._hash_cache.get_md5_string(file_path)
+            except FileNotFoundError:
+                continue
+
+            member_infos.append({
+                'name': name,
+                'path': file_path,
+                'md5': md5,
+                'size': size
+            })
+
+        return member_infos
+
+    def get_local_file_info(self, file_name):
+        member_infos = self.get_member_infos()
+
+        return {
+            'name': file_name,
+            'path': self._local_directory_path,
+            'md5': get_pack_md5(member_infos) if len(member_infos) > 0
+            else "",
+            'members': member_infos
+        }
+
+    def get_local_file_paths(self):
+        return [self._local_directory_path + name
+                for name in self.get_member_names()]
+
+    def matches_remote_file(self, file_name, drive_file_info):
+        # Members the pack does not have are left alone by a pull, so the
+        # save can still differ from the pack afterwards.
+        return self.get_local_file_info(file_name)['md5'] == \
+            get_content_md5(drive_file_info)
+
+    def update_local_file(self, file_name, remote_manifest, current_time):
+        self.get_sync_progress().check_cancelled()
+
+        drive_file_info = remote_manifest.get(file_name)
+        if drive_file_info is None:
+            return OUTCOME_SKIPPED
+
+        local_file_info = self.get_local_file_info(file_name)
+        if local_file_info['md5'] == get_content_md5(drive_file_info):
+            return OUTCOME_UNCHANGED
+
+        transfer_strategy = self.get_transfer_strategy(drive_file_info)
+        with metric_span(PHASE_TRANSFER):
+            index, index_size, data = transfer_strategy.read_index(
+                self, drive_file_info)
+        changed_members = transfer_strategy.get_changed_members(
+            index, local_file_info['members'])
+        # The local save only has members the pack does not.
+        if len(changed_members) == 0:
+            return OUTCOME_UNCHANGED
+
+        # Only the members about to be replaced are backed up.
+        changed_names = set(member['name'] for member in changed_members)
+        with metric_span(PHASE_BACKUP):
+            for member_info in local_file_info['members']:
+                if member_info['name'] in changed_names:
+                    self._backup_store.add(
+                        member_info['path'], member_info['md5'],
+                        get_backup_file_name(
+                            member_info['name'], current_time),
+                        self._backup_style)
+
+        with metric_span(PHASE_TRANSFER):
+            transfer_strategy.extract_members(
+                self, drive_file_info, index_size, changed_members,
+                self._local_directory_path, data)
+
+        return OUTCOME_DOWNLOADED
+
+
+class DiabloIISaveFileUpdater(PackSaveFileUpdater):
+    # Characters, their maps and key bindings, and the stash files of
+    # Resurrected and PlugY.
+    member_extensions = ('.d2s', '.d2x', '.d2i', '.key', '.ma0', '.ma1',
+                         '.ma2', '.ma3', '.map', '.sss')
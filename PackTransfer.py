@@ -0,0 +1,228 @@
+import hashlib
+import io
+import json
+import posixpath
+import tempfile
+
+from HashCache import HASH_CHUNK_SIZE
+from SyncMetrics import COUNTER_BYTES_DOWNLOADED, count_metric
+from TransferStrategy import FullFileTransfer, TRANSFER_CHUNK_SIZE, \
+    get_app_properties, get_upload_chunk_size, download_media, \
+    upload_media, open_atomic_file, create_upload_request
+
+TRANSFER_FORMAT_PACK = 'pack'
+
+# Appended to the world name to name the pack on Drive.
+PACK_FILE_EXTENSION = '.vdsupack'
+
+# A pack starts with this line and a one line JSON index of its members,
+# followed by the members' contents back to back:
+#
+#   VDSUPACK1
+#   {"members": [{"name": ..., "md5": ..., "size": ..., "offset": ...}, ...]}
+#   <data>
+#
+# Offsets count from the end of the index. The index size is also kept in
+# appProperties, so the index can be fetched without reading the data.
+PACK_MAGIC = b'VDSUPACK1\n'
+INDEX_SIZE_PROPERTY = 'vdsuIndexSize'
+
+# Packs up to this size are always downloaded with a single request; only
+# bigger ones are worth fetching the index first.
+SMALL_PACK_SIZE = 4 * 1024 * 1024
+
+# Changed members closer than this are fetched with one ranged request,
+# together with the unchanged bytes between them.
+RANGE_MERGE_GAP = 256 * 1024
+
+
+def get_pack_md5(member_infos):
+    # Identifies the content of a pack by its members rather than by its
+    # bytes, so it can be computed from the hash cache alone.
+    md5 = hashlib.md5()
+    for member_info in sorted(member_infos, key=lambda info: info['name']):
+        md5.update('{}\0{}\n'.format(
+            member_info['name'], member_info['md5']).encode())
+
+    return md5.hexdigest()
+
+
+def get_index_size(drive_file_info):
+    app_properties = drive_file_info.get('appProperties') or {}
+    index_size = app_properties.get(INDEX_SIZE_PROPERTY)
+
+    return None if index_size is None else int(index_size)
+
+
+def parse_index(data):
+    if not data.startswith(PACK_MAGIC):
+        raise ValueError("Not a VDSU pack")
+
+    end = data.index(b'\n', len(PACK_MAGIC))
+    return json.loads(data[len(PACK_MAGIC):end]), end + 1
+
+
+def check_member_name(name):
+    # Members are extracted into the save directory and nowhere else.
+    if name in ('', '.', '..') or posixpath.basename(name) != name or \
+            '\\' in name:
+        raise ValueError("Invalid pack member name: {!r}".format(name))
+
+
+def get_member_ranges(members, merge_gap=RANGE_MERGE_GAP):
+    # Groups members into (begin, end, members) ranges of the data section,
+    # with end exclusive.
+    ranges = []
+    for member in sorted(members, key=lambda member: member['offset']):
+        begin = member['offset']
+        end = begin + member['size']
+
+        if len(ranges) > 0 and begin - ranges[-1][1] <= merge_gap:
+            ranges[-1][1] = max(ranges[-1][1], end)
+            ranges[-1][2].append(member)
+        else:
+            ranges.append([begin, end, [member]])
+
+    return ranges
+
+
+def download_range(updater, file_id, begin, end):
+    # end is exclusive; an empty range cannot be requested.
+    if end <= begin:
+        return b''
+
+    request = updater.get_drive_service().files().get_media(fileId=file_id)
+    request.headers['range'] = 'bytes={}-{}'.format(begin, end - 1)
+
+    updater.get_sync_progress().add_total_bytes(end - begin)
+    data = updater.execute_request(request, idempotent=True)
+    updater.get_sync_progress().advance(len(data))
+    count_metric(COUNTER_BYTES_DOWNLOADED, len(data))
+
+    return data
+
+
+# Stores many small files as a single Drive file, so that a sync costs one
+# request however many files the save has. Pulls only extract the members
+# whose MD5 differs from the local copy.
+class PackTransfer(FullFileTransfer):
+    transfer_format = TRANSFER_FORMAT_PACK
+
+    def write_pack(self, member_infos, pack_file):
+        # member_infos are dicts with name, path, md5 and size. Returns the
+        # size of the header and index.
+        members = []
+        offset = 0
+        for member_info in member_infos:
+            members.append({
+                'name': member_info['name'],
+                'md5': member_info['md5'],
+                'size': member_info['size'],
+                'offset': offset
+            })
+            offset += member_info['size']
+
+        index = json.dumps({'members': members}).encode() + b'\n'
+        pack_file.write(PACK_MAGIC)
+        pack_file.write(index)
+
+        # The index is written before the data, so a member the game rewrote
+        # since it was hashed would leave the pack inconsistent.
+        for member_info in member_infos:
+            md5 = hashlib.md5()
+            with open(member_info['path'], "rb") as file:
+                for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                    md5.update(chunk)
+                    pack_file.write(chunk)
+
+            if md5.hexdigest() != member_info['md5']:
+                raise IOError(
+                    "{} changed while it was packed".format(
+                        member_info['path']))
+
+        return len(PACK_MAGIC) + len(index)
+
+    def upload(self, updater, metadata, directory_path, md5):
+        from googleapiclient.http import MediaIoBaseUpload
+
+        member_infos = updater.get_member_infos()
+
+        with tempfile.TemporaryFile() as pack_file:
+            index_size = self.write_pack(member_infos, pack_file)
+            pack_size = pack_file.tell()
+            pack_file.seek(0)
+
+            # Small packs go up as one multipart request.
+            media = MediaIoBaseUpload(
+                pack_file,
+                mimetype='application/octet-stream',
+                chunksize=get_upload_chunk_size(updater),
+                resumable=pack_size > TRANSFER_CHUNK_SIZE)
+            body = dict(metadata)
+            body['appProperties'] = get_app_properties(
+                self.transfer_format, md5)
+            body['appProperties'][INDEX_SIZE_PROPERTY] = str(index_size)
+
+            request = create_upload_request(updater, body, media)
+
+            return upload_media(
+                updater, request, media, idempotent='id' in body)
+
+    def read_index(self, updater, drive_file_info):
+        # Returns the index, the size of the header and index, and the whole
+        # pack if it was small enough to fetch at once.
+        index_size = get_index_size(drive_file_info)
+        size = drive_file_info.get('size')
+
+        if index_size is None or \
+                (size is not None and int(size) <= SMALL_PACK_SIZE):
+            buffer = io.BytesIO()
+            download_media(updater, drive_file_info['id'], buffer)
+            data = buffer.getvalue()
+
+            index, index_size = parse_index(data)
+            return index, index_size, data
+
+        index, _ = parse_index(download_range(
+            updater, drive_file_info['id'], 0, index_size))
+        return index, index_size, None
+
+    def extract_members(self, updater, drive_file_info, index_size, members,
+                        directory_path, data=None):
+        for member in members:
+            check_member_name(member['name'])
+
+        for begin, end, range_members in get_member_ranges(members):
+            if data is not None:
+                range_data = data[index_size + begin:index_size + end]
+            else:
+                range_data = download_range(
+                    updater, drive_file_info['id'],
+                    index_size + begin, index_size + end)
+
+            for member in range_members:
+                updater.get_sync_progress().check_cancelled()
+
+                member_offset = member['offset'] - begin
+                file_path = directory_path + member['name']
+                with open_atomic_file(
+                        file_path, updater._hash_cache) as writer:
+                    writer.write(range_data[
+                        member_offset:member_offset + member['size']])
+                    writer.check_md5(member['md5'], file_path)
+
+    def get_changed_members(self, index, member_infos):
+        local_md5s = {member_info['name']: member_info['md5']
+                      for member_info in member_infos}
+
+        return [member for member in index['members']
+                if local_md5s.get(member['name']) != member['md5']]
+
+    def download(self, updater, drive_file_info, directory_path):
+        index, index_size, data = self.read_index(updater, drive_file_info)
+        self.extract_members(
+            updater, drive_file_info, index_size,
+            self.get_changed_members(index, updater.get_member_infos()),
+            directory_path, data)
+
+        return directory_path
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+
+from DriveRequest import execute_request
+from RemoteManifest import RemoteManifest, DRIVE_FILE_FIELDS, \
+    DRIVE_LIST_PAGE_SIZE, list_drive_folder
+
+REMOTE_STATE_FILE_NAME = 'remote_state.json'
+
+CHANGE_FILE_FIELDS = DRIVE_FILE_FIELDS + ', parents, trashed'
+
+# Drive answers an expired or unknown page token with one of these.
+INVALID_PAGE_TOKEN_STATUSES = (400, 404, 410)
+
+# Trackers of different folders share one state file.
+state_file_lock = threading.Lock()
+
+
+def get_manifest_entry(file):
+    entry = dict(file)
+    entry.pop('parents', None)
+    entry.pop('trashed', None)
+
+    return entry
+
+
+class RemoteChangeTracker():
+    change_file_fields = CHANGE_FILE_FIELDS
+
+    def __init__(self,
+                 drive_service,
+                 drive_folder_id,
+                 state_file_path=REMOTE_STATE_FILE_NAME,
+                 request_executor=None):
+        self._drive_service = drive_service
+        self._request_executor = request_executor
+        self._drive_folder_id = drive_folder_id
+        self._state_file_path = state_file_path
+
+        self._start_page_token = None
+        self._manifest = None
+        self._lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self._state_file_path, "r", encoding="utf-8") as file:
+                states = json.load(file)
+        except (FileNotFoundError, ValueError):
+            states = {}
+
+        state = states.get(self._drive_folder_id)
+        if state is not None:
+            self.set_state(state)
+
+    def get_state(self):
+        return {
+            'start_page_token': self._start_page_token,
+            'files': self._manifest.entries()
+        }
+
+    def set_state(self, state):
+        self._start_page_token = state['start_page_token']
+        self._manifest = RemoteManifest(state['files'])
+
+    def save(self):
+        with state_file_lock:
+            self.write_state()
+
+    def write_state(self):
+        try:
+            with open(self._state_file_path, "r", encoding="utf-8") as file:
+                states = json.load(file)
+        except (FileNotFoundError, ValueError):
+            states = {}
+
+        states[self._drive_folder_id] = self.get_state()
+
+        temp_file_path = self._state_file_path + '.tmp'
+        with open(temp_file_path, "w", encoding="utf-8") as file:
+            json.dump(states, file)
+        os.replace(temp_file_path, self._state_file_path)
+
+    def get_remote_manifest(self):
+        with self._lock:
+            return self.update_manifest()
+
+    def update_manifest(self):
+        from googleapiclient.errors import HttpError
+
+        if self._start_page_token is None or self._manifest is None:
+            self.refresh()
+            return self._manifest
+
+        try:
+            self.apply_changes()
+        except HttpError as error:
+            if error.resp.status not in INVALID_PAGE_TOKEN_STATUSES:
+                raise
+
+            self.refresh()
+
+        return self._manifest
+
+    def refresh(self):
+        # The token is taken before listing so that nothing modified while
+        # the folder is being listed is missed on the next sync.
+        start_page_token = execute_request(
+            self._drive_service.changes().getStartPageToken(),
+            self._request_executor, idempotent=True)['startPageToken']
+
+        self.list_files()
+        self._start_page_token = start_page_token
+
+        self.save()
+
+    def list_files(self):
+        self._manifest = RemoteManifest(list_drive_folder(
+            self._drive_service, self._drive_folder_id,
+            request_executor=self._request_executor))
+
+    def apply_changes(self):
+        fields = 'nextPageToken, newStartPageToken, ' \
+            'changes(fileId, removed, file({}))'.format(
+                self.change_file_fields)
+
+        start_page_token = self._start_page_token
+        page_token = start_page_token
+        changed = False
+
+        while page_token is not None:
+            results = execute_request(self._drive_service.changes().list(
+                pageToken=page_token,
+                pageSize=DRIVE_LIST_PAGE_SIZE,
+                spaces='drive',
+                fields=fields), self._request_executor, idempotent=True)
+
+            for change in results.get('changes', []):
+                self.apply_change(change)
+                changed = True
+
+            if 'newStartPageToken' in results:
+                self._start_page_token = results['newStartPageToken']
+
+            page_token = results.get('nextPageToken')
+
+        if changed or self._start_page_token != start_page_token:
+            self.save()
+
+    def apply_change(self, change):
+        file = change.get('file')
+
+        if change.get('removed') or file is None or file.get('trashed') or \
+                self._drive_folder_id not in file.get('parents', []):
+            # Deleted, trashed or moved out of the folder.
+            self._manifest.remove(change['fileId'])
+            return
+
+        self._manifest.add(get_manifest_entry(file))
@@ -0,0 +1,137 @@
+import threading
+
+from DriveRequest import execute_request
+from TransferStrategy import get_content_md5
+
+# Drive caps pageSize at 1000 for files().list.
+DRIVE_LIST_PAGE_SIZE = 1000
+
+DRIVE_FILE_FIELDS = \
+    'id, name, md5Checksum, size, modifiedTime, appProperties'
+
+
+def list_drive_folder(drive_service, folder_id, file_fields=DRIVE_FILE_FIELDS,
+                      request_executor=None):
+    return list_drive_folders(
+        drive_service, [folder_id], file_fields, request_executor)
+
+
+def list_drive_folders(drive_service, folder_ids,
+                       file_fields=DRIVE_FILE_FIELDS, request_executor=None):
+    # Lists the children of several folders with a single query.
+    q = "({}) and trashed = false".format(" or ".join(
+        "'{}' in parents".format(folder_id) for folder_id in folder_ids))
+
+    return list_drive_files(drive_service, q, file_fields, request_executor)
+
+
+def list_drive_files(drive_service, q, file_fields=DRIVE_FILE_FIELDS,
+                     request_executor=None):
+    fields = 'nextPageToken, files({})'.format(file_fields)
+
+    files = []
+    page_token = None
+
+    while True:
+        results = execute_request(drive_service.files().list(
+            q=q,
+            fields=fields,
+            pageSize=DRIVE_LIST_PAGE_SIZE,
+            pageToken=page_token), request_executor, idempotent=True)
+
+        files.extend(results.get('files', []))
+
+        page_token = results.get('nextPageToken')
+        if page_token is None:
+            break
+
+    return files
+
+
+def is_newer(entry, other_entry):
+    # modifiedTime is RFC 3339 in UTC, so string order is time order.
+    return entry.get('modifiedTime', '') > other_entry.get('modifiedTime', '')
+
+
+class RemoteManifest():
+    def __init__(self, entries=()):
+        self._entries = {}
+        self._ids_by_name = {}
+        # Backups count too, so a save rolled back to an older version can be
+        # found by its content.
+        self._ids_by_md5 = {}
+        # Worlds sharing a folder update one manifest from several threads.
+        self._lock = threading.RLock()
+
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file_name):
+        return file_name in self._ids_by_name
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def get(self, file_name):
+        with self._lock:
+            file_id = self._ids_by_name.get(file_name)
+            if file_id is None:
+                return None
+
+            return self._entries[file_id]
+
+    def get_by_id(self, file_id):
+        return self._entries.get(file_id)
+
+    def get_by_md5(self, md5):
+        with self._lock:
+            file_ids = self._ids_by_md5.get(md5)
+            if not file_ids:
+                return None
+
+            return self._entries[next(iter(file_ids))]
+
+    def add(self, entry):
+        with self._lock:
+            self.remove(entry['id'])
+            self._entries[entry['id']] = entry
+
+            # Drive allows several files with the same name in one folder;
+            # the most recently modified one is treated as the live save.
+            current = self.get(entry['name'])
+            if current is None or is_newer(entry, current):
+                self._ids_by_name[entry['name']] = entry['id']
+
+            md5 = get_content_md5(entry)
+            if md5 is not None:
+                self._ids_by_md5.setdefault(md5, set()).add(entry['id'])
+
+    def remove(self, file_id):
+        with self._lock:
+            entry = self._entries.pop(file_id, None)
+            if entry is None:
+                return None
+
+            md5 = get_content_md5(entry)
+            if md5 in self._ids_by_md5:
+                self._ids_by_md5[md5].discard(file_id)
+                if len(self._ids_by_md5[md5]) == 0:
+                    del self._ids_by_md5[md5]
+
+            file_name = entry['name']
+            if self._ids_by_name.get(file_name) == file_id:
+                del self._ids_by_name[file_name]
+
+                for other_entry in self._entries.values():
+                    if other_entry['name'] != file_name:
+                        continue
+
+                    current = self.get(file_name)
+                    if current is None or is_newer(other_entry, current):
+                        self._ids_by_name[file_name] = other_entry['id']
+
+            return entry
@@ -0,0 +1,156 @@
+import posixpath
+
+from RemoteManifest import RemoteManifest, DRIVE_FILE_FIELDS, \
+    list_drive_folders
+from RemoteChangeTracker import RemoteChangeTracker, get_manifest_entry
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+TREE_FILE_FIELDS = DRIVE_FILE_FIELDS + ', mimeType, parents'
+
+# Folders whose children are listed with one query while the tree is first
+# built. Drive rejects very long queries.
+FOLDER_QUERY_SIZE = 50
+
+
+def is_folder(file):
+    return file.get('mimeType') == FOLDER_MIME_TYPE
+
+
+# Tracks a whole directory tree on Drive. Files are keyed by their path
+# relative to the root folder, e.g. "region/r.0.0.mca", and only the first
+# sync walks the tree; later syncs read the Changes API like
+# RemoteChangeTracker does.
+class RemoteTreeTracker(RemoteChangeTracker):
+    change_file_fields = TREE_FILE_FIELDS + ', trashed'
+
+    def __init__(self, *args, **kwargs):
+        # Folder id -> path, with the root folder at ''.
+        self._folder_paths = {}
+        self._folder_ids = {}
+        # Changed files whose folder has not been seen yet. The Changes API
+        # lists a folder after its files if it was modified after them.
+        self._unresolved_files = {}
+
+        super().__init__(*args, **kwargs)
+
+        if self._drive_folder_id not in self._folder_paths:
+            self.set_folder_paths({})
+
+    def get_state(self):
+        state = super().get_state()
+        state['folders'] = self._folder_paths
+
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.set_folder_paths(state.get('folders', {}))
+
+    def set_folder_paths(self, folder_paths):
+        self._folder_paths = dict(folder_paths)
+        self._folder_paths[self._drive_folder_id] = ''
+        self._folder_ids = {
+            path: folder_id for folder_id, path in self._folder_paths.items()}
+
+    def get_folder_id(self, path):
+        with self._lock:
+            return self._folder_ids.get(path)
+
+    def add_folder(self, folder_id, path):
+        with self._lock:
+            self._folder_paths[folder_id] = path
+            self._folder_ids[path] = folder_id
+
+    def get_path(self, file):
+        for parent in file.get('parents', []):
+            parent_path = self._folder_paths.get(parent)
+            if parent_path is not None:
+                return posixpath.join(parent_path, file['name'])
+
+        return None
+
+    def list_files(self):
+        self.set_folder_paths({})
+        manifest = RemoteManifest()
+
+        pending_folder_ids = [self._drive_folder_id]
+        while len(pending_folder_ids) > 0:
+            folder_ids = pending_folder_ids[:FOLDER_QUERY_SIZE]
+            pending_folder_ids = pending_folder_ids[FOLDER_QUERY_SIZE:]
+
+            for file in list_drive_folders(
+                    self._drive_service, folder_ids, TREE_FILE_FIELDS,
+                    self._request_executor):
+                path = self.get_path(file)
+
+                if is_folder(file):
+                    self._folder_paths[file['id']] = path
+                    self._folder_ids[path] = file['id']
+                    pending_folder_ids.append(file['id'])
+                else:
+                    manifest.add(get_manifest_entry(dict(file, name=path)))
+
+        self._manifest = manifest
+
+    def apply_change(self, change):
+        file = change.get('file')
+        file_id = change['fileId']
+
+        path = None
+        if not change.get('removed') and file is not None and \
+                not file.get('trashed'):
+            path = self.get_path(file)
+
+        if file_id in self._folder_paths or \
+                (file is not None and is_folder(file)):
+            self.apply_folder_change(file_id, path)
+            return
+
+        self._unresolved_files.pop(file_id, None)
+
+        if path is None:
+            # Deleted, trashed or moved out of the tree.
+            self._manifest.remove(file_id)
+
+            if file is not None and not change.get('removed') and \
+                    not file.get('trashed'):
+                self._unresolved_files[file_id] = file
+            return
+
+        self._manifest.add(get_manifest_entry(dict(file, name=path)))
+
+    def apply_folder_change(self, folder_id, path):
+        old_path = self._folder_paths.get(folder_id)
+        if old_path == path or folder_id == self._drive_folder_id:
+            return
+
+        # A folder was added, removed, renamed or moved; everything below it
+        # follows.
+        folder_paths = {}
+        for other_folder_id, other_path in self._folder_paths.items():
+            if old_path is not None and (
+                    other_path == old_path or
+                    other_path.startswith(old_path + '/')):
+                if path is None:
+                    continue
+                other_path = path + other_path[len(old_path):]
+            folder_paths[other_folder_id] = other_path
+
+        if old_path is None and path is not None:
+            folder_paths[folder_id] = path
+
+        for entry in self._manifest.entries():
+            if old_path is None or not entry['name'].startswith(old_path + '/'):
+                continue
+
+            self._manifest.remove(entry['id'])
+            if path is not None:
+                self._manifest.add(
+                    dict(entry, name=path + entry['name'][len(old_path):]))
+
+        self.set_folder_paths(folder_paths)
+
+        for file in list(self._unresolved_files.values()):
+            if self.get_path(file) is not None:
+                self.apply_change({'fileId': file['id'], 'file': file})
@@ -1,46 +1,61 @@
-import pickle
+import contextlib
+import functools
+import mimetypes
 import os.path
+import threading
 from abc import abstractmethod
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport import requests
 
-import datetime
 import re
-import hashlib
-import io
-import shutil
 
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/drive']
-
-
-def load_credentials(client_secret_file_name):
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.token or not creds.valid or creds.expired:
-        flow = InstalledAppFlow.from_client_secrets_file(
-            client_secret_file_name, SCOPES)
-        creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-
-    return creds
-
-
-def get_google_drive_v3_service(client_secret_file_name):
-    creds = load_credentials(client_secret_file_name)
-    service = build('drive', 'v3', credentials=creds)
-
-    return service
+from HashCache import HashCache
+from RemoteManifest import RemoteManifest
+from RemoteChangeTracker import RemoteChangeTracker
+from TransferStrategy import FullFileTransfer, TRANSFER_FORMAT_FULL, \
+    get_upload_chunk_size, get_transfer_format, get_content_md5, \
+    download_media, upload_media, resume_upload, open_atomic_file, \
+    create_upload_request
+from DeltaTransfer import DeltaTransfer, TRANSFER_FORMAT_DELTA
+from CompressedTransfer import ZstdTransfer, GzipTransfer, \
+    TRANSFER_FORMAT_ZSTD, TRANSFER_FORMAT_GZIP
+from TransferScheduler import TransferScheduler, OUTCOME_UNCHANGED, \
+    OUTCOME_UPLOADED, OUTCOME_COPIED, OUTCOME_DOWNLOADED, OUTCOME_SKIPPED, \
+    OUTCOME_FAILED, OUTCOME_CONFLICT, OUTCOME_QUEUED, get_outcome
+from DriveRequest import DriveRequestExecutor
+from SyncProgress import SyncProgress, get_current_sync_progress, \
+    activate_sync_progress
+from SyncMetrics import SyncMetrics, PHASE_CREDENTIALS, PHASE_HASHING, \
+    PHASE_BACKUP, PHASE_TRANSFER, OPERATION_PUSH, OPERATION_PULL, \
+    OPERATION_SYNC, OPERATION_STATUS, OPERATION_LIST, OPERATION_DRAIN, \
+    get_current_metrics, activate_metrics, metric_span
+from UploadJournal import UploadJournal
+from UploadQueue import UploadQueue, MIN_DRAIN_RETRY_SECONDS, \
+    MAX_DRAIN_RETRY_SECONDS, is_network_error
+from SyncLedger import SyncLedger, DIRECTION_UPLOAD, DIRECTION_DOWNLOAD, \
+    DIRECTION_CONFLICT, get_sync_direction
+from LocalBackupStore import get_local_backup_store, BACKUP_FOLDER_NAME
+from StorageBackend import DriveStorageBackend
+from SharedFileReader import SharedFileReader
+from BackupRetention import BACKUPSTYLE_TIME, BACKUPSTYLE_NOBACKUP, \
+    get_backup_time_string, get_expired_backups, parse_backup_file_name
+
+# Drive answers a resumable session it no longer knows with one of these.
+EXPIRED_SESSION_STATUSES = (404, 410)
+
+STATUS_IN_SYNC = 'in sync'
+STATUS_DIFFERENT = 'different'
+STATUS_LOCAL_CHANGED = 'local changed'
+STATUS_DRIVE_CHANGED = 'drive changed'
+STATUS_CONFLICT = 'conflict'
+STATUS_LOCAL_ONLY = 'local only'
+STATUS_DRIVE_ONLY = 'drive only'
+STATUS_MISSING = 'missing'
+
+TRANSFER_STRATEGIES = {
+    TRANSFER_FORMAT_FULL: FullFileTransfer,
+    TRANSFER_FORMAT_DELTA: DeltaTransfer,
+    TRANSFER_FORMAT_ZSTD: ZstdTransfer,
+    TRANSFER_FORMAT_GZIP: GzipTransfer
+}
 
 
 def seperate_file_path(file_path, new_separator='//'):
@@ -53,56 +68,265 @@ def seperate_file_path(file_path, new_separator='//'):
     return (parent, file_name)
 
 
-def get_backup_file_name(file_name, time_string):
-    tokens = file_name.split('.')
-    tokens.insert(1, time_string)
-
-    if file_name.find('.') == -1:
-        return '{}_{}'.format(*tokens)
-
-    return '{}_{}.{}'.format(*tokens)
-
-
-def create_local_backup_file(file_path, time_string):
-    parent, file_name = seperate_file_path(file_path)
+def records_metrics(operation):
+    # Runs the decorated updater method as one sync operation, or as part of
+    # the one already running.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.record_metrics(operation):
+                return method(self, *args, **kwargs)
 
-    backup_file_name = get_backup_file_name(file_name, time_string)
-    backup_file_path = parent + '//' + backup_file_name
+        return wrapper
 
-    return shutil.copy(file_path, backup_file_path)
+    return decorator
 
 
-def get_md5_string(file_path):
-    with open(file_path, "rb") as file:
-        md5_string = hashlib.md5(file.read()).hexdigest()
+def get_backup_file_name(file_name, time_string):
+    # The time goes before the last extension only, so that names with
+    # several dots, like r.0.0.mca, keep all of them.
+    root, extension = os.path.splitext(file_name)
 
-    return md5_string
+    return '{}_{}{}'.format(root, time_string, extension)
 
 
 class SaveFileUpdater():
+    # Replaced remote saves are renamed to backups. Updaters that overwrite
+    # files in place leave the old versions to Drive's revision history.
+    renames_drive_backups = True
+
     def __init__(self,
                  client_secret_file_name,
                  drive_folder_id,
-                 local_directory_path):
-        self._drive_service = get_google_drive_v3_service(
-            client_secret_file_name)
+                 local_directory_path,
+                 drive_service=None):
+        # The Google client libraries are slow to import and the credentials
+        # may need a refresh, so the Drive service is only built when a sync
+        # first needs it.
+        self._client_secret_file_name = client_secret_file_name
+        self._token_file_name = None
+        self._interactive_authorization = True
+        self._drive_service = drive_service
+        self._drive_service_lock = threading.Lock()
+        self._shared_state_owner = None
 
         self._drive_folder_id = drive_folder_id
-        self._local_directory_path = local_directory_path.replace('/', '\\')
-
-        path_length = len(self._local_directory_path)
-        if self._local_directory_path[path_length - 1] != '\\':
-            self._local_directory_path += '//'
+        self._local_directory_path = os.path.join(local_directory_path, '')
+        self._world_name = None
 
         self._file_names = []
 
-    def get_drive_file_list(self, fields):
-        q = "'{}' in parents".format(self._drive_folder_id)
-
-        results = self._drive_service.files().list(
-            q=q, fields=fields).execute()
-
-        return results.get('files', [])
+        self._hash_cache = HashCache()
+        self._upload_journal = UploadJournal()
+        self._sync_ledger = SyncLedger()
+        self._upload_queue = UploadQueue()
+        self._change_tracker = None
+        self._backup_style = BACKUPSTYLE_TIME
+        self._backup_store = get_local_backup_store(
+            os.path.join(self._local_directory_path, BACKUP_FOLDER_NAME))
+        self._pruning_thread = None
+        # A push and a drain of the upload queue must not upload the same
+        # files at once.
+        self._push_lock = threading.Lock()
+        self._draining_thread = None
+        self._draining_stopped = threading.Event()
+
+        self._transfer_strategy = FullFileTransfer()
+        self._transfer_scheduler = TransferScheduler()
+        # Reported to by operations nobody watches or cancels.
+        self._sync_progress = SyncProgress()
+        self._request_executor = DriveRequestExecutor()
+        self._storage_backend = DriveStorageBackend()
+        # Other folders or accounts the saves are pushed to as well.
+        self._replicas = []
+        self._shared_file_readers = {}
+        self._metrics_sink = None
+        self._last_metrics_report = None
+
+    def get_drive_service(self):
+        if self._shared_state_owner is not None:
+            return self._shared_state_owner.get_drive_service()
+
+        with self._drive_service_lock:
+            if self._drive_service is None:
+                from DriveService import get_google_drive_v3_service, \
+                    TOKEN_FILE_NAME
+
+                with metric_span(PHASE_CREDENTIALS):
+                    self._drive_service = get_google_drive_v3_service(
+                        self._client_secret_file_name,
+                        self._token_file_name or TOKEN_FILE_NAME,
+                        self._interactive_authorization)
+
+            return self._drive_service
+
+    def set_token_file_name(self, token_file_name):
+        # Keeps the credentials of another Google account apart.
+        self._token_file_name = token_file_name
+
+    def set_interactive_authorization(self, interactive_authorization):
+        # When off, credentials that need the user to sign in with a browser
+        # raise AuthorizationRequiredError instead.
+        self._interactive_authorization = interactive_authorization
+
+        for _, replica in self._replicas:
+            replica.set_interactive_authorization(interactive_authorization)
+
+    def get_credentials_key(self):
+        # Updaters with the same key sign in to the same Google account.
+        return (self._client_secret_file_name, self._token_file_name)
+
+    def share_state_with(self, save_file_updater):
+        # Worlds synced together use one Drive client, one rate limit and one
+        # copy of each state file. Updaters of the same folder also share its
+        # change tracker and remote manifest.
+        self._shared_state_owner = save_file_updater
+        self._request_executor = save_file_updater._request_executor
+        self.share_local_state_with(save_file_updater)
+
+    def share_local_state_with(self, save_file_updater):
+        self._hash_cache = save_file_updater._hash_cache
+        self._upload_journal = save_file_updater._upload_journal
+        self._sync_ledger = save_file_updater._sync_ledger
+        self._upload_queue = save_file_updater._upload_queue
+        self._metrics_sink = save_file_updater._metrics_sink
+
+        for _, replica in self._replicas:
+            replica.share_local_state_with(self)
+
+    def set_replicas(self, replicas):
+        # replicas is a list of (name, updater) pairs, each an updater of the
+        # same saves for another folder, account or storage. Pushes go to
+        # all of them; pulls only come from this updater's folder.
+        self._replicas = list(replicas)
+
+        for _, replica in self._replicas:
+            replica.share_local_state_with(self)
+
+    def get_replicas(self):
+        return list(self._replicas)
+
+    def set_request_executor(self, request_executor):
+        self._request_executor = request_executor
+
+    def get_request_executor(self):
+        return self._request_executor
+
+    def set_storage_backend(self, storage_backend):
+        # Where the remote copies are kept; see StorageBackend.
+        self._storage_backend = storage_backend
+
+    def get_storage_backend(self):
+        return self._storage_backend
+
+    def prepare_storage(self):
+        # Does the slow part of connecting to the storage ahead of the first
+        # sync, e.g. refreshing the Drive credentials.
+        self._storage_backend.prepare(self)
+
+    def set_metrics_sink(self, metrics_sink):
+        # metrics_sink.write(report) is called with the metrics of every sync
+        # operation; see SyncMetrics.
+        self._metrics_sink = metrics_sink
+
+        for _, replica in self._replicas:
+            replica.set_metrics_sink(metrics_sink)
+
+    def get_last_metrics_report(self):
+        return self._last_metrics_report
+
+    @contextlib.contextmanager
+    def record_metrics(self, operation):
+        # Operations started from inside another one count towards it.
+        metrics = get_current_metrics()
+        if metrics is not None:
+            yield metrics
+            return
+
+        metrics = SyncMetrics(
+            operation, self.get_ledger_scope(), self.get_world_name())
+        error = None
+        try:
+            with activate_metrics(metrics):
+                yield metrics
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            self._last_metrics_report = metrics.get_report(error)
+            if self._metrics_sink is not None:
+                try:
+                    self._metrics_sink.write(self._last_metrics_report)
+                except Exception as exception:
+                    print("Could not write sync metrics: {}".format(
+                        exception))
+
+    def execute_request(self, request, idempotent=False):
+        return self._request_executor.execute(request, idempotent)
+
+    def get_world_name(self):
+        return self._world_name
+
+    def get_manifest_key(self):
+        # Updaters with the same key read the same remote manifest.
+        return self._drive_folder_id
+
+    def get_remote_folder_path(self):
+        # The directory the files are kept in on local storage.
+        return self._drive_folder_id
+
+    def get_change_tracker(self):
+        owner = self._shared_state_owner
+        if owner is not None and \
+                owner.get_manifest_key() == self.get_manifest_key():
+            return owner.get_change_tracker()
+
+        if self._change_tracker is None:
+            self._change_tracker = RemoteChangeTracker(
+                self.get_drive_service(),
+                self._drive_folder_id,
+                request_executor=self._request_executor)
+
+        return self._change_tracker
+
+    def get_sync_progress(self):
+        # The progress of the operation running on this thread. A sync that
+        # reports its progress activates it for as long as it runs, so the
+        # updater never holds on to it.
+        sync_progress = get_current_sync_progress()
+        if sync_progress is None:
+            return self._sync_progress
+
+        return sync_progress
+
+    def set_backup_style(self, backup_style):
+        self._backup_style = backup_style
+
+    def keeps_drive_backups(self):
+        # With backups turned off, replaced saves are overwritten in place
+        # like those of updaters that never rename them.
+        return self.renames_drive_backups and \
+            self._backup_style != BACKUPSTYLE_NOBACKUP
+
+    def set_transfer_strategy(self, transfer_strategy):
+        self._transfer_strategy = transfer_strategy
+
+    def get_transfer_strategy(self, drive_file_info):
+        # Remote files are always read back the way they were stored,
+        # whatever strategy is currently used for uploads.
+        transfer_format = get_transfer_format(drive_file_info)
+        if transfer_format == self._transfer_strategy.transfer_format:
+            return self._transfer_strategy
+
+        if transfer_format not in TRANSFER_STRATEGIES:
+            raise ValueError(
+                "Unknown transfer format: {}".format(transfer_format))
+
+        return TRANSFER_STRATEGIES[transfer_format]()
+
+    def get_remote_manifest(self):
+        with self.record_metrics(OPERATION_LIST):
+            return self._storage_backend.list_files(self)
 
     def get_metadata(self, file_name):
         return {
@@ -110,134 +334,764 @@ class SaveFileUpdater():
             'parents': [self._drive_folder_id]
         }
 
-    def download_from_drive(self, file_id, file_path_to_save):
-        request = self._drive_service.files().get_media(fileId=file_id)
-        file = io.FileIO(file_path_to_save, "wb")
-        downloader = MediaIoBaseDownload(file, request)
-
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print("Download {}%.".format(int(status.progress() * 100)))
-
-        return file
-
-    def upload_to_drive(self, metadata, file_path):
-        media = MediaFileUpload(file_path, resumable=True)
-        file = self._drive_service.files().create(
-            body=metadata, media_body=media, fields='id').execute()
-
-        return file
+    def get_upload_metadata(self, file_name, drive_file_info):
+        # drive_file_info is the remote file being replaced, if any.
+        if drive_file_info is not None and not self.keeps_drive_backups():
+            return {
+                'id': drive_file_info['id'],
+                'name': file_name
+            }
+
+        return self.get_metadata(file_name)
+
+    def update_file_names(self, remote_manifest):
+        # Called before every sync, for updaters whose set of files is not
+        # known up front.
+        pass
+
+    def download_from_drive(self, file_id, file_path_to_save, md5=None):
+        # The MD5 is computed as the bytes arrive, so verifying the download
+        # needs no second read of the file.
+        with open_atomic_file(
+                file_path_to_save, self._hash_cache) as writer:
+            download_media(self, file_id, writer)
+            writer.check_md5(md5, file_path_to_save)
+
+        return file_path_to_save
+
+    def upload_to_drive(self, metadata, file_path, md5=None):
+        from googleapiclient.errors import HttpError
+
+        journal_entry = None
+        if md5 is not None:
+            journal_entry = self._upload_journal.get(
+                self.get_ledger_scope(), file_path, md5)
+
+        try:
+            response = self.run_resumable_upload(
+                metadata, file_path, md5, journal_entry)
+        except HttpError as error:
+            # The session expired or was discarded by Drive; start over.
+            if journal_entry is None or \
+                    error.resp.status not in EXPIRED_SESSION_STATUSES:
+                raise
+
+            self._upload_journal.remove(self.get_ledger_scope(), file_path)
+            response = self.run_resumable_upload(
+                metadata, file_path, md5, None)
+
+        self._upload_journal.remove(self.get_ledger_scope(), file_path)
+
+        return response
+
+    def create_upload_media(self, file_path):
+        from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+
+        # A file pushed to several destinations at once is read through one
+        # shared reader.
+        shared_file_reader = self._shared_file_readers.get(
+            os.path.abspath(file_path))
+        if shared_file_reader is None:
+            return MediaFileUpload(
+                file_path, chunksize=get_upload_chunk_size(self),
+                resumable=True)
+
+        return MediaIoBaseUpload(
+            shared_file_reader.open_stream(),
+            mimetype=mimetypes.guess_type(file_path)[0] or
+            'application/octet-stream',
+            chunksize=get_upload_chunk_size(self),
+            resumable=True)
+
+    def run_resumable_upload(self, metadata, file_path, md5, journal_entry):
+        media = self.create_upload_media(file_path)
+        request = create_upload_request(self, metadata, media)
+
+        if journal_entry is not None:
+            response = resume_upload(
+                self, request, journal_entry['resumable_uri'], media.size())
+            if response is not None:
+                return response
+
+        def on_chunk(resumable_uri, offset):
+            if md5 is not None:
+                self._upload_journal.record(
+                    self.get_ledger_scope(), file_path, md5, resumable_uri,
+                    offset)
+
+        return upload_media(self, request, media, on_chunk)
+
+    def get_local_file_info(self, file_name):
+        file_path = self._local_directory_path + file_name
+
+        try:
+            with metric_span(PHASE_HASHING):
+                md5 = self._hash_cache.get_md5_string(file_path)
+        except FileNotFoundError:
+            md5 = ""
 
-    def update_local(self):
-        current_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
-
-        drive_data_file_info = self.get_drive_file_list(
-            "files(id, name, md5Checksum)")
+        return {
+            'name': file_name,
+            'path': file_path,
+            'md5': md5
+        }
 
-        file_paths = map(lambda s: self._local_directory_path + s, self._file_names)
+    def get_local_directory_path(self):
+        return self._local_directory_path
+
+    def get_local_file_paths(self):
+        return [self._local_directory_path + file_name
+                for file_name in self._file_names]
+
+    def get_local_file_infos(self):
+        return [self.get_local_file_info(file_name)
+                for file_name in self._file_names]
+
+    def update_local_file(self, file_name, remote_manifest, current_time):
+        self.get_sync_progress().check_cancelled()
+
+        drive_file_info = remote_manifest.get(file_name)
+        if drive_file_info is None:
+            return OUTCOME_SKIPPED
+
+        local_file_info = self.get_local_file_info(file_name)
+        local_file_path = local_file_info['path']
+        local_file_md5 = local_file_info['md5']
+
+        if local_file_md5 == get_content_md5(drive_file_info):
+            return OUTCOME_UNCHANGED
+
+        if local_file_md5 != "":
+            with metric_span(PHASE_BACKUP):
+                self._backup_store.add(
+                    local_file_path, local_file_md5,
+                    get_backup_file_name(file_name, current_time),
+                    self._backup_style)
+
+        with metric_span(PHASE_TRANSFER):
+            self._storage_backend.fetch_file(
+                self, drive_file_info, local_file_path)
+
+        return OUTCOME_DOWNLOADED
+
+    def upload_drive_file(self, local_file_info, drive_file_info,
+                          remote_manifest):
+        self.get_sync_progress().check_cancelled()
+
+        # The storage may already hold this exact content, e.g. as the backup
+        # of a save that was rolled back. Copying it there moves no data.
+        source_file_info = remote_manifest.get_by_md5(local_file_info['md5'])
+        if source_file_info is not None:
+            with metric_span(PHASE_TRANSFER):
+                copied = self._storage_backend.copy_file(
+                    self, source_file_info, local_file_info['name'],
+                    drive_file_info)
+            if copied:
+                return OUTCOME_COPIED
+
+        with metric_span(PHASE_TRANSFER):
+            self._storage_backend.put_file(
+                self, local_file_info, drive_file_info)
+
+        return OUTCOME_UPLOADED
+
+    def backup_drive_files(self, drive_file_infos, current_time):
+        # Renames every replaced remote file and returns the errors by file
+        # id.
+        with metric_span(PHASE_BACKUP):
+            return self._storage_backend.rename_files(self, [
+                (drive_file_info, get_backup_file_name(
+                    drive_file_info['name'], current_time))
+                for drive_file_info in drive_file_infos])
+
+    def get_expired_drive_backups(self, remote_manifest):
+        if not self.keeps_drive_backups():
+            return []
+
+        file_names = set(self._file_names)
+        backup_file_infos = {}
+        for drive_file_info in remote_manifest.entries():
+            parsed = parse_backup_file_name(drive_file_info['name'])
+            if parsed is not None and parsed[0] in file_names:
+                backup_file_infos[drive_file_info['name']] = drive_file_info
+
+        return [backup_file_infos[backup_file_name]
+                for backup_file_name in get_expired_backups(
+                    list(backup_file_infos), self._backup_style)]
+
+    def prune_drive_backups(self, drive_file_infos):
+        # Expired backups go to the trash where the storage has one, so a
+        # mistake can still be undone. Returns the ids that were trashed.
+        errors = self._storage_backend.trash_files(self, drive_file_infos)
+
+        trashed_file_ids = []
+        for drive_file_info in drive_file_infos:
+            exception = errors.get(drive_file_info['id'])
+            if exception is None:
+                trashed_file_ids.append(drive_file_info['id'])
+            else:
+                print("Could not trash {}: {}".format(
+                    drive_file_info['name'], exception))
+
+        return trashed_file_ids
+
+    def start_pruning_drive_backups(self, remote_manifest):
+        # The expired backups are picked from the manifest of the sync that
+        # just ran; only trashing them happens in the background.
+        drive_file_infos = self.get_expired_drive_backups(remote_manifest)
+        if len(drive_file_infos) == 0:
+            return
+
+        self.wait_for_pruning()
+
+        def prune():
+            try:
+                with activate_sync_progress(SyncProgress()):
+                    trashed_file_ids = self.prune_drive_backups(
+                        drive_file_infos)
+
+                    # The chunks of a delta backup are only trashed once
+                    # nothing else uses them.
+                    if any(get_transfer_format(drive_file_info) ==
+                           TRANSFER_FORMAT_DELTA and
+                           drive_file_info['id'] in trashed_file_ids
+                           for drive_file_info in drive_file_infos):
+                        DeltaTransfer().prune_chunks(self)
+            except Exception as exception:
+                print("Pruning Drive backups failed: {}".format(exception))
+
+        self._pruning_thread = threading.Thread(target=prune)
+        self._pruning_thread.start()
+
+    def wait_for_pruning(self):
+        if self._pruning_thread is not None:
+            self._pruning_thread.join()
+            self._pruning_thread = None
+
+    @records_metrics(OPERATION_STATUS)
+    def get_sync_status(self, remote_manifest=None):
+        if remote_manifest is None:
+            remote_manifest = self.get_remote_manifest()
+        self.update_file_names(remote_manifest)
+        local_file_infos = self._transfer_scheduler.map(
+            self.get_local_file_info, self._file_names)
+        base_md5s = self.get_base_md5s()
+
+        statuses = []
+        for local_file_info in local_file_infos:
+            drive_file_info = remote_manifest.get(local_file_info['name'])
+            drive_md5 = None
+            drive_modified_time = None
+            if drive_file_info is not None:
+                drive_md5 = get_content_md5(drive_file_info)
+                drive_modified_time = drive_file_info.get('modifiedTime')
+
+            if local_file_info['md5'] == "":
+                status = STATUS_MISSING if drive_md5 is None \
+                    else STATUS_DRIVE_ONLY
+            elif drive_md5 is None:
+                status = STATUS_LOCAL_ONLY
+            elif local_file_info['md5'] == drive_md5:
+                status = STATUS_IN_SYNC
+            elif local_file_info['name'] not in base_md5s:
+                # Never synced, so which side changed is unknown.
+                status = STATUS_DIFFERENT
+            else:
+                status = {
+                    DIRECTION_UPLOAD: STATUS_LOCAL_CHANGED,
+                    DIRECTION_DOWNLOAD: STATUS_DRIVE_CHANGED,
+                    DIRECTION_CONFLICT: STATUS_CONFLICT
+                }[get_sync_direction(
+                    base_md5s[local_file_info['name']],
+                    local_file_info['md5'], drive_md5)]
+
+            statuses.append({
+                'name': local_file_info['name'],
+                'status': status,
+                'local_md5': local_file_info['md5'] or None,
+                'base_md5': base_md5s.get(local_file_info['name']),
+                'drive_md5': drive_md5,
+                'drive_modified_time': drive_modified_time
+            })
+
+        self._hash_cache.save()
+
+        return statuses
+
+    def get_ledger_scope(self):
+        return str(self.get_manifest_key())
+
+    def get_ledger_entry(self, file_name, md5, drive_file_info=None):
+        return {
+            'path': self._local_directory_path + file_name,
+            'md5': md5,
+            'drive_file_id': None if drive_file_info is None
+            else drive_file_info['id'],
+            'drive_modified_time': None if drive_file_info is None
+            else drive_file_info.get('modifiedTime')
+        }
 
-        local_file_infos = []
+    def get_base_md5s(self):
+        # The MD5 of every file as of its last sync, by file name.
+        base_md5s = {}
+        ledger_entries = self._sync_ledger.get_entries(self.get_ledger_scope())
+
+        for file_name in self._file_names:
+            ledger_entry = ledger_entries.get(
+                os.path.abspath(self._local_directory_path + file_name))
+            if ledger_entry is not None:
+                base_md5s[file_name] = ledger_entry['md5']
+
+        return base_md5s
+
+    def pull_files(self, file_names, remote_manifest, current_time):
+        # Returns the outcomes by file name.
+        report = self._transfer_scheduler.run(
+            file_names,
+            lambda file_name: self.update_local_file(
+                file_name, remote_manifest, current_time))
+
+        ledger_entries = []
+        for outcome in report:
+            if outcome['status'] not in (
+                    OUTCOME_UNCHANGED, OUTCOME_DOWNLOADED):
+                continue
 
-        for i, file_path in enumerate(file_paths):
-            try:
-                md5 = get_md5_string(file_path)
-                local_file_infos.append({
-                    "name": self._file_names[i],
-                    "path": file_path,
-                    "md5": md5
-                })
-            except FileNotFoundError:
-                local_file_infos.append({
-                    "name": self._file_names[i],
-                    "path": "",
-                    "md5": ""
-                })
-
-        for drive_file_info in drive_data_file_info:
-            drive_file_id = drive_file_info['id']
-            drive_file_name = drive_file_info['name']
-            drive_file_md5 = drive_file_info['md5Checksum']
-
-            for index, local_file_info in enumerate(local_file_infos):
-                if drive_file_name == local_file_info['name']:
-                    local_file_infos[index]['drive_id'] = drive_file_id
-                    local_file_infos[index]['drive_md5'] = drive_file_md5
+            drive_file_info = remote_manifest.get(outcome['name'])
+            if self.matches_remote_file(outcome['name'], drive_file_info):
+                ledger_entries.append(self.get_ledger_entry(
+                    outcome['name'], get_content_md5(drive_file_info),
+                    drive_file_info))
+        self._sync_ledger.record(self.get_ledger_scope(), ledger_entries)
+
+        return {outcome['name']: outcome for outcome in report}
+
+    def matches_remote_file(self, file_name, drive_file_info):
+        # Whether the local file holds the remote content after a pull. A
+        # downloaded file is verified as it is written, so it always does.
+        return True
+
+    def push_files(self, local_file_infos, remote_manifest, current_time):
+        # Returns the outcomes by file name.
+        with self._push_lock:
+            outcomes = self.run_push(
+                local_file_infos, remote_manifest, current_time)
+
+        # Files Drive could not be reached for are pushed again later.
+        queued_file_infos = [
+            local_file_info for local_file_info in local_file_infos
+            if outcomes[local_file_info['name']]['status'] == OUTCOME_FAILED
+            and is_network_error(outcomes[local_file_info['name']]['error'])]
+        for local_file_info in queued_file_infos:
+            outcome = outcomes[local_file_info['name']]
+            outcomes[local_file_info['name']] = get_outcome(
+                outcome['name'], OUTCOME_QUEUED, outcome['error'],
+                outcome['elapsed'])
+        self.put_upload_queue(queued_file_infos)
+
+        # Skipped files no longer exist and have nothing left to send.
+        self._upload_queue.remove(self.get_ledger_scope(), [
+            self._local_directory_path + file_name
+            for file_name, outcome in outcomes.items()
+            if outcome['status'] in (OUTCOME_UNCHANGED, OUTCOME_UPLOADED,
+                                     OUTCOME_COPIED, OUTCOME_SKIPPED)])
+
+        return outcomes
+
+    def run_push(self, local_file_infos, remote_manifest, current_time):
+        outcomes = {}
+        changed_file_infos = []
+        ledger_entries = []
 
         for local_file_info in local_file_infos:
-            local_file_name = local_file_info['name']
-            local_file_path = local_file_info['path']
-            local_file_md5 = local_file_info['md5']
+            file_name = local_file_info['name']
+            drive_file_info = remote_manifest.get(file_name)
+
+            if local_file_info['md5'] == "":
+                outcomes[file_name] = get_outcome(file_name, OUTCOME_SKIPPED)
+            elif drive_file_info is not None and \
+                    local_file_info['md5'] == get_content_md5(drive_file_info):
+                outcomes[file_name] = get_outcome(file_name, OUTCOME_UNCHANGED)
+                ledger_entries.append(self.get_ledger_entry(
+                    file_name, local_file_info['md5'], drive_file_info))
+            else:
+                changed_file_infos.append((local_file_info, drive_file_info))
+
+        backup_errors = {}
+        if self.keeps_drive_backups():
+            backup_errors = self.backup_drive_files(
+                [drive_file_info for _, drive_file_info in changed_file_infos
+                 if drive_file_info is not None],
+                current_time)
+
+        upload_file_infos = {}
+        for local_file_info, drive_file_info in changed_file_infos:
+            file_name = local_file_info['name']
+            backup_error = None
+            if drive_file_info is not None:
+                backup_error = backup_errors.get(drive_file_info['id'])
+
+            if backup_error is not None:
+                outcomes[file_name] = get_outcome(
+                    file_name, OUTCOME_FAILED, backup_error)
+                continue
+
+            if drive_file_info is not None and self.keeps_drive_backups():
+                # Lets the new backup count towards retention right away.
+                remote_manifest.remove(drive_file_info['id'])
+                remote_manifest.add(
+                    self._storage_backend.get_renamed_file_info(
+                        drive_file_info,
+                        get_backup_file_name(file_name, current_time)))
+                # The renamed file is a backup now; the upload makes a new
+                # one.
+                drive_file_info = None
+
+            upload_file_infos[file_name] = (local_file_info, drive_file_info)
+
+        report = self._transfer_scheduler.run(
+            list(upload_file_infos),
+            lambda file_name: self.upload_drive_file(
+                *upload_file_infos[file_name], remote_manifest))
+
+        for outcome in report:
+            outcomes[outcome['name']] = outcome
+
+            # The id of the new remote file is picked up by the next sync.
+            if outcome['status'] in (OUTCOME_UPLOADED, OUTCOME_COPIED):
+                local_file_info, _ = upload_file_infos[outcome['name']]
+                ledger_entries.append(self.get_ledger_entry(
+                    outcome['name'], local_file_info['md5']))
+        self._sync_ledger.record(self.get_ledger_scope(), ledger_entries)
+
+        self.start_pruning_drive_backups(remote_manifest)
+
+        return outcomes
+
+    @records_metrics(OPERATION_PULL)
+    def update_local(self, remote_manifest=None):
+        current_time = get_backup_time_string()
+
+        if remote_manifest is None:
+            remote_manifest = self.get_remote_manifest()
+        self.update_file_names(remote_manifest)
+
+        outcomes = self.pull_files(
+            self._file_names, remote_manifest, current_time)
+
+        self._hash_cache.save()
+
+        return [outcomes[file_name] for file_name in self._file_names]
+
+    @records_metrics(OPERATION_PUSH)
+    def update_drive(self, remote_manifest=None, replicas=None,
+                     manifest_error=None):
+        # replicas defaults to the ones set with set_replicas. manifest_error
+        # is the error listing the folder failed with, if it was listed
+        # beforehand.
+        if replicas is None:
+            replicas = self._replicas
+        if len(replicas) > 0:
+            return self.update_drives(
+                remote_manifest, replicas, manifest_error)
+        if manifest_error is not None:
+            return self.queue_uploads(manifest_error)
+
+        current_time = get_backup_time_string()
+
+        try:
+            if remote_manifest is None:
+                remote_manifest = self.get_remote_manifest()
+            self.update_file_names(remote_manifest)
+            local_file_infos = self._transfer_scheduler.map(
+                self.get_local_file_info, self._file_names)
+
+            outcomes = self.push_files(
+                local_file_infos, remote_manifest, current_time)
+        except Exception as exception:
+            return self.queue_uploads(exception)
+
+        self._hash_cache.save()
+
+        return [outcomes[file_name] for file_name in self._file_names]
+
+    def update_drives(self, remote_manifest, replicas, manifest_error):
+        # Pushes to this updater's folder and every replica at once. Each
+        # destination is compared, backed up and queued for on its own, so
+        # one that is unreachable or fails holds up none of the others, but
+        # every file is hashed once and read once for all of them.
+        current_time = get_backup_time_string()
+        destinations = [(None, self)] + list(replicas)
+
+        def get_remote_manifest(destination):
+            _, save_file_updater = destination
+            if save_file_updater is self:
+                if manifest_error is not None:
+                    return manifest_error
+                if remote_manifest is not None:
+                    return remote_manifest
 
             try:
-                drive_file_id = local_file_info['drive_id']
-                drive_file_md5 = local_file_info['drive_md5']
-            except KeyError:
-                continue
+                return save_file_updater.get_remote_manifest()
+            except Exception as exception:
+                return exception
 
-            if local_file_md5 != drive_file_md5:
-                if local_file_path != "":
-                    create_local_backup_file(local_file_path, current_time)
+        remote_manifests = self._transfer_scheduler.map(
+            get_remote_manifest, destinations)
 
-                self.download_from_drive(drive_file_id, local_file_path)
+        file_names = []
+        for (_, save_file_updater), destination_manifest in \
+                zip(destinations, remote_manifests):
+            if isinstance(destination_manifest, Exception):
+                destination_manifest = RemoteManifest()
+            save_file_updater.update_file_names(destination_manifest)
 
-    def update_drive(self):
-        current_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+            file_names.extend(file_name
+                              for file_name in save_file_updater._file_names
+                              if file_name not in file_names)
 
-        drive_data_file_info = self.get_drive_file_list(
-            "files(id, name, md5Checksum)")
+        local_file_infos = dict(zip(file_names, self._transfer_scheduler.map(
+            self.get_local_file_info, file_names)))
+        self._hash_cache.save()
 
-        print(self._file_names)
+        shared_file_readers = self.get_shared_file_readers(
+            local_file_infos.values(), remote_manifests)
 
-        local_file_infos = []
+        def push(index):
+            _, save_file_updater = destinations[index]
+            destination_manifest = remote_manifests[index]
+            destination_file_names = save_file_updater._file_names
 
-        for index, file_path in enumerate(self._file_names):
             try:
-                md5 = get_md5_string(file_path)
-                local_file_infos.append({
-                    'name': self._file_names[index],
-                    'path': file_path,
-                    'md5': md5
-                })
-            except FileNotFoundError:
-                continue
+                if isinstance(destination_manifest, Exception):
+                    raise destination_manifest
+
+                save_file_updater._shared_file_readers = shared_file_readers
+                try:
+                    outcomes = save_file_updater.push_files(
+                        [local_file_infos[file_name]
+                         for file_name in destination_file_names],
+                        destination_manifest, current_time)
+                finally:
+                    save_file_updater._shared_file_readers = {}
+            except Exception as exception:
+                try:
+                    return save_file_updater.queue_uploads(exception)
+                except Exception:
+                    return [get_outcome(file_name, OUTCOME_FAILED, exception)
+                            for file_name in destination_file_names]
+
+            return [outcomes[file_name]
+                    for file_name in destination_file_names]
+
+        try:
+            reports = self._transfer_scheduler.map(
+                push, list(range(len(destinations))))
+        finally:
+            for shared_file_reader in shared_file_readers.values():
+                shared_file_reader.close()
+
+        self._hash_cache.save()
+
+        report = []
+        for (name, _), destination_report in zip(destinations, reports):
+            for outcome in destination_report:
+                if name is not None:
+                    outcome = dict(
+                        outcome, name='{} ({})'.format(outcome['name'], name))
+                report.append(outcome)
+
+        return report
+
+    def get_shared_file_readers(self, local_file_infos, remote_manifests):
+        # One reader, by path, for every file that differs in more than one
+        # destination. Files that turn out not to be uploaded, e.g. because
+        # they are copied instead, are never opened.
+        shared_file_readers = {}
 
-        print(local_file_infos)
-        for drive_file_info in drive_data_file_info:
-            drive_file_id = drive_file_info['id']
-            drive_file_name = drive_file_info['name']
-            drive_file_md5 = drive_file_info['md5Checksum']
+        for local_file_info in local_file_infos:
+            if local_file_info['md5'] == "" or \
+                    not os.path.isfile(local_file_info['path']):
+                continue
 
-            for index, local_file_info in enumerate(local_file_infos):
-                if drive_file_name == local_file_info['name']:
-                    local_file_infos[index]['drive_id'] = drive_file_id
-                    local_file_infos[index]['drive_md5'] = drive_file_md5
+            changed_count = 0
+            for remote_manifest in remote_manifests:
+                if isinstance(remote_manifest, Exception):
+                    continue
 
-        for local_file_info in local_file_infos:
-            local_file_name = local_file_info['name']
-            local_file_path = local_file_info['path']
-            local_file_md5 = local_file_info['md5']
+                drive_file_info = remote_manifest.get(local_file_info['name'])
+                if drive_file_info is None or local_file_info['md5'] != \
+                        get_content_md5(drive_file_info):
+                    changed_count += 1
 
-            try:
-                drive_file_id = local_file_info['drive_id']
-                drive_file_md5 = local_file_info['drive_md5']
-            except KeyError:
-                drive_file_id = ""
-                drive_file_md5 = ""
+            if changed_count > 1:
+                file_path = os.path.abspath(local_file_info['path'])
+                shared_file_readers[file_path] = SharedFileReader(file_path)
 
-            metadata = self.get_metadata(local_file_info['name'])
-            backup_file_name = get_backup_file_name(
-                    drive_file_name, current_time)
+        return shared_file_readers
 
-            print(local_file_info)
+    def put_upload_queue(self, local_file_infos):
+        for local_file_info in local_file_infos:
+            self._upload_queue.put(
+                self.get_ledger_scope(),
+                local_file_info['name'],
+                self._local_directory_path + local_file_info['name'],
+                local_file_info['md5'])
+
+        if len(local_file_infos) > 0:
+            self.start_draining_upload_queue()
+
+    @records_metrics(OPERATION_PUSH)
+    def queue_uploads(self, error):
+        # Called instead of a push when Drive cannot be reached: queues every
+        # save there is and returns the report. Other errors are raised.
+        if not is_network_error(error):
+            raise error
+
+        # Without a remote manifest, only local files are known.
+        self.update_file_names(RemoteManifest())
+        local_file_infos = self._transfer_scheduler.map(
+            self.get_local_file_info, self._file_names)
+        self._hash_cache.save()
+
+        queued_file_infos = [local_file_info
+                             for local_file_info in local_file_infos
+                             if local_file_info['md5'] != ""]
+        self.put_upload_queue(queued_file_infos)
+
+        return [get_outcome(local_file_info['name'], OUTCOME_QUEUED, error)
+                if local_file_info['md5'] != "" else
+                get_outcome(local_file_info['name'], OUTCOME_SKIPPED)
+                for local_file_info in local_file_infos]
+
+    def get_queued_file_names(self):
+        return [entry['name'] for entry
+                in self._upload_queue.get_entries(self.get_ledger_scope())]
+
+    def start_draining_upload_queue(
+            self,
+            min_retry_seconds=MIN_DRAIN_RETRY_SECONDS,
+            max_retry_seconds=MAX_DRAIN_RETRY_SECONDS):
+        # Replicas that were unreachable have queues of their own.
+        for _, replica in self._replicas:
+            replica.start_draining_upload_queue(
+                min_retry_seconds, max_retry_seconds)
+
+        if len(self.get_queued_file_names()) == 0:
+            return
+        if self._draining_thread is not None and \
+                self._draining_thread.is_alive():
+            return
+
+        self._draining_stopped.clear()
+        # A daemon, so that a queue waiting for the network never keeps the
+        # application from exiting; whatever is left is drained next time.
+        self._draining_thread = threading.Thread(
+            target=self.drain_upload_queue,
+            args=(min_retry_seconds, max_retry_seconds),
+            daemon=True)
+        self._draining_thread.start()
+
+    def stop_draining_upload_queue(self):
+        for _, replica in self._replicas:
+            replica.stop_draining_upload_queue()
+
+        self._draining_stopped.set()
+
+        if self._draining_thread is not None:
+            self._draining_thread.join()
+            self._draining_thread = None
+
+    def close(self):
+        # Ends the transfer threads once their work is done. They are
+        # started again if the updater is used after all.
+        for _, replica in self._replicas:
+            replica.close()
+
+        self._transfer_scheduler.shutdown()
+
+    def drain_upload_queue(self,
+                           min_retry_seconds=MIN_DRAIN_RETRY_SECONDS,
+                           max_retry_seconds=MAX_DRAIN_RETRY_SECONDS):
+        # Pushes the queued saves once Drive can be reached again, waiting
+        # longer after every attempt that fails.
+        retry_seconds = min_retry_seconds
+
+        while not self._draining_stopped.wait(retry_seconds):
+            file_names = self.get_queued_file_names()
+            if len(file_names) == 0:
+                return
 
-            if local_file_md5 != drive_file_md5:
-                if drive_file_id != "":
-                    self._drive_service.files().update(
-                                fileId=drive_file_id,
-                                body={'name': backup_file_name}).execute()
+            try:
+                with self.record_metrics(OPERATION_DRAIN), \
+                        activate_sync_progress(SyncProgress()):
+                    remote_manifest = self.get_remote_manifest()
+                    local_file_infos = self._transfer_scheduler.map(
+                        self.get_local_file_info, file_names)
+                    outcomes = self.push_files(
+                        local_file_infos, remote_manifest,
+                        get_backup_time_string())
+                    self._hash_cache.save()
+            except Exception as exception:
+                if not is_network_error(exception):
+                    print("Draining the upload queue failed: {}".format(
+                        exception))
+                outcomes = None
+
+            if outcomes is None or any(
+                    outcome['status'] in (OUTCOME_FAILED, OUTCOME_QUEUED)
+                    for outcome in outcomes.values()):
+                retry_seconds = min(retry_seconds * 2, max_retry_seconds)
+            else:
+                retry_seconds = min_retry_seconds
+
+    @records_metrics(OPERATION_SYNC)
+    def sync(self, remote_manifest=None):
+        # Sends every file in the direction it changed in since the last
+        # sync. Files changed on both sides are reported as conflicts and
+        # left alone; so are files that differ and were never synced.
+        current_time = get_backup_time_string()
+
+        if remote_manifest is None:
+            remote_manifest = self.get_remote_manifest()
+        self.update_file_names(remote_manifest)
+        local_file_infos = self._transfer_scheduler.map(
+            self.get_local_file_info, self._file_names)
+        base_md5s = self.get_base_md5s()
+
+        outcomes = {}
+        upload_file_infos = []
+        download_file_names = []
 
-                self.upload_to_drive(metadata, local_file_path)
+        for local_file_info in local_file_infos:
+            file_name = local_file_info['name']
+            drive_file_info = remote_manifest.get(file_name)
+            direction = get_sync_direction(
+                base_md5s.get(file_name),
+                local_file_info['md5'],
+                None if drive_file_info is None
+                else get_content_md5(drive_file_info))
+
+            if direction == DIRECTION_UPLOAD:
+                upload_file_infos.append(local_file_info)
+            elif direction == DIRECTION_DOWNLOAD:
+                download_file_names.append(file_name)
+            elif direction == DIRECTION_CONFLICT:
+                outcomes[file_name] = get_outcome(file_name, OUTCOME_CONFLICT)
+            elif drive_file_info is None:
+                outcomes[file_name] = get_outcome(file_name, OUTCOME_SKIPPED)
+            else:
+                # Already in sync; pushing it only updates the ledger.
+                upload_file_infos.append(local_file_info)
+
+        outcomes.update(self.push_files(
+            upload_file_infos, remote_manifest, current_time))
+        outcomes.update(self.pull_files(
+            download_file_names, remote_manifest, current_time))
+
+        self._hash_cache.save()
+
+        return [outcomes[file_name] for file_name in self._file_names]
 
 
 class ValheimSaveFileUpdater(SaveFileUpdater):
@@ -245,11 +1099,13 @@ class ValheimSaveFileUpdater(SaveFileUpdater):
                  client_secret_file_name,
                  drive_folder_id,
                  local_directory_path,
-                 world_name):
+                 world_name,
+                 drive_service=None):
         super().__init__(
             client_secret_file_name,
             drive_folder_id,
-            local_directory_path)
+            local_directory_path,
+            drive_service)
 
         self._world_name = world_name
 
@@ -264,11 +1120,13 @@ class TerrariaSaveFileUpdater(SaveFileUpdater):
                  client_secret_file_name,
                  drive_folder_id,
                  local_directory_path,
-                 world_name):
+                 world_name,
+                 drive_service=None):
         super().__init__(
             client_secret_file_name,
             drive_folder_id,
-            local_directory_path)
+            local_directory_path,
+            drive_service)
 
         self._world_name = world_name
 
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+# A save counts as settled once none of its files changed size or mtime for
+# this long. Games write saves in bursts, and uploading mid-burst would send
+# a torn file.
+SETTLE_SECONDS = 5.0
+
+# Stat polling interval. It is also the fallback when no filesystem
+# notifications are available.
+POLL_SECONDS = 1.0
+
+
+def get_file_signatures(file_paths):
+    signatures = []
+
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            signatures.append((stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            signatures.append(None)
+
+    return signatures
+
+
+class SaveFileWatcher():
+    def __init__(self,
+                 file_paths,
+                 callback,
+                 settle_seconds=SETTLE_SECONDS,
+                 poll_seconds=POLL_SECONDS):
+        self._file_paths = list(file_paths)
+        self._callback = callback
+        self._settle_seconds = settle_seconds
+        self._poll_seconds = poll_seconds
+
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._synced_signatures = None
+        self._observed_signatures = None
+        self._changed_at = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        # Whatever is on disk when watching starts is taken as already synced.
+        self._synced_signatures = get_file_signatures(self._file_paths)
+        self._observed_signatures = self._synced_signatures
+        self._changed_at = time.monotonic()
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def notify(self):
+        # Called by a filesystem notification source to check right away
+        # instead of at the next poll.
+        self._wake.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self._poll_seconds)
+            self._wake.clear()
+
+            if self._stopped.is_set():
+                break
+
+            self.check()
+
+    def check(self):
+        now = time.monotonic()
+        signatures = get_file_signatures(self._file_paths)
+
+        if signatures != self._observed_signatures:
+            # Still being written; restart the settle window.
+            self._observed_signatures = signatures
+            self._changed_at = now
+            return False
+
+        if signatures == self._synced_signatures:
+            return False
+
+        if now - self._changed_at < self._settle_seconds:
+            return False
+
+        try:
+            self._callback()
+        except Exception as exception:
+            print("Auto update failed: {}".format(exception))
+            self._changed_at = now
+            return False
+
+        # Every write since the last sync is covered by this one callback.
+        self._synced_signatures = signatures
+
+        return True
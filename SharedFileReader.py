@@ -0,0 +1,132 @@
+import os
+import threading
+
+from TransferStrategy import MAX_UPLOAD_CHUNK_SIZE
+
+SHARED_READ_BLOCK_SIZE = 1024 * 1024
+# How far an upload may fall behind the one furthest ahead and still be
+# served from memory. Uploads that keep pace send the same chunk at about
+# the same time, so one chunk of the largest size is enough.
+SHARED_READ_WINDOW_SIZE = MAX_UPLOAD_CHUNK_SIZE
+
+
+# Lets the uploads of one file to several destinations read it from disk
+# once. Blocks are read as the upload furthest ahead needs them and kept
+# until it is a window further on; an upload that falls further behind, or
+# goes back to resend a chunk, reads its blocks from disk again. No upload
+# ever waits for another, so a slow or failing destination holds up nothing.
+class SharedFileReader():
+    def __init__(self,
+                 file_path,
+                 block_size=SHARED_READ_BLOCK_SIZE,
+                 window_size=SHARED_READ_WINDOW_SIZE):
+        self._file_path = file_path
+        self._block_size = block_size
+        self._window_block_count = max(1, window_size // block_size)
+        self._lock = threading.Lock()
+
+        # Opened on first read, as most files turn out to be unchanged.
+        self._file = None
+        self._size = None
+        self._blocks = {}
+        self._last_block_index = -1
+        self._disk_bytes_read = 0
+
+    def get_file_path(self):
+        return self._file_path
+
+    def get_disk_bytes_read(self):
+        with self._lock:
+            return self._disk_bytes_read
+
+    def open_file(self):
+        if self._file is None:
+            self._file = open(self._file_path, "rb")
+            self._size = os.fstat(self._file.fileno()).st_size
+
+    def get_size(self):
+        with self._lock:
+            self.open_file()
+            return self._size
+
+    def get_block(self, block_index):
+        block = self._blocks.get(block_index)
+        if block is not None:
+            return block
+
+        self._file.seek(block_index * self._block_size)
+        block = self._file.read(self._block_size)
+        self._disk_bytes_read += len(block)
+
+        if block_index > self._last_block_index:
+            self._last_block_index = block_index
+            for old_block_index in [
+                    old_block_index for old_block_index in self._blocks
+                    if old_block_index <= block_index -
+                    self._window_block_count]:
+                del self._blocks[old_block_index]
+
+        if block_index > self._last_block_index - self._window_block_count:
+            self._blocks[block_index] = block
+
+        return block
+
+    def read(self, offset, length):
+        with self._lock:
+            self.open_file()
+            end = min(offset + length, self._size)
+
+            chunks = []
+            while offset < end:
+                block_index, block_offset = divmod(offset, self._block_size)
+                block = self.get_block(block_index)
+                if block_offset >= len(block):
+                    break
+
+                chunk = block[block_offset:block_offset + end - offset]
+                chunks.append(chunk)
+                offset += len(chunk)
+
+            return b''.join(chunks)
+
+    def open_stream(self):
+        return SharedFileStream(self)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._blocks = {}
+
+
+# A read-only file object over a SharedFileReader, with a position of its
+# own, for MediaIoBaseUpload.
+class SharedFileStream():
+    def __init__(self, shared_file_reader):
+        self._shared_file_reader = shared_file_reader
+        self._position = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._shared_file_reader.get_size()
+        self._position = max(0, offset)
+
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self._shared_file_reader.get_size() - self._position)
+
+        data = self._shared_file_reader.read(self._position, size)
+        self._position += len(data)
+
+        return data
+
+    def close(self):
+        pass
@@ -0,0 +1,100 @@
+from SyncMetrics import PHASE_LISTING, metric_span
+
+STORAGE_DRIVE = 'drive'
+
+
+# Where the remote copies of the saves are kept. A backend lists the files of
+# an updater's folder as a RemoteManifest of Drive-like file infos (id, name,
+# md5Checksum or appProperties, modifiedTime and size), and moves files in
+# and out of it:
+#
+#   list_files(updater)                               -> RemoteManifest
+#   fetch_file(updater, file_info, file_path)
+#   put_file(updater, local_file_info, file_info)     file_info is replaced
+#   copy_file(updater, source_file_info, file_name, file_info) -> copied
+#   rename_files(updater, renames)                    -> errors by file id
+#   get_renamed_file_info(file_info, name)            -> file info
+#   trash_files(updater, file_infos)                  -> errors by file id
+#
+# Backends keep no state of their own; everything lives in the updater.
+#
+# The Google Drive backend goes through the updater's Drive service, change
+# tracker and transfer strategy.
+class DriveStorageBackend():
+    storage_name = STORAGE_DRIVE
+
+    def prepare(self, updater):
+        # Loads and refreshes the credentials.
+        updater.get_drive_service()
+
+    def list_files(self, updater):
+        # Builds the Drive service first, so that loading the credentials is
+        # not counted as listing.
+        change_tracker = updater.get_change_tracker()
+
+        with metric_span(PHASE_LISTING):
+            return change_tracker.get_remote_manifest()
+
+    def fetch_file(self, updater, file_info, file_path):
+        transfer_strategy = updater.get_transfer_strategy(file_info)
+        transfer_strategy.download(updater, file_info, file_path)
+
+    def put_file(self, updater, local_file_info, file_info):
+        metadata = updater.get_upload_metadata(
+            local_file_info['name'], file_info)
+
+        updater._transfer_strategy.upload(
+            updater, metadata, local_file_info['path'], local_file_info['md5'])
+
+    def copy_file(self, updater, source_file_info, file_name, file_info):
+        from googleapiclient.errors import HttpError
+
+        # A server-side copy can only make a new file.
+        metadata = updater.get_upload_metadata(file_name, file_info)
+        if 'id' in metadata:
+            return False
+
+        body = dict(metadata)
+        # Saves stored as delta or compressed need their format to be read
+        # back.
+        if source_file_info.get('appProperties'):
+            body['appProperties'] = source_file_info['appProperties']
+
+        try:
+            updater.execute_request(updater.get_drive_service().files().copy(
+                fileId=source_file_info['id'], body=body, fields='id'))
+        except HttpError as error:
+            # The manifest is out of date and the file is gone.
+            if error.resp.status != 404:
+                raise
+            return False
+
+        return True
+
+    def rename_files(self, updater, renames):
+        # Renames every (file info, name) pair in a single batch request.
+        return self.update_files(
+            updater, [(file_info, {'name': name})
+                      for file_info, name in renames])
+
+    def get_renamed_file_info(self, file_info, name):
+        return dict(file_info, name=name)
+
+    def trash_files(self, updater, file_infos):
+        # Trashed files can still be restored from the Drive web page.
+        return self.update_files(
+            updater, [(file_info, {'trashed': True})
+                      for file_info in file_infos])
+
+    def update_files(self, updater, updates):
+        drive_service = updater.get_drive_service()
+        requests = [drive_service.files().update(
+            fileId=file_info['id'], body=body) for file_info, body in updates]
+
+        results = updater.get_request_executor().execute_batch(
+            drive_service, requests, idempotent=True)
+
+        return {file_info['id']: exception
+                for (file_info, _), (response, exception)
+                in zip(updates, results)
+                if exception is not None}
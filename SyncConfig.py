@@ -0,0 +1,258 @@
+import configparser
+import os
+import sys
+
+from SaveFileUpdater import ValheimSaveFileUpdater, TerrariaSaveFileUpdater
+from TreeSaveFileUpdater import MinecraftSaveFileUpdater
+from PackSaveFileUpdater import DiabloIISaveFileUpdater
+from DeltaTransfer import DeltaTransfer
+from CompressedTransfer import get_compressed_transfer
+from BackupRetention import BACKUPSTYLE_TIME
+from MultiWorldSync import MultiWorldSync
+from SyncMetrics import get_metrics_sink
+from StorageBackend import STORAGE_DRIVE
+from LocalStorageBackend import LocalStorageBackend, STORAGE_LOCAL
+
+CONFIG_FILE_NAME = 'config.ini'
+CLIENT_SECRET_FILE_NAME = 'credentials.json'
+
+GAMEPRESET_VALHEIM = 0
+GAMEPRESET_MINECRAFT = 1
+GAMEPRESET_TERRARIA = 2
+GAMEPRESET_DIABLO2 = 3
+
+TRANSFERMODE_FULL = 'full'
+TRANSFERMODE_DELTA = 'delta'
+TRANSFERMODE_COMPRESSED = 'compressed'
+
+# Several worlds can be configured in sections named "World:<name>". The world
+# name defaults to <name>; other keys they leave out come from [General].
+WORLD_SECTION_PREFIX = 'World:'
+
+# Pushes also go to the replicas a world lists by name, each configured in a
+# section named "Replica:<name>" with the drivefolderid, tokenfile, storage
+# and storagepath it uses instead of the world's.
+REPLICA_SECTION_PREFIX = 'Replica:'
+
+
+def get_default_save_file_path():
+    home = os.path.expanduser('~')
+
+    if sys.platform == 'win32':
+        return os.path.join(
+            home, 'AppData', 'LocalLow', 'IronGate', 'Valheim', 'worlds')
+    if sys.platform == 'darwin':
+        return os.path.join(
+            home, 'Library', 'Application Support', 'IronGate', 'Valheim',
+            'worlds')
+
+    # Unity's persistent data path, used by the Linux client and the
+    # dedicated server alike.
+    return os.path.join(
+        home, '.config', 'unity3d', 'IronGate', 'Valheim', 'worlds')
+
+
+def get_default_config():
+    config = configparser.ConfigParser()
+    config['Main'] = {
+        'autoupdate': False
+    }
+
+    config['General'] = {
+        'worldname': "None",
+        'drivefolderid': "None",
+        'gamepreset': GAMEPRESET_VALHEIM,
+        'savefilepath': get_default_save_file_path(),
+        'backupstyle': BACKUPSTYLE_TIME,
+        'transfermode': TRANSFERMODE_FULL,
+        # With local storage, saves are kept in storagepath, e.g. a NAS
+        # share, instead of the Drive folder.
+        'storage': STORAGE_DRIVE,
+        'storagepath': "None",
+        # Names of replicas to push to as well, separated by commas.
+        'replicas': "",
+        # Sync metrics are appended to this file as JSON lines, or kept in it
+        # for the Prometheus textfile collector if it ends in .prom.
+        'metricsfile': "None",
+        'minimizetosystemtrayonclose': 0
+    }
+
+    return config
+
+
+def config_file_exists(config_file_path=CONFIG_FILE_NAME):
+    return os.path.exists(config_file_path)
+
+
+def create_config_file_if_not_exists(config_file_path=CONFIG_FILE_NAME):
+    if not config_file_exists(config_file_path):
+        with open(config_file_path, "w", encoding="utf-8") as config_file:
+            config = get_default_config()
+            config.write(config_file)
+
+
+def load_config(config_file_path=CONFIG_FILE_NAME):
+    config = configparser.ConfigParser()
+
+    with open(config_file_path, "r", encoding="utf-8") as config_file:
+        config.read_file(config_file)
+
+    return config
+
+
+def get_world_configs(config):
+    # Returns (world name, settings) pairs; without any world sections the
+    # [General] world is the only one.
+    world_configs = []
+
+    for section in config.sections():
+        if not section.startswith(WORLD_SECTION_PREFIX):
+            continue
+
+        world_name = section[len(WORLD_SECTION_PREFIX):]
+        world_config = dict(config['General'], worldname=world_name)
+        world_config.update(config[section])
+        world_configs.append((world_name, world_config))
+
+    if len(world_configs) == 0:
+        world_configs.append(
+            (config['General']['worldname'], dict(config['General'])))
+
+    return world_configs
+
+
+def get_config_metrics_sink(config, metrics_file_path=None):
+    if metrics_file_path is None:
+        metrics_file_path = config['General'].get('metricsfile')
+
+    return get_metrics_sink(metrics_file_path)
+
+
+def create_save_file_updater(config,
+                             client_secret_file_name=CLIENT_SECRET_FILE_NAME,
+                             drive_service=None):
+    save_file_updater = create_world_save_file_updater(
+        config['General'], client_secret_file_name, drive_service)
+    save_file_updater.set_replicas(create_replica_updaters(
+        config, config['General'], client_secret_file_name, drive_service))
+    save_file_updater.set_metrics_sink(get_config_metrics_sink(config))
+
+    return save_file_updater
+
+
+def create_multi_world_sync(config,
+                            client_secret_file_name=CLIENT_SECRET_FILE_NAME,
+                            drive_service=None,
+                            world_names=None,
+                            metrics_file_path=None):
+    save_file_updaters = []
+    # One sink for every world, so that they do not write over each other.
+    metrics_sink = get_config_metrics_sink(config, metrics_file_path)
+
+    for world_name, world_config in get_world_configs(config):
+        if world_names is not None and world_name not in world_names:
+            continue
+
+        save_file_updater = create_world_save_file_updater(
+            world_config, client_secret_file_name, drive_service)
+        save_file_updater.set_replicas(create_replica_updaters(
+            config, world_config, client_secret_file_name, drive_service))
+        save_file_updater.set_metrics_sink(metrics_sink)
+        save_file_updaters.append((world_name, save_file_updater))
+
+    return MultiWorldSync(save_file_updaters)
+
+
+def get_replica_names(world_config):
+    return [replica_name.strip()
+            for replica_name in world_config.get('replicas', '').split(',')
+            if replica_name.strip() != '']
+
+
+def create_replica_updaters(config,
+                            world_config,
+                            client_secret_file_name,
+                            drive_service=None):
+    # Returns (replica name, updater) pairs for the replicas of a world.
+    replicas = []
+
+    for replica_name in get_replica_names(world_config):
+        section = REPLICA_SECTION_PREFIX + replica_name
+        if section not in config:
+            raise ValueError(
+                "Replica {} is not configured".format(replica_name))
+
+        # The same world, kept somewhere else.
+        replica_config = dict(world_config, replicas="")
+        replica_config.update(config[section])
+
+        # Another account needs a Drive client of its own.
+        replica_drive_service = drive_service
+        if 'tokenfile' in config[section]:
+            replica_drive_service = None
+
+        replicas.append((replica_name, create_world_save_file_updater(
+            replica_config, client_secret_file_name, replica_drive_service)))
+
+    return replicas
+
+
+def create_world_save_file_updater(world_config,
+                                   client_secret_file_name,
+                                   drive_service=None):
+    game_preset = int(world_config['gamepreset'])
+
+    storage = world_config.get('storage', STORAGE_DRIVE)
+    if storage == STORAGE_LOCAL:
+        # The directory takes the place of the Drive folder.
+        world_config = dict(
+            world_config, drivefolderid=world_config['storagepath'])
+    elif storage != STORAGE_DRIVE:
+        raise ValueError("Storage {} is not supported".format(storage))
+
+    if game_preset == GAMEPRESET_VALHEIM:
+        save_file_updater = ValheimSaveFileUpdater(
+            client_secret_file_name,
+            world_config['drivefolderid'],
+            world_config['savefilepath'],
+            world_config['worldname'],
+            drive_service)
+    elif game_preset == GAMEPRESET_MINECRAFT:
+        save_file_updater = MinecraftSaveFileUpdater(
+            client_secret_file_name,
+            world_config['drivefolderid'],
+            world_config['savefilepath'],
+            world_config['worldname'],
+            drive_service)
+    elif game_preset == GAMEPRESET_TERRARIA:
+        save_file_updater = TerrariaSaveFileUpdater(
+            client_secret_file_name,
+            world_config['drivefolderid'],
+            world_config['savefilepath'],
+            world_config['worldname'],
+            drive_service)
+    elif game_preset == GAMEPRESET_DIABLO2:
+        save_file_updater = DiabloIISaveFileUpdater(
+            client_secret_file_name,
+            world_config['drivefolderid'],
+            world_config['savefilepath'],
+            world_config['worldname'],
+            drive_service)
+    else:
+        raise ValueError(
+            "Game preset {} is not supported yet".format(game_preset))
+
+    if storage == STORAGE_LOCAL:
+        save_file_updater.set_storage_backend(LocalStorageBackend())
+    if world_config.get('tokenfile'):
+        save_file_updater.set_token_file_name(world_config['tokenfile'])
+
+    save_file_updater.set_backup_style(int(world_config['backupstyle']))
+
+    transfer_mode = world_config.get('transfermode', TRANSFERMODE_FULL)
+    if transfer_mode == TRANSFERMODE_DELTA:
+        save_file_updater.set_transfer_strategy(DeltaTransfer())
+    elif transfer_mode == TRANSFERMODE_COMPRESSED:
+        save_file_updater.set_transfer_strategy(get_compressed_transfer())
+
+    return save_file_updater
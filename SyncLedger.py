@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+
+SYNC_LEDGER_FILE_NAME = 'sync_ledger.db'
+
+DIRECTION_NONE = 'none'
+DIRECTION_UPLOAD = 'upload'
+DIRECTION_DOWNLOAD = 'download'
+DIRECTION_CONFLICT = 'conflict'
+
+
+def get_sync_direction(base_md5, local_md5, drive_md5):
+    # Three-way comparison against the content both sides had after the last
+    # sync. A missing local file has an MD5 of "" and a missing remote file
+    # one of None.
+    local_md5 = local_md5 or None
+
+    if local_md5 == drive_md5:
+        return DIRECTION_NONE
+    if local_md5 is None:
+        return DIRECTION_DOWNLOAD
+    if drive_md5 is None:
+        return DIRECTION_UPLOAD
+
+    # Without a last synced version there is no telling which side is newer.
+    if base_md5 is not None:
+        if local_md5 == base_md5:
+            return DIRECTION_DOWNLOAD
+        if drive_md5 == base_md5:
+            return DIRECTION_UPLOAD
+
+    return DIRECTION_CONFLICT
+
+
+def is_recorded(current_entry, entry):
+    if current_entry is None:
+        return False
+
+    return all(current_entry[key] == entry[key]
+               for key in ('md5', 'drive_file_id', 'drive_modified_time'))
+
+
+# Remembers, for every synced file, the content it had on both sides after
+# its last sync and the remote file it was synced with. Rows are grouped by
+# scope, which names the remote folder, and keyed by the local file path.
+class SyncLedger():
+    def __init__(self, ledger_file_path=SYNC_LEDGER_FILE_NAME):
+        self._ledger_file_path = ledger_file_path
+        self._connection = None
+        # Several transfer threads, and several worlds, may share one ledger.
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        # Opened on first use, so that merely starting the application does
+        # not create the database.
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self._ledger_file_path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS synced_files ("
+                    "scope TEXT NOT NULL, "
+                    "path TEXT NOT NULL, "
+                    "md5 TEXT NOT NULL, "
+                    "drive_file_id TEXT, "
+                    "drive_modified_time TEXT, "
+                    "synced_time REAL NOT NULL, "
+                    "PRIMARY KEY (scope, path))")
+
+        return self._connection
+
+    def get_entries(self, scope):
+        # Returns the rows of scope as dicts, by path.
+        with self._lock:
+            rows = self.get_connection().execute(
+                "SELECT path, md5, drive_file_id, drive_modified_time, "
+                "synced_time FROM synced_files WHERE scope = ?", (scope,))
+
+            return {
+                path: {
+                    'path': path,
+                    'md5': md5,
+                    'drive_file_id': drive_file_id,
+                    'drive_modified_time': drive_modified_time,
+                    'synced_time': synced_time
+                }
+                for path, md5, drive_file_id, drive_modified_time, synced_time
+                in rows}
+
+    def record(self, scope, entries):
+        # entries are dicts with path, md5, drive_file_id and
+        # drive_modified_time, written in one transaction. Rows that are
+        # already up to date are not rewritten.
+        current_entries = self.get_entries(scope)
+        entries = [entry for entry in entries
+                   if not is_recorded(
+                       current_entries.get(os.path.abspath(entry['path'])),
+                       entry)]
+        if len(entries) == 0:
+            return
+
+        synced_time = time.time()
+
+        with self._lock:
+            connection = self.get_connection()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO synced_files (scope, path, md5, "
+                    "drive_file_id, drive_modified_time, synced_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(scope, os.path.abspath(entry['path']), entry['md5'],
+                      entry['drive_file_id'], entry['drive_modified_time'],
+                      synced_time)
+                     for entry in entries])
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
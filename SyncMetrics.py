@@ -0,0 +1,216 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+PHASE_CREDENTIALS = 'credentials'
+PHASE_LISTING = 'listing'
+PHASE_HASHING = 'hashing'
+PHASE_BACKUP = 'backup'
+PHASE_TRANSFER = 'transfer'
+
+PHASES = (PHASE_CREDENTIALS, PHASE_LISTING, PHASE_HASHING, PHASE_BACKUP,
+          PHASE_TRANSFER)
+
+COUNTER_BYTES_UPLOADED = 'bytes_uploaded'
+COUNTER_BYTES_DOWNLOADED = 'bytes_downloaded'
+COUNTER_REQUESTS = 'requests'
+COUNTER_RETRIES = 'retries'
+
+COUNTERS = (COUNTER_BYTES_UPLOADED, COUNTER_BYTES_DOWNLOADED,
+            COUNTER_REQUESTS, COUNTER_RETRIES)
+
+OPERATION_PUSH = 'push'
+OPERATION_PULL = 'pull'
+OPERATION_SYNC = 'sync'
+OPERATION_STATUS = 'status'
+OPERATION_LIST = 'list'
+OPERATION_DRAIN = 'drain'
+
+PROMETHEUS_FILE_EXTENSION = '.prom'
+
+# The metrics of the operation running on this thread. Worker threads started
+# for an operation are handed the same metrics by the transfer scheduler.
+_current = threading.local()
+
+
+def get_current_metrics():
+    return getattr(_current, 'metrics', None)
+
+
+@contextlib.contextmanager
+def activate_metrics(metrics):
+    previous_metrics = get_current_metrics()
+    _current.metrics = metrics
+
+    try:
+        yield metrics
+    finally:
+        _current.metrics = previous_metrics
+
+
+@contextlib.contextmanager
+def metric_span(phase):
+    # Times the block as part of phase, if an operation is being recorded.
+    metrics = get_current_metrics()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_span(phase, time.perf_counter() - start)
+
+
+def count_metric(counter, count=1):
+    metrics = get_current_metrics()
+    if metrics is not None:
+        metrics.add(counter, count)
+
+
+# Figures of one sync operation of one world. Phase times are summed over
+# every thread that worked in the phase, so with parallel transfers they can
+# add up to more than the elapsed time.
+class SyncMetrics():
+    def __init__(self, operation, scope, world_name):
+        self._operation = operation
+        self._scope = scope
+        self._world_name = world_name
+        self._lock = threading.Lock()
+
+        self._phase_seconds = {phase: 0.0 for phase in PHASES}
+        self._phase_counts = {phase: 0 for phase in PHASES}
+        self._counters = {counter: 0 for counter in COUNTERS}
+
+        self._start_timestamp = time.time()
+        self._start = time.perf_counter()
+
+    def add_span(self, phase, seconds):
+        with self._lock:
+            self._phase_seconds[phase] += seconds
+            self._phase_counts[phase] += 1
+
+    def add(self, counter, count=1):
+        with self._lock:
+            self._counters[counter] += count
+
+    def get_report(self, error=None):
+        with self._lock:
+            return {
+                'operation': self._operation,
+                'scope': self._scope,
+                'world': self._world_name,
+                'timestamp': self._start_timestamp,
+                'elapsed': time.perf_counter() - self._start,
+                'phases': {
+                    phase: {
+                        'seconds': self._phase_seconds[phase],
+                        'count': self._phase_counts[phase]
+                    }
+                    for phase in PHASES},
+                'counters': dict(self._counters),
+                'error': None if error is None else str(error)
+            }
+
+
+# Appends every report as one line of JSON.
+class JsonLinesMetricsSink():
+    def __init__(self, file_path):
+        self._file_path = file_path
+        self._lock = threading.Lock()
+
+    def write(self, report):
+        line = json.dumps(report, sort_keys=True) + '\n'
+
+        with self._lock:
+            with open(self._file_path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+
+def get_prometheus_labels(labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+# Keeps a file for the textfile collector of the Prometheus node exporter up
+# to date with the last report of every operation of every world.
+class PrometheusTextfileMetricsSink():
+    def __init__(self, file_path):
+        self._file_path = file_path
+        self._lock = threading.Lock()
+        self._reports = {}
+
+    def write(self, report):
+        with self._lock:
+            key = (report['scope'], str(report['world']), report['operation'])
+            self._reports[key] = report
+            text = self.format_reports(
+                [self._reports[key] for key in sorted(self._reports)])
+
+            # The collector may read the file at any moment.
+            temp_file_path = self._file_path + '.tmp'
+            with open(temp_file_path, "w", encoding="utf-8") as file:
+                file.write(text)
+            os.replace(temp_file_path, self._file_path)
+
+    def format_reports(self, reports):
+        metrics = [
+            ('vdsu_sync_timestamp_seconds', 'gauge',
+             "Start of the last sync operation.",
+             lambda report: [((), report['timestamp'])]),
+            ('vdsu_sync_duration_seconds', 'gauge',
+             "Duration of the last sync operation.",
+             lambda report: [((), report['elapsed'])]),
+            ('vdsu_sync_success', 'gauge',
+             "1 if the last sync operation finished without an error.",
+             lambda report: [((), int(report['error'] is None))]),
+            ('vdsu_sync_phase_seconds', 'gauge',
+             "Time spent in each phase of the last sync operation, summed "
+             "over threads.",
+             lambda report: [
+                 ((('phase', phase),), report['phases'][phase]['seconds'])
+                 for phase in PHASES]),
+            ('vdsu_sync_bytes', 'gauge',
+             "Bytes moved by the last sync operation.",
+             lambda report: [
+                 ((('direction', 'upload'),),
+                  report['counters'][COUNTER_BYTES_UPLOADED]),
+                 ((('direction', 'download'),),
+                  report['counters'][COUNTER_BYTES_DOWNLOADED])]),
+            ('vdsu_sync_requests', 'gauge',
+             "Drive requests sent by the last sync operation.",
+             lambda report: [((), report['counters'][COUNTER_REQUESTS])]),
+            ('vdsu_sync_retries', 'gauge',
+             "Drive requests retried by the last sync operation.",
+             lambda report: [((), report['counters'][COUNTER_RETRIES])])
+        ]
+
+        lines = []
+        for name, metric_type, help_text, get_samples in metrics:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+
+            for report in reports:
+                for labels, value in get_samples(report):
+                    labels = (('scope', report['scope']),
+                              ('world', report['world']),
+                              ('operation', report['operation'])) + labels
+                    lines.append('{}{{{}}} {}'.format(
+                        name, get_prometheus_labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics_sink(file_path):
+    # Picks the format by extension; no file means no metrics.
+    if not file_path or file_path == 'None':
+        return None
+    if file_path.endswith(PROMETHEUS_FILE_EXTENSION):
+        return PrometheusTextfileMetricsSink(file_path)
+
+    return JsonLinesMetricsSink(file_path)
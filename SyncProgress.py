@@ -0,0 +1,79 @@
+import contextlib
+import threading
+import time
+
+# The progress of the sync operation running on each thread.
+_current = threading.local()
+
+
+class SyncCancelledError(Exception):
+    pass
+
+
+class SyncProgress():
+    def __init__(self, callback=None):
+        # callback(done_bytes, total_bytes, bytes_per_second, eta_seconds) is
+        # called from whichever transfer thread made progress.
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+        self._total_bytes = 0
+        self._done_bytes = 0
+        self._start_time = time.perf_counter()
+
+    def add_total_bytes(self, count):
+        with self._lock:
+            self._total_bytes += count
+
+        self.notify()
+
+    def advance(self, count):
+        with self._lock:
+            self._done_bytes += count
+
+        self.notify()
+
+    def get_state(self):
+        with self._lock:
+            done_bytes = self._done_bytes
+            total_bytes = self._total_bytes
+
+        elapsed = time.perf_counter() - self._start_time
+        bytes_per_second = done_bytes / elapsed if elapsed > 0 else 0.0
+
+        if bytes_per_second > 0:
+            eta_seconds = max(total_bytes - done_bytes, 0) / bytes_per_second
+        else:
+            eta_seconds = -1.0
+
+        return done_bytes, total_bytes, bytes_per_second, eta_seconds
+
+    def notify(self):
+        if self._callback is not None:
+            self._callback(*self.get_state())
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise SyncCancelledError("Sync cancelled")
+
+
+def get_current_sync_progress():
+    return getattr(_current, 'sync_progress', None)
+
+
+@contextlib.contextmanager
+def activate_sync_progress(sync_progress):
+    previous_sync_progress = get_current_sync_progress()
+    _current.sync_progress = sync_progress
+
+    try:
+        yield sync_progress
+    finally:
+        _current.sync_progress = previous_sync_progress
@@ -0,0 +1,105 @@
+import os
+
+from PyQt5.QtCore import QObject, QThread, QFileSystemWatcher, pyqtSignal
+
+from SyncProgress import SyncProgress, activate_sync_progress
+from SaveFileWatcher import SaveFileWatcher
+
+SYNC_DIRECTION_LOCAL = 'local'
+SYNC_DIRECTION_DRIVE = 'drive'
+
+
+class SyncWorker(QObject):
+    # done bytes, total bytes, bytes per second, ETA in seconds (-1 if unknown)
+    progressChanged = pyqtSignal('qint64', 'qint64', float, float)
+    finished = pyqtSignal(str, list)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, save_file_updater, direction, parent=None):
+        QObject.__init__(self, parent)
+
+        self._save_file_updater = save_file_updater
+        self._direction = direction
+        self._sync_progress = SyncProgress(self.progressChanged.emit)
+
+    def run(self):
+        try:
+            with activate_sync_progress(self._sync_progress):
+                if self._direction == SYNC_DIRECTION_LOCAL:
+                    report = self._save_file_updater.update_local()
+                else:
+                    report = self._save_file_updater.update_drive()
+        except Exception as exception:
+            self.failed.emit(self._direction, str(exception))
+            return
+
+        self.finished.emit(self._direction, report)
+
+    def cancel(self):
+        # Safe to call from the GUI thread; transfers stop at their next
+        # chunk boundary.
+        self._sync_progress.cancel()
+
+
+def start_sync_worker(save_file_updater, direction, parent=None):
+    thread = QThread(parent)
+    worker = SyncWorker(save_file_updater, direction)
+    worker.moveToThread(thread)
+
+    thread.started.connect(worker.run)
+    worker.finished.connect(thread.quit)
+    worker.failed.connect(thread.quit)
+    thread.finished.connect(worker.deleteLater)
+    thread.finished.connect(thread.deleteLater)
+
+    thread.start()
+
+    return thread, worker
+
+
+class AutoUpdateWatcher(QObject):
+    # Emitted on the GUI thread once a burst of save writes has settled.
+    saveSettled = pyqtSignal()
+
+    def __init__(self, directory_path, file_paths, parent=None):
+        QObject.__init__(self, parent)
+
+        self._directory_path = directory_path
+        self._file_paths = list(file_paths)
+
+        # The polling watcher decides when a save has settled. Filesystem
+        # notifications only make it look sooner, so it still works where
+        # they are unavailable.
+        self._save_file_watcher = SaveFileWatcher(
+            self._file_paths, self.saveSettled.emit)
+
+        self._file_system_watcher = QFileSystemWatcher(self)
+        self._file_system_watcher.directoryChanged.connect(self.on_changed)
+        self._file_system_watcher.fileChanged.connect(self.on_changed)
+
+    def start(self):
+        if os.path.isdir(self._directory_path):
+            self._file_system_watcher.addPath(self._directory_path)
+        self.watch_existing_files()
+
+        self._save_file_watcher.start()
+
+    def stop(self):
+        self._save_file_watcher.stop()
+
+        watched_paths = self._file_system_watcher.files() + \
+            self._file_system_watcher.directories()
+        if len(watched_paths) > 0:
+            self._file_system_watcher.removePaths(watched_paths)
+
+    def watch_existing_files(self):
+        # Games often replace a save instead of rewriting it, which drops the
+        # file from the watch list.
+        watched_files = self._file_system_watcher.files()
+        for file_path in self._file_paths:
+            if file_path not in watched_files and os.path.exists(file_path):
+                self._file_system_watcher.addPath(file_path)
+
+    def on_changed(self, path):
+        self.watch_existing_files()
+        self._save_file_watcher.notify()
@@ -0,0 +1,141 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from SyncProgress import SyncCancelledError, get_current_sync_progress, \
+    activate_sync_progress
+from SyncMetrics import get_current_metrics, activate_metrics
+
+# Enough to overlap every file of the multi-file presets without opening a
+# connection storm against Drive.
+MAX_TRANSFER_WORKERS = 4
+
+OUTCOME_UNCHANGED = 'unchanged'
+OUTCOME_UPLOADED = 'uploaded'
+OUTCOME_COPIED = 'copied'
+OUTCOME_DOWNLOADED = 'downloaded'
+OUTCOME_SKIPPED = 'skipped'
+OUTCOME_FAILED = 'failed'
+OUTCOME_CANCELLED = 'cancelled'
+# Changed locally and on Drive since the last sync; nothing was transferred.
+OUTCOME_CONFLICT = 'conflict'
+# Drive could not be reached; the upload waits in the upload queue.
+OUTCOME_QUEUED = 'queued'
+
+
+def get_outcome(file_name, status, error=None, elapsed=0.0):
+    return {
+        'name': file_name,
+        'status': status,
+        'error': error,
+        'elapsed': elapsed
+    }
+
+
+def get_failed_outcomes(report):
+    return [outcome for outcome in report
+            if outcome['status'] == OUTCOME_FAILED]
+
+
+def get_conflicting_outcomes(report):
+    return [outcome for outcome in report
+            if outcome['status'] == OUTCOME_CONFLICT]
+
+
+def get_queued_outcomes(report):
+    return [outcome for outcome in report
+            if outcome['status'] == OUTCOME_QUEUED]
+
+
+def is_cancelled(report):
+    return any(outcome['status'] == OUTCOME_CANCELLED for outcome in report)
+
+
+def with_current_operation(function):
+    # Lets worker threads count towards the sync operation that started
+    # them, and report its progress.
+    metrics = get_current_metrics()
+    sync_progress = get_current_sync_progress()
+    if metrics is None and sync_progress is None:
+        return function
+
+    def run_in_operation(*args):
+        with activate_metrics(metrics), \
+                activate_sync_progress(sync_progress):
+            return function(*args)
+
+    return run_in_operation
+
+
+class TransferScheduler():
+    def __init__(self, max_workers=MAX_TRANSFER_WORKERS):
+        self._max_workers = max_workers
+        # The worker threads live as long as the scheduler, so their Drive
+        # connections are reused from one sync to the next. A task may
+        # schedule tasks of its own, as a replica push does for its files;
+        # each nesting level has a pool of its own so that they never wait
+        # on each other for a worker.
+        self._executors = []
+        self._executors_lock = threading.Lock()
+        self._nesting = threading.local()
+
+    def get_executor(self):
+        depth = getattr(self._nesting, 'depth', 0)
+
+        with self._executors_lock:
+            while len(self._executors) <= depth:
+                self._executors.append(
+                    ThreadPoolExecutor(max_workers=self._max_workers))
+
+            return self._executors[depth]
+
+    def with_nesting(self, function):
+        depth = getattr(self._nesting, 'depth', 0) + 1
+
+        def run_nested(*args):
+            self._nesting.depth = depth
+            return function(*args)
+
+        return run_nested
+
+    def shutdown(self):
+        with self._executors_lock:
+            executors = self._executors
+            self._executors = []
+
+        for executor in executors:
+            executor.shutdown()
+
+    def run_task(self, task, file_name):
+        start = time.perf_counter()
+
+        try:
+            status = task(file_name)
+            error = None
+        except SyncCancelledError as exception:
+            status = OUTCOME_CANCELLED
+            error = exception
+        except Exception as exception:
+            status = OUTCOME_FAILED
+            error = exception
+
+        return get_outcome(
+            file_name, status, error, time.perf_counter() - start)
+
+    def map(self, function, items):
+        if len(items) == 0:
+            return []
+
+        return list(self.get_executor().map(
+            self.with_nesting(with_current_operation(function)), items))
+
+    def run(self, file_names, task):
+        if len(file_names) == 0:
+            return []
+
+        executor = self.get_executor()
+        run_task = self.with_nesting(with_current_operation(self.run_task))
+        futures = [executor.submit(run_task, task, file_name)
+                   for file_name in file_names]
+
+        return [future.result() for future in futures]
@@ -0,0 +1,252 @@
+import contextlib
+import hashlib
+import json
+import os
+import re
+import time
+
+from SyncMetrics import COUNTER_BYTES_UPLOADED, COUNTER_BYTES_DOWNLOADED, \
+    count_metric
+
+# Transfers move in pieces of this size, which sets how often progress is
+# reported and how quickly a cancellation takes effect.
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Resumable upload chunks are sized so that each one takes about
+# UPLOAD_CHUNK_SECONDS at the throughput of the previous upload. Drive
+# requires them to be multiples of 256 KiB.
+UPLOAD_CHUNK_SECONDS = 4.0
+UPLOAD_CHUNK_GRANULARITY = 256 * 1024
+MIN_UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Drive appProperties used to describe how a remote save is stored. Files
+# without them are plain copies of the save.
+TRANSFER_FORMAT_PROPERTY = 'vdsuFormat'
+CONTENT_MD5_PROPERTY = 'vdsuMd5'
+
+TRANSFER_FORMAT_FULL = 'full'
+
+# Downloads are written next to the save under this suffix and only moved
+# over it once verified.
+TEMP_FILE_SUFFIX = '.vdsu_tmp'
+
+
+class ChecksumMismatchError(IOError):
+    pass
+
+
+class HashingWriter():
+    def __init__(self, file):
+        self._file = file
+        self._md5 = hashlib.md5()
+
+    def write(self, data):
+        self._md5.update(data)
+        self._file.write(data)
+        return len(data)
+
+    def get_md5_string(self):
+        return self._md5.hexdigest()
+
+    def check_md5(self, expected_md5, file_path):
+        if expected_md5 is not None and self.get_md5_string() != expected_md5:
+            raise ChecksumMismatchError(
+                "Checksum mismatch while downloading " + file_path)
+
+
+@contextlib.contextmanager
+def open_atomic_file(file_path, hash_cache=None):
+    # Yields a HashingWriter over a temporary file in the same directory,
+    # which replaces file_path only if the block finishes without raising.
+    # A failed or cancelled transfer leaves the existing save untouched.
+    # The MD5 computed while writing goes into hash_cache, if given, so the
+    # next sync does not read the file again.
+    temp_file_path = file_path + TEMP_FILE_SUFFIX
+
+    try:
+        with open(temp_file_path, "wb") as file:
+            writer = HashingWriter(file)
+            yield writer
+
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_file_path, file_path)
+
+        if hash_cache is not None:
+            hash_cache.set_md5_string(file_path, writer.get_md5_string())
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+
+def get_transfer_format(drive_file_info):
+    app_properties = drive_file_info.get('appProperties') or {}
+    return app_properties.get(TRANSFER_FORMAT_PROPERTY, TRANSFER_FORMAT_FULL)
+
+
+def get_content_md5(drive_file_info):
+    # The MD5 of the save itself, which differs from md5Checksum whenever the
+    # save is stored in an encoded form.
+    app_properties = drive_file_info.get('appProperties') or {}
+    return app_properties.get(
+        CONTENT_MD5_PROPERTY, drive_file_info.get('md5Checksum'))
+
+
+def get_app_properties(transfer_format, md5):
+    return {
+        TRANSFER_FORMAT_PROPERTY: transfer_format,
+        CONTENT_MD5_PROPERTY: md5
+    }
+
+
+def create_upload_request(updater, metadata, media):
+    # Metadata with an id replaces the content of that file, which Drive keeps
+    # as a new revision, instead of creating another file.
+    files = updater.get_drive_service().files()
+
+    if 'id' not in metadata:
+        return files.create(body=metadata, media_body=media, fields='id')
+
+    body = {key: value for key, value in metadata.items()
+            if key not in ('id', 'parents')}
+    return files.update(fileId=metadata['id'], body=body, media_body=media,
+                        fields='id')
+
+
+def download_media(updater, file_id, file):
+    from googleapiclient.http import MediaIoBaseDownload
+
+    sync_progress = updater.get_sync_progress()
+    request = updater.get_drive_service().files().get_media(fileId=file_id)
+    downloader = MediaIoBaseDownload(
+        file, request, chunksize=TRANSFER_CHUNK_SIZE)
+
+    received_bytes = 0
+    total_bytes = None
+
+    done = False
+    while done is False:
+        sync_progress.check_cancelled()
+        status, done = updater.get_request_executor().next_chunk(downloader)
+
+        if total_bytes is None and status.total_size is not None:
+            total_bytes = status.total_size
+            sync_progress.add_total_bytes(total_bytes)
+
+        sync_progress.advance(status.resumable_progress - received_bytes)
+        count_metric(COUNTER_BYTES_DOWNLOADED,
+                     status.resumable_progress - received_bytes)
+        received_bytes = status.resumable_progress
+
+    return received_bytes
+
+
+def get_upload_chunk_size(updater):
+    # Picked once, when the media of an upload is built.
+    bytes_per_second = updater.get_request_executor().get_upload_throughput()
+    if bytes_per_second is None:
+        return TRANSFER_CHUNK_SIZE
+
+    target_size = int(bytes_per_second * UPLOAD_CHUNK_SECONDS)
+    target_size = max(
+        MIN_UPLOAD_CHUNK_SIZE, min(MAX_UPLOAD_CHUNK_SIZE, target_size))
+
+    return target_size - target_size % UPLOAD_CHUNK_GRANULARITY
+
+
+def resume_upload(updater, request, resumable_uri, total_bytes):
+    # Asks Drive how much of an interrupted session it already has, with the
+    # status query of the resumable upload protocol, and lets the request
+    # continue from there. Returns the response if the session had already
+    # been completed, and None otherwise.
+    from googleapiclient.errors import HttpError
+
+    def query():
+        resp, content = request.http.request(
+            resumable_uri, method='PUT', headers={
+                'Content-Length': '0',
+                'Content-Range': 'bytes */{}'.format(total_bytes)})
+        if resp.status not in (200, 201, 308):
+            raise HttpError(resp, content, uri=resumable_uri)
+
+        return resp, content
+
+    resp, content = updater.get_request_executor().call(
+        query, idempotent=True)
+
+    request.resumable_uri = resumable_uri
+    if resp.status != 308:
+        request.resumable_progress = total_bytes
+        return json.loads(content)
+
+    # The Range header is missing when Drive has none of the file yet.
+    match = re.fullmatch(r'bytes=0-(\d+)', resp.get('range', ''))
+    request.resumable_progress = 0 if match is None else \
+        int(match.group(1)) + 1
+
+    return None
+
+
+def upload_media(updater, request, media, on_chunk=None, idempotent=False):
+    # on_chunk(resumable_uri, offset) is called after every chunk the server
+    # has committed. A resumable upload can always be resumed; an upload sent
+    # in one request is only retried if it replaces the content of a file.
+    sync_progress = updater.get_sync_progress()
+    total_bytes = media.size()
+    sync_progress.add_total_bytes(total_bytes)
+
+    if not media.resumable():
+        sync_progress.check_cancelled()
+        response = updater.execute_request(request, idempotent)
+        sync_progress.advance(total_bytes)
+        count_metric(COUNTER_BYTES_UPLOADED, total_bytes)
+        return response
+
+    sent_bytes = 0
+    resumed_bytes = request.resumable_progress
+    seconds = 0.0
+    response = None
+    while response is None:
+        sync_progress.check_cancelled()
+
+        start = time.perf_counter()
+        status, response = updater.get_request_executor().next_chunk(request)
+        seconds += time.perf_counter() - start
+
+        if status is not None:
+            sync_progress.advance(status.resumable_progress - sent_bytes)
+            sent_bytes = status.resumable_progress
+
+            if on_chunk is not None:
+                on_chunk(request.resumable_uri, sent_bytes)
+
+    sync_progress.advance(total_bytes - sent_bytes)
+    count_metric(COUNTER_BYTES_UPLOADED, total_bytes)
+
+    # Sizes the chunks of the uploads that follow. Smaller uploads mostly
+    # measure the latency.
+    if total_bytes - resumed_bytes >= MIN_UPLOAD_CHUNK_SIZE:
+        updater.get_request_executor().record_upload_throughput(
+            total_bytes - resumed_bytes, seconds)
+
+    return response
+
+
+class FullFileTransfer():
+    transfer_format = TRANSFER_FORMAT_FULL
+
+    def upload(self, updater, metadata, file_path, md5):
+        if md5 is not None:
+            # Marks the file as a plain copy again if it replaces one that
+            # was stored in another format.
+            metadata = dict(metadata, appProperties=get_app_properties(
+                self.transfer_format, md5))
+
+        return updater.upload_to_drive(metadata, file_path, md5)
+
+    def download(self, updater, drive_file_info, file_path):
+        return updater.download_from_drive(
+            drive_file_info['id'], file_path,
+            drive_file_info.get('md5Checksum'))
@@ -0,0 +1,183 @@
+import os
+import posixpath
+import threading
+
+from SaveFileUpdater import SaveFileUpdater
+from RemoteTreeTracker import RemoteTreeTracker, FOLDER_MIME_TYPE
+from LocalBackupStore import get_local_backup_store, BACKUP_FOLDER_NAME
+from TransferStrategy import TEMP_FILE_SUFFIX
+
+
+def get_folder_query(name, parent_id):
+    return "name = '{}' and '{}' in parents and mimeType = '{}' " \
+        "and trashed = false".format(
+            name.replace("\\", "\\\\").replace("'", "\\'"), parent_id,
+            FOLDER_MIME_TYPE)
+
+
+# Syncs a world that is a whole directory tree rather than a few files. The
+# world folder is mirrored into a folder of the same name on Drive, and files
+# are named by their path relative to it, e.g. "region/r.0.0.mca".
+#
+# Changed files are overwritten in place, so Drive keeps the old versions as
+# revisions instead of the renamed backups used for single file saves.
+class TreeSaveFileUpdater(SaveFileUpdater):
+    renames_drive_backups = False
+
+    # Files the game holds open or writes while running.
+    excluded_file_names = ()
+
+    def __init__(self,
+                 client_secret_file_name,
+                 drive_folder_id,
+                 local_directory_path,
+                 world_name,
+                 drive_service=None):
+        super().__init__(
+            client_secret_file_name,
+            drive_folder_id,
+            os.path.join(local_directory_path, world_name),
+            drive_service)
+
+        self._world_name = world_name
+        self._world_folder_id = None
+        # Creating a folder twice would split the tree on Drive.
+        self._folder_lock = threading.RLock()
+
+        # Backups are kept next to the world rather than inside it, where the
+        # game would see them.
+        self._backup_store = get_local_backup_store(os.path.join(
+            local_directory_path, BACKUP_FOLDER_NAME, world_name))
+
+    def get_manifest_key(self):
+        return (self._drive_folder_id, self._world_name)
+
+    def get_remote_folder_path(self):
+        return os.path.join(self._drive_folder_id, self._world_name)
+
+    def get_world_folder_id(self):
+        with self._folder_lock:
+            if self._world_folder_id is None:
+                self._world_folder_id = self.find_or_create_drive_folder(
+                    self._world_name, self._drive_folder_id)
+
+            return self._world_folder_id
+
+    def find_or_create_drive_folder(self, name, parent_id):
+        files = self.execute_request(self.get_drive_service().files().list(
+            q=get_folder_query(name, parent_id),
+            fields='files(id)'), idempotent=True).get('files', [])
+        if len(files) > 0:
+            return files[0]['id']
+
+        return self.execute_request(self.get_drive_service().files().create(
+            body={
+                'name': name,
+                'mimeType': FOLDER_MIME_TYPE,
+                'parents': [parent_id]
+            },
+            fields='id'))['id']
+
+    def get_drive_folder_id(self, path):
+        # Returns the id of the Drive folder mirroring path, creating it and
+        # its parents as needed.
+        change_tracker = self.get_change_tracker()
+
+        with self._folder_lock:
+            folder_id = change_tracker.get_folder_id(path)
+            if folder_id is not None:
+                return folder_id
+
+            parent_path, name = posixpath.split(path)
+            folder_id = self.execute_request(
+                self.get_drive_service().files().create(
+                    body={
+                        'name': name,
+                        'mimeType': FOLDER_MIME_TYPE,
+                        'parents': [self.get_drive_folder_id(parent_path)]
+                    },
+                    fields='id'))['id']
+            change_tracker.add_folder(folder_id, path)
+
+            return folder_id
+
+    def get_change_tracker(self):
+        owner = self._shared_state_owner
+        if owner is not None and \
+                owner.get_manifest_key() == self.get_manifest_key():
+            return owner.get_change_tracker()
+
+        with self._folder_lock:
+            if self._change_tracker is None:
+                self._change_tracker = RemoteTreeTracker(
+                    self.get_drive_service(),
+                    self.get_world_folder_id(),
+                    request_executor=self._request_executor)
+
+            return self._change_tracker
+
+    def get_upload_metadata(self, file_name, drive_file_info):
+        parent_path, name = posixpath.split(file_name)
+
+        if drive_file_info is not None:
+            return {
+                'id': drive_file_info['id'],
+                'name': name
+            }
+
+        return {
+            'name': name,
+            'parents': [self.get_drive_folder_id(parent_path)]
+        }
+
+    def is_excluded(self, file_name):
+        return posixpath.basename(file_name) in self.excluded_file_names or \
+            file_name.endswith(TEMP_FILE_SUFFIX)
+
+    def get_local_file_names(self):
+        file_names = []
+
+        for directory_path, directory_names, names in \
+                os.walk(self._local_directory_path):
+            directory_names.sort()
+            relative_path = os.path.relpath(
+                directory_path, self._local_directory_path)
+
+            for name in sorted(names):
+                file_name = name if relative_path == os.curdir else \
+                    posixpath.join(
+                        relative_path.replace(os.sep, '/'), name)
+
+                if not self.is_excluded(file_name):
+                    file_names.append(file_name)
+
+        return file_names
+
+    def update_file_names(self, remote_manifest):
+        # Files that only exist on Drive are downloaded; files deleted on
+        # either side are not deleted on the other.
+        file_names = self.get_local_file_names()
+
+        local_file_names = set(file_names)
+        file_names.extend(sorted(
+            entry['name'] for entry in remote_manifest.entries()
+            if entry['name'] not in local_file_names and
+            not self.is_excluded(entry['name'])))
+
+        self._file_names = file_names
+
+    def get_local_file_paths(self):
+        return [self._local_directory_path + file_name
+                for file_name in self.get_local_file_names()]
+
+    def update_local_file(self, file_name, remote_manifest, current_time):
+        local_file_path = self._local_directory_path + file_name
+        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+
+        return super().update_local_file(
+            file_name, remote_manifest, current_time)
+
+
+class MinecraftSaveFileUpdater(TreeSaveFileUpdater):
+    # The game keeps session.lock open for as long as the world is loaded.
+    excluded_file_names = ('session.lock',)
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+import time
+
+UPLOAD_JOURNAL_FILE_NAME = 'upload_journal.json'
+
+# Drive keeps a resumable session for about a week; older ones are not
+# worth trying.
+SESSION_LIFETIME_SECONDS = 6 * 24 * 60 * 60
+
+
+def get_journal_key(scope, file_path):
+    # A file pushed to several folders has a session for each of them.
+    return json.dumps([scope, os.path.abspath(file_path)])
+
+
+class UploadJournal():
+    def __init__(self, journal_file_path=UPLOAD_JOURNAL_FILE_NAME):
+        self._journal_file_path = journal_file_path
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self._journal_file_path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            entries = {}
+
+        # Entries keyed by the path alone do not say which folder their
+        # session uploads to; those uploads start over.
+        self._entries = {key: entry for key, entry in entries.items()
+                         if key.startswith('[')}
+
+    def save(self):
+        temp_file_path = self._journal_file_path + '.tmp'
+        with open(temp_file_path, "w", encoding="utf-8") as file:
+            json.dump(self._entries, file)
+        os.replace(temp_file_path, self._journal_file_path)
+
+    def get(self, scope, file_path, md5):
+        # Returns the session an interrupted upload of exactly this content
+        # left behind, if it can still be resumed.
+        with self._lock:
+            entry = self._entries.get(get_journal_key(scope, file_path))
+
+        if entry is None or entry['md5'] != md5:
+            return None
+
+        if time.time() - entry['created'] > SESSION_LIFETIME_SECONDS:
+            return None
+
+        return entry
+
+    def record(self, scope, file_path, md5, resumable_uri, offset):
+        key = get_journal_key(scope, file_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['resumable_uri'] != resumable_uri:
+                entry = {
+                    'md5': md5,
+                    'resumable_uri': resumable_uri,
+                    'created': time.time()
+                }
+                self._entries[key] = entry
+
+            entry['offset'] = offset
+            self.save()
+
+    def remove(self, scope, file_path):
+        with self._lock:
+            if self._entries.pop(
+                    get_journal_key(scope, file_path), None) is not None:
+                self.save()
@@ -0,0 +1,114 @@
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+UPLOAD_QUEUE_FILE_NAME = 'upload_queue.json'
+
+# How long to wait before checking again whether Drive can be reached. The
+# wait doubles after every failed attempt.
+MIN_DRAIN_RETRY_SECONDS = 5.0
+MAX_DRAIN_RETRY_SECONDS = 300.0
+
+NETWORK_ERRNOS = (errno.ENETDOWN, errno.ENETUNREACH, errno.EHOSTDOWN,
+                  errno.EHOSTUNREACH)
+
+
+def get_queue_key(scope, file_path):
+    # A file pushed to several folders is queued for each of them.
+    return json.dumps([scope, os.path.abspath(file_path)])
+
+
+def is_network_error(exception):
+    # True for errors that mean Drive could not be reached at all, as
+    # opposed to Drive answering with an error.
+    if isinstance(exception, (ConnectionError, TimeoutError)):
+        return True
+
+    try:
+        import httplib2
+        if isinstance(exception, httplib2.ServerNotFoundError):
+            return True
+    except ImportError:
+        pass
+
+    try:
+        # Refreshing the credentials is the first thing to fail offline.
+        from google.auth.exceptions import TransportError
+        if isinstance(exception, TransportError):
+            return True
+    except ImportError:
+        pass
+
+    # Name resolution and routing errors, which are not ConnectionErrors.
+    if isinstance(exception, (socket.gaierror, socket.herror)):
+        return True
+
+    return isinstance(exception, OSError) and \
+        exception.errno in NETWORK_ERRNOS
+
+
+# Saves that could not be pushed because Drive was unreachable. There is at
+# most one entry per file: queueing a file again replaces its entry, and the
+# push that drains it sends whatever the file holds by then, so a long
+# offline session still ends in one upload per file.
+class UploadQueue():
+    def __init__(self, queue_file_path=UPLOAD_QUEUE_FILE_NAME):
+        self._queue_file_path = queue_file_path
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self._queue_file_path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            entries = {}
+
+        # Older queues were keyed by the path alone.
+        self._entries = {
+            key if key.startswith('[') else get_queue_key(entry['scope'], key):
+            entry
+            for key, entry in entries.items()}
+
+    def save(self):
+        temp_file_path = self._queue_file_path + '.tmp'
+        with open(temp_file_path, "w", encoding="utf-8") as file:
+            json.dump(self._entries, file)
+        os.replace(temp_file_path, self._queue_file_path)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get_entries(self, scope):
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()
+                    if entry['scope'] == scope]
+
+    def put(self, scope, file_name, file_path, md5):
+        key = get_queue_key(scope, file_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            self._entries[key] = {
+                'scope': scope,
+                'name': file_name,
+                'md5': md5,
+                'queued': time.time() if entry is None else entry['queued'],
+                'replaced': 0 if entry is None else
+                entry['replaced'] + (entry['md5'] != md5)
+            }
+            self.save()
+
+    def remove(self, scope, file_paths):
+        with self._lock:
+            removed = [self._entries.pop(get_queue_key(scope, file_path), None)
+                       for file_path in file_paths]
+
+            if any(entry is not None for entry in removed):
+                self.save()
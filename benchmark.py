@@ -0,0 +1,1412 @@
+import argparse
+import configparser
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from HashCache import HashCache, HASH_CACHE_FILE_NAME, get_md5_string
+from DriveRequest import DriveRequestExecutor
+from FakeDriveService import FakeDriveService
+from SaveFileUpdater import ValheimSaveFileUpdater, get_backup_file_name
+from TreeSaveFileUpdater import TreeSaveFileUpdater, \
+    MinecraftSaveFileUpdater
+from PackSaveFileUpdater import DiabloIISaveFileUpdater
+from TransferStrategy import FullFileTransfer, get_content_md5
+from DeltaTransfer import DeltaTransfer
+from MultiWorldSync import MultiWorldSync
+from BackupRetention import get_backup_time_string
+from LocalStorageBackend import LocalStorageBackend
+
+
+STARTUP_TARGET_SECONDS = 0.3
+
+# Runs in a fresh interpreter from the start of main.py until the window has
+# been shown and painted once.
+STARTUP_SCRIPT = '''
+import sys
+import time
+start = time.perf_counter()
+sys.path.insert(0, {package_path!r})
+from PyQt5.QtWidgets import QApplication
+import main
+app = QApplication(sys.argv)
+window = main.MainWindow()
+window.show()
+app.processEvents()
+print(time.perf_counter() - start)
+'''
+
+
+def get_peak_rss_kb():
+    if resource is None:
+        return -1
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+
+    return peak_rss
+
+
+def get_read_bytes():
+    # Bytes this process has read through system calls, page cache hits
+    # included, or -1 where the kernel does not tell.
+    try:
+        with open('/proc/self/io', "r", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return -1
+
+
+def create_sample_file(file_path, size_mb):
+    block = os.urandom(1024 * 1024)
+    with open(file_path, "wb") as file:
+        for _ in range(size_mb):
+            file.write(block)
+
+
+def read_all_md5_string(file_path):
+    # The original implementation, kept as the baseline to compare against.
+    with open(file_path, "rb") as file:
+        return hashlib.md5(file.read()).hexdigest()
+
+
+def run_hash_method(method, file_path, cache_file_path):
+    hash_cache = None
+    if method == 'read_all':
+        hash_function = read_all_md5_string
+    elif method == 'streaming':
+        hash_function = get_md5_string
+    else:
+        hash_cache = HashCache(cache_file_path)
+        hash_function = hash_cache.get_md5_string
+
+    start = time.perf_counter()
+    md5 = hash_function(file_path)
+    elapsed = time.perf_counter() - start
+
+    if hash_cache is not None:
+        hash_cache.save()
+
+    print("{} {:.4f} {}".format(md5, elapsed, get_peak_rss_kb()))
+
+
+def measure_in_subprocess(method, file_path, cache_file_path):
+    # Peak RSS is a per-process high-water mark, so every method runs in a
+    # fresh interpreter.
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '_hash',
+        method, file_path, cache_file_path])
+    md5, elapsed, peak_rss = output.decode().split()
+
+    return md5, float(elapsed), int(peak_rss)
+
+
+def benchmark_hash(size_mb):
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'world.db')
+        cache_file_path = os.path.join(directory, 'hash_cache.json')
+        create_sample_file(file_path, size_mb)
+
+        print("Hashing a {} MB file".format(size_mb))
+        print("{:<14}{:>12}{:>16}".format("method", "wall (s)", "peak RSS (KB)"))
+
+        for method in ['read_all', 'streaming', 'cache_cold', 'cache_warm']:
+            md5, elapsed, peak_rss = measure_in_subprocess(
+                method, file_path, cache_file_path)
+            print("{:<14}{:>12.4f}{:>16}".format(method, elapsed, peak_rss))
+
+
+def modify_sample_file(file_path, offsets):
+    with open(file_path, "r+b") as file:
+        for offset in offsets:
+            file.seek(offset)
+            file.write(os.urandom(4096))
+
+
+def create_fake_updater(drive_service, folder_id, directory, transfer_strategy):
+    updater = ValheimSaveFileUpdater(
+        None, folder_id, directory, 'world', drive_service)
+    updater.set_transfer_strategy(transfer_strategy)
+
+    return updater
+
+
+def benchmark_transfer(size_mb):
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            print("Syncing a {} MB world, then changing 3 regions".format(
+                size_mb))
+            print("{:<8}{:>16}{:>16}{:>12}".format(
+                "mode", "push (bytes)", "pull (bytes)", "requests"))
+
+            for transfer_strategy in [FullFileTransfer(), DeltaTransfer()]:
+                run_transfer_scenario(directory, size_mb, transfer_strategy)
+        finally:
+            os.chdir(current_directory)
+
+
+def run_transfer_scenario(directory, size_mb, transfer_strategy):
+    transfer_format = transfer_strategy.transfer_format
+    drive_service = FakeDriveService()
+    folder = drive_service.files().create(
+        body={'name': 'worlds'}).execute()
+
+    source_directory = os.path.join(directory, transfer_format, 'source')
+    target_directory = os.path.join(directory, transfer_format, 'target')
+    os.makedirs(source_directory)
+    os.makedirs(target_directory)
+
+    source_path = os.path.join(source_directory, 'world.db')
+    target_path = os.path.join(target_directory, 'world.db')
+    create_sample_file(source_path, size_mb)
+    create_sample_file(os.path.join(source_directory, 'world.fwl'), 0)
+
+    source = create_fake_updater(
+        drive_service, folder['id'], source_directory, transfer_strategy)
+    target = create_fake_updater(
+        drive_service, folder['id'], target_directory, transfer_strategy)
+
+    source.update_drive()
+    target.update_local()
+
+    size = size_mb * 1024 * 1024
+    modify_sample_file(source_path, [0, size // 2, size - 4096])
+
+    drive_service.reset_counters()
+    source.update_drive()
+    pushed = drive_service.bytes_uploaded
+
+    drive_service.reset_counters()
+    target.update_local()
+    pulled = drive_service.bytes_downloaded
+
+    if get_md5_string(source_path) != get_md5_string(target_path):
+        raise AssertionError(
+            "{} transfer produced a different world".format(transfer_format))
+
+    print("{:<8}{:>16}{:>16}{:>12}".format(
+        transfer_format, pushed, pulled, drive_service.request_count))
+
+
+def write_benchmark_config(directory, save_file_path):
+    config = configparser.ConfigParser()
+    config['Main'] = {'autoupdate': False}
+    config['General'] = {
+        'worldname': 'world',
+        'drivefolderid': 'benchmark',
+        'gamepreset': 0,
+        'savefilepath': save_file_path,
+        'backupstyle': 0,
+        'minimizetosystemtrayonclose': 0
+    }
+
+    with open(os.path.join(directory, 'config.ini'), "w",
+              encoding="utf-8") as config_file:
+        config.write(config_file)
+
+
+def benchmark_startup(runs):
+    environment = dict(os.environ)
+    if sys.platform.startswith('linux') and 'DISPLAY' not in environment:
+        environment.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    script = STARTUP_SCRIPT.format(
+        package_path=os.path.dirname(os.path.abspath(__file__)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_benchmark_config(directory, directory)
+
+        print("Launching MainWindow {} times (target {:.0f} ms)".format(
+            runs, STARTUP_TARGET_SECONDS * 1000))
+        print("{:<6}{:>16}{:>16}".format("run", "visible (ms)", "process (ms)"))
+
+        visible_times = []
+        for run in range(runs):
+            start = time.perf_counter()
+            output = subprocess.check_output(
+                [sys.executable, '-c', script],
+                cwd=directory,
+                env=environment,
+                stderr=subprocess.DEVNULL)
+            process_time = time.perf_counter() - start
+
+            visible_time = float(output.decode().split()[-1])
+            visible_times.append(visible_time)
+            print("{:<6}{:>16.1f}{:>16.1f}".format(
+                run, visible_time * 1000, process_time * 1000))
+
+        visible_times.sort()
+        median = visible_times[len(visible_times) // 2]
+        print("median {:.1f} ms: {}".format(
+            median * 1000,
+            "PASS" if median < STARTUP_TARGET_SECONDS else "FAIL"))
+
+
+def benchmark_dedup(size_mb):
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            print("Pushing a {} MB world, a newer version, then rolling "
+                  "back".format(size_mb))
+            print("{:<16}{:>16}{:>12}{:>10}".format(
+                "mode", "push (bytes)", "requests", "status"))
+
+            for transfer_strategy in [FullFileTransfer(), DeltaTransfer()]:
+                run_dedup_scenario(directory, size_mb, transfer_strategy)
+        finally:
+            os.chdir(current_directory)
+
+
+def run_dedup_scenario(directory, size_mb, transfer_strategy):
+    transfer_format = transfer_strategy.transfer_format
+    drive_service = FakeDriveService()
+    folder = drive_service.files().create(
+        body={'name': 'worlds'}).execute()
+
+    save_directory = os.path.join(directory, transfer_format)
+    os.makedirs(save_directory)
+    save_path = os.path.join(save_directory, 'world.db')
+    create_sample_file(save_path, size_mb)
+    create_sample_file(os.path.join(save_directory, 'world.fwl'), 0)
+
+    updater = create_fake_updater(
+        drive_service, folder['id'], save_directory, transfer_strategy)
+    updater.update_drive()
+
+    old_save_path = os.path.join(directory, transfer_format + '.old')
+    with open(save_path, "rb") as source, open(old_save_path, "wb") as file:
+        file.write(source.read())
+
+    modify_sample_file(save_path, [0])
+    updater.update_drive()
+
+    os.replace(old_save_path, save_path)
+    drive_service.reset_counters()
+    report = updater.update_drive()
+
+    statuses = {outcome['name']: outcome['status'] for outcome in report}
+    print("{:<16}{:>16}{:>12}{:>10}".format(
+        transfer_format + " rollback", drive_service.bytes_uploaded,
+        drive_service.request_count, statuses['world.db']))
+
+    restored_path = os.path.join(directory, transfer_format + '.restored')
+    os.makedirs(restored_path)
+    restored = create_fake_updater(
+        drive_service, folder['id'], restored_path, transfer_strategy)
+    restored.update_local()
+
+    if get_md5_string(save_path) != \
+            get_md5_string(os.path.join(restored_path, 'world.db')):
+        raise AssertionError(
+            "{} rollback produced a different world".format(transfer_format))
+
+
+def create_world_updaters(drive_service, folder_ids, directory, world_count):
+    updaters = []
+
+    for index in range(world_count):
+        world_name = 'world{}'.format(index)
+        create_sample_file(os.path.join(directory, world_name + '.db'), 1)
+        create_sample_file(os.path.join(directory, world_name + '.fwl'), 0)
+
+        updater = ValheimSaveFileUpdater(
+            None, folder_ids[index % len(folder_ids)], directory, world_name,
+            drive_service)
+        updaters.append((world_name, updater))
+
+    return updaters
+
+
+def run_worlds_scenario(directory, world_count, latency_seconds, batched):
+    drive_service = FakeDriveService()
+    folder_ids = [drive_service.files().create(body={'name': name}).execute()
+                  ['id'] for name in ['valheim', 'terraria']]
+    drive_service.latency_seconds = latency_seconds
+
+    updaters = create_world_updaters(
+        drive_service, folder_ids, directory, world_count)
+    if batched:
+        multi_world_sync = MultiWorldSync(updaters)
+
+    timings = []
+    for _ in range(2):
+        drive_service.reset_counters()
+        start = time.perf_counter()
+
+        if batched:
+            multi_world_sync.update_drive()
+            multi_world_sync.wait_for_pruning()
+        else:
+            for _, updater in updaters:
+                updater.update_drive()
+                updater.wait_for_pruning()
+
+        timings.append((time.perf_counter() - start,
+                        drive_service.request_count))
+
+        for world_name, _ in updaters:
+            modify_sample_file(
+                os.path.join(directory, world_name + '.db'), [0])
+
+    if batched:
+        multi_world_sync.close()
+    else:
+        for _, updater in updaters:
+            updater.close()
+
+    return timings
+
+
+def benchmark_worlds(world_count, latency_ms):
+    print("Pushing {} worlds in 2 folders, {} ms per request, then again "
+          "after changing every world".format(world_count, latency_ms))
+    print("{:<12}{:>14}{:>12}{:>14}{:>12}".format(
+        "mode", "first (s)", "requests", "second (s)", "requests"))
+
+    for mode, batched in [('one by one', False), ('batched', True)]:
+        with tempfile.TemporaryDirectory() as directory:
+            current_directory = os.getcwd()
+            os.chdir(directory)
+
+            try:
+                timings = run_worlds_scenario(
+                    directory, world_count, latency_ms / 1000, batched)
+            finally:
+                os.chdir(current_directory)
+
+        print("{:<12}{:>14.2f}{:>12}{:>14.2f}{:>12}".format(
+            mode, timings[0][0], timings[0][1], timings[1][0], timings[1][1]))
+
+
+def create_tree_world(world_path, file_count, file_size):
+    # Roughly the layout of a Minecraft world: region files for three
+    # dimensions, player data and a few files at the top.
+    folder_names = ['region', 'DIM-1/region', 'DIM1/region', 'playerdata',
+                    'data', 'entities', 'poi']
+    file_names = ['level.dat', 'level.dat_old', 'session.lock']
+
+    for index in range(file_count - len(file_names)):
+        folder_name = folder_names[index % len(folder_names)]
+        file_names.append('{}/r.{}.{}.mca'.format(
+            folder_name, index // len(folder_names), index % 3))
+
+    for file_name in file_names:
+        file_path = os.path.join(world_path, file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            file.write(os.urandom(file_size))
+
+    return [file_name for file_name in file_names
+            if file_name != 'session.lock']
+
+
+def get_tree_md5s(world_path, file_names):
+    return [read_all_md5_string(os.path.join(world_path, file_name))
+            for file_name in file_names]
+
+
+def run_tree_scenario(directory, file_count, changed_count, latency_seconds):
+    drive_service = FakeDriveService()
+    folder_id = drive_service.files().create(
+        body={'name': 'minecraft'}).execute()['id']
+    drive_service.latency_seconds = latency_seconds
+
+    saves_path = os.path.join(directory, 'saves')
+    file_names = create_tree_world(
+        os.path.join(saves_path, 'world'), file_count, 2048)
+    updater = MinecraftSaveFileUpdater(
+        None, folder_id, saves_path, 'world', drive_service)
+
+    timings = []
+
+    def measure(name, sync):
+        drive_service.reset_counters()
+        start = time.perf_counter()
+        report = sync()
+        timings.append((name, time.perf_counter() - start,
+                        drive_service.request_count, len(report)))
+
+    measure('first push', updater.update_drive)
+    measure('unchanged', updater.update_drive)
+
+    for file_name in file_names[-changed_count:]:
+        modify_sample_file(os.path.join(saves_path, 'world', file_name), [0])
+    measure('{} changed'.format(changed_count), updater.update_drive)
+
+    # A second machine with an empty saves folder pulls the whole world.
+    other_saves_path = os.path.join(directory, 'other_saves')
+    other_updater = MinecraftSaveFileUpdater(
+        None, folder_id, other_saves_path, 'world', drive_service)
+    measure('pull', other_updater.update_local)
+
+    matches = get_tree_md5s(os.path.join(saves_path, 'world'), file_names) == \
+        get_tree_md5s(os.path.join(other_saves_path, 'world'), file_names)
+
+    return timings, matches
+
+
+def benchmark_tree(file_count, changed_count, latency_ms):
+    print("Syncing a world of {} files, {} ms per request".format(
+        file_count, latency_ms))
+    print("{:<16}{:>12}{:>12}{:>10}".format(
+        "sync", "time (s)", "requests", "files"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            timings, matches = run_tree_scenario(
+                directory, file_count, changed_count, latency_ms / 1000)
+        finally:
+            os.chdir(current_directory)
+
+    for name, elapsed, request_count, report_count in timings:
+        print("{:<16}{:>12.2f}{:>12}{:>10}".format(
+            name, elapsed, request_count, report_count))
+
+    print("pulled world matches: {}".format("PASS" if matches else "FAIL"))
+
+
+def create_diablo2_saves(save_path, character_count):
+    os.makedirs(save_path)
+
+    file_names = []
+    for index in range(character_count):
+        for extension, size in [('.d2s', 8192), ('.key', 300), ('.ma0', 2048),
+                                ('.map', 32)]:
+            file_names.append('Char{}{}'.format(index, extension))
+            with open(os.path.join(save_path, file_names[-1]), "wb") as file:
+                file.write(os.urandom(size))
+
+    return file_names
+
+
+def create_small_file_updater(drive_service, folder_id, saves_path, packed):
+    if packed:
+        return DiabloIISaveFileUpdater(
+            None, folder_id, os.path.join(saves_path, 'save'), 'Diablo II',
+            drive_service)
+
+    # One Drive file per save file, as any other preset would store them.
+    return TreeSaveFileUpdater(
+        None, folder_id, saves_path, 'save', drive_service)
+
+
+def run_pack_scenario(directory, character_count, latency_seconds, packed):
+    drive_service = FakeDriveService()
+    folder_id = drive_service.files().create(
+        body={'name': 'diablo2'}).execute()['id']
+    drive_service.latency_seconds = latency_seconds
+
+    saves_path = os.path.join(directory, 'saves')
+    file_names = create_diablo2_saves(
+        os.path.join(saves_path, 'save'), character_count)
+    updater = create_small_file_updater(
+        drive_service, folder_id, saves_path, packed)
+
+    other_saves_path = os.path.join(directory, 'other_saves')
+    os.makedirs(os.path.join(other_saves_path, 'save'))
+    other_updater = create_small_file_updater(
+        drive_service, folder_id, other_saves_path, packed)
+
+    timings = []
+
+    def measure(name, sync):
+        drive_service.reset_counters()
+        start = time.perf_counter()
+        sync()
+        timings.append((name, time.perf_counter() - start,
+                        drive_service.request_count,
+                        drive_service.bytes_downloaded))
+
+    measure('first push', updater.update_drive)
+    measure('first pull', other_updater.update_local)
+
+    # A play session changes one character and the shared stash.
+    for file_name in file_names[:2]:
+        modify_sample_file(os.path.join(saves_path, 'save', file_name), [0])
+    measure('push 2 changed', updater.update_drive)
+    measure('pull 2 changed', other_updater.update_local)
+    updater.wait_for_pruning()
+
+    matches = all(
+        read_all_md5_string(os.path.join(saves_path, 'save', file_name)) ==
+        read_all_md5_string(os.path.join(other_saves_path, 'save', file_name))
+        for file_name in file_names)
+
+    return timings, matches
+
+
+def benchmark_pack(character_count, latency_ms):
+    print("Syncing {} small save files, {} ms per request".format(
+        character_count * 4, latency_ms))
+    print("{:<10}{:<18}{:>10}{:>12}{:>16}".format(
+        "mode", "sync", "time (s)", "requests", "downloaded (B)"))
+
+    results = []
+    for mode, packed in [('per file', False), ('pack', True)]:
+        with tempfile.TemporaryDirectory() as directory:
+            current_directory = os.getcwd()
+            os.chdir(directory)
+
+            try:
+                timings, matches = run_pack_scenario(
+                    directory, character_count, latency_ms / 1000, packed)
+            finally:
+                os.chdir(current_directory)
+
+        for name, elapsed, request_count, bytes_downloaded in timings:
+            print("{:<10}{:<18}{:>10.2f}{:>12}{:>16}".format(
+                mode, name, elapsed, request_count, bytes_downloaded))
+        results.append(matches)
+
+    print("pulled saves match: {}".format("PASS" if all(results) else "FAIL"))
+
+
+def check_retry_counters(name, request_executor, round_trips, retries):
+    stats = request_executor.get_stats()
+    passed = stats['round_trips'] == round_trips and \
+        stats['retries'] == retries
+
+    print("{:<28}{:>12}{:>10}  {}".format(
+        name, stats['round_trips'], stats['retries'],
+        "PASS" if passed else "FAIL"))
+
+    return passed
+
+
+def run_http_retry_scenario(name, responses, round_trips, retries,
+                            create=False):
+    # Listing files can be retried on any transient error; creating one only
+    # when Drive turned the request away.
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpMockSequence
+
+    drive_service = build(
+        'drive', 'v3', http=HttpMockSequence(responses),
+        static_discovery=True)
+    request_executor = DriveRequestExecutor(sleep=lambda seconds: None)
+
+    try:
+        if create:
+            request_executor.execute(
+                drive_service.files().create(body={'name': 'world.db'}))
+        else:
+            request_executor.execute(
+                drive_service.files().list(), idempotent=True)
+    except Exception as exception:
+        print("{}: gave up with {}".format(name, exception))
+
+    return check_retry_counters(name, request_executor, round_trips, retries)
+
+
+def run_batch_retry_scenario(directory):
+    drive_service = FakeDriveService()
+    folder = drive_service.files().create(
+        body={'name': 'worlds'}).execute()
+
+    create_sample_file(os.path.join(directory, 'world.db'), 1)
+    create_sample_file(os.path.join(directory, 'world.fwl'), 1)
+
+    updater = create_fake_updater(
+        drive_service, folder['id'], directory, FullFileTransfer())
+    updater.update_drive()
+
+    modify_sample_file(os.path.join(directory, 'world.db'), [0])
+    modify_sample_file(os.path.join(directory, 'world.fwl'), [0])
+
+    request_executor = DriveRequestExecutor(sleep=lambda seconds: None)
+    updater = create_fake_updater(
+        drive_service, folder['id'], directory, FullFileTransfer())
+    updater.set_request_executor(request_executor)
+
+    # Listing changes fails once, the backup batch fails as a whole once and
+    # then for one of its two renames, and one upload chunk fails.
+    drive_service.fail_next_requests = [
+        503, None,
+        429, None, 500, None,
+        None, None,
+        503]
+    report = updater.update_drive()
+
+    uploaded = all(outcome['status'] == 'uploaded' for outcome in report)
+    if not uploaded:
+        print("batched backups: {}".format(report))
+
+    passed = check_retry_counters(
+        "batched backups + uploads", request_executor, 8, 4)
+    batched_requests = request_executor.get_stats()['batched_requests']
+    print("renames sent in batches: {} (2 + 1 retried)".format(
+        batched_requests))
+
+    return passed and uploaded and batched_requests == 3
+
+
+def run_offline_scenario(directory, save_count):
+    drive_service = FakeDriveService()
+    folder_id = drive_service.files().create(
+        body={'name': 'valheim'}).execute()['id']
+
+    world_path = os.path.join(directory, 'world.db')
+    create_sample_file(world_path, 1)
+    create_sample_file(os.path.join(directory, 'world.fwl'), 0)
+
+    updater = ValheimSaveFileUpdater(
+        None, folder_id, directory, 'world', drive_service)
+    # Failed requests are retried without waiting.
+    updater.set_request_executor(
+        DriveRequestExecutor(sleep=lambda seconds: None))
+    updater.update_drive()
+
+    drive_service.offline = True
+    statuses = set()
+    for _ in range(save_count):
+        modify_sample_file(world_path, [0])
+        statuses.update(outcome['status'] for outcome in updater.update_drive())
+    queued_file_names = updater.get_queued_file_names()
+
+    # The queue would normally be checked every few seconds.
+    updater.start_draining_upload_queue(0.05, 0.2)
+    drive_service.reset_counters()
+    drive_service.offline = False
+
+    deadline = time.monotonic() + 10
+    while len(updater.get_queued_file_names()) > 0 and \
+            time.monotonic() < deadline:
+        time.sleep(0.05)
+    updater.stop_draining_upload_queue()
+    updater.wait_for_pruning()
+
+    drive_md5 = get_content_md5(updater.get_remote_manifest().get('world.db'))
+    return {
+        'statuses': statuses,
+        'queued': queued_file_names,
+        'left': updater.get_queued_file_names(),
+        'bytes_uploaded': drive_service.bytes_uploaded,
+        'requests': drive_service.request_count,
+        'latest': drive_md5 == read_all_md5_string(world_path)
+    }
+
+
+def benchmark_offline(save_count):
+    print("Saving a 1 MB world {} times while Drive is unreachable, then "
+          "reconnecting".format(save_count))
+
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            result = run_offline_scenario(directory, save_count)
+        finally:
+            os.chdir(current_directory)
+
+    print("push outcomes while offline: {}".format(
+        ", ".join(sorted(result['statuses']))))
+    print("queued files: {}".format(", ".join(sorted(result['queued']))))
+    print("after reconnect: {} requests, {} bytes uploaded".format(
+        result['requests'], result['bytes_uploaded']))
+
+    passed = result['statuses'] == {'queued'} and \
+        len(result['left']) == 0 and result['latest'] and \
+        result['bytes_uploaded'] == 1024 * 1024
+    print("one upload of the latest save: {}".format(
+        "PASS" if passed else "FAIL"))
+
+
+def run_storage_scenario(directory, name, size_mb, create_updater):
+    saves_path = os.path.join(directory, name, 'saves')
+    other_saves_path = os.path.join(directory, name, 'pull')
+    os.makedirs(saves_path)
+    os.makedirs(other_saves_path)
+
+    world_path = os.path.join(saves_path, 'world.db')
+    create_sample_file(world_path, size_mb)
+    create_sample_file(os.path.join(saves_path, 'world.fwl'), 0)
+    with open(world_path, "rb") as file:
+        first_version = file.read(4096)
+
+    updater = create_updater(saves_path)
+    other_updater = create_updater(other_saves_path)
+
+    times = []
+    start = time.perf_counter()
+    updater.update_drive()
+    times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    other_updater.update_local()
+    times.append(time.perf_counter() - start)
+
+    modify_sample_file(world_path, [0])
+    # Backups are named by the time, to the microsecond.
+    updater.update_drive()
+
+    # Rolling back finds the first version among the backups.
+    with open(world_path, "r+b") as file:
+        file.write(first_version)
+    start = time.perf_counter()
+    outcomes = updater.update_drive()
+    times.append(time.perf_counter() - start)
+    updater.wait_for_pruning()
+
+    rolled_back = [outcome['status'] for outcome in outcomes
+                   if outcome['name'] == 'world.db'] == ['copied']
+    matches = read_all_md5_string(world_path) == read_all_md5_string(
+        os.path.join(other_saves_path, 'world.db'))
+
+    print("{:<8}{:>12.2f}{:>12.2f}{:>16.2f}".format(name, *times))
+
+    return rolled_back, matches
+
+
+def benchmark_storage(size_mb, latency_ms, bandwidth_mbps):
+    print("Pushing and pulling a {} MB world on a fake Drive ({} ms, {}) "
+          "and in a local directory".format(
+              size_mb, latency_ms,
+              "{} Mbit/s".format(bandwidth_mbps) if bandwidth_mbps > 0
+              else "unlimited"))
+    print("{:<8}{:>12}{:>12}{:>16}".format(
+        "storage", "push (s)", "pull (s)", "rollback (s)"))
+
+    drive_service = FakeDriveService()
+    drive_service.latency_seconds = latency_ms / 1000
+    if bandwidth_mbps > 0:
+        drive_service.bandwidth_bytes_per_second = \
+            bandwidth_mbps * 1000 * 1000 / 8
+    folder_id = drive_service.files().create(
+        body={'name': 'valheim'}).execute()['id']
+
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+
+        storage_path = os.path.join(directory, 'share')
+        os.makedirs(storage_path)
+
+        def create_drive_updater(saves_path):
+            return ValheimSaveFileUpdater(
+                None, folder_id, saves_path, 'world', drive_service)
+
+        def create_local_updater(saves_path):
+            updater = ValheimSaveFileUpdater(
+                None, storage_path, saves_path, 'world')
+            updater.set_storage_backend(LocalStorageBackend())
+            return updater
+
+        try:
+            results = [
+                run_storage_scenario(
+                    directory, 'drive', size_mb, create_drive_updater),
+                run_storage_scenario(
+                    directory, 'local', size_mb, create_local_updater)]
+        finally:
+            os.chdir(current_directory)
+
+    print("rollbacks copied without uploading: {}".format(
+        "PASS" if all(rolled_back for rolled_back, _ in results)
+        else "FAIL"))
+    print("pulled worlds match: {}".format(
+        "PASS" if all(matches for _, matches in results) else "FAIL"))
+
+
+def create_replica_services(count, latency_ms, bandwidth_mbps):
+    # One fake account per destination, each with a link of its own.
+    destinations = []
+
+    for _ in range(count):
+        drive_service = FakeDriveService()
+        drive_service.latency_seconds = latency_ms / 1000
+        if bandwidth_mbps > 0:
+            drive_service.bandwidth_bytes_per_second = \
+                bandwidth_mbps * 1000 * 1000 / 8
+        folder_id = drive_service.files().create(
+            body={'name': 'valheim'}).execute()['id']
+        destinations.append((drive_service, folder_id))
+
+    return destinations
+
+
+def run_replicas_scenario(directory, size_mb, count, latency_ms,
+                          bandwidth_mbps, fan_out):
+    saves_path = os.path.join(
+        directory, 'fan-out' if fan_out else 'separate')
+    os.makedirs(saves_path)
+    create_sample_file(os.path.join(saves_path, 'world.db'), size_mb)
+    create_sample_file(os.path.join(saves_path, 'world.fwl'), 0)
+
+    destinations = create_replica_services(count, latency_ms, bandwidth_mbps)
+
+    def create_updater(destination):
+        drive_service, folder_id = destination
+        return ValheimSaveFileUpdater(
+            None, folder_id, saves_path, 'world', drive_service)
+
+    # The world is hashed before either run, as a save that was just
+    # written would be by the watcher.
+    updater = create_updater(destinations[0])
+    updater.get_local_file_infos()
+    updater._hash_cache.save()
+
+    read_bytes = get_read_bytes()
+    start = time.perf_counter()
+
+    report = []
+    if fan_out:
+        # Set up as SyncConfig does, so that the replicas write to the
+        # state files of this updater rather than to copies of their own.
+        updater = create_updater(destinations[0])
+        updater.set_replicas([
+            ('replica {}'.format(index), create_updater(destination))
+            for index, destination in enumerate(destinations[1:], 1)])
+        report = updater.update_drive()
+    else:
+        # Like one configuration per destination, run one after another.
+        for destination in destinations:
+            report.extend(create_updater(destination).update_drive())
+
+    elapsed = time.perf_counter() - start
+    read_bytes = get_read_bytes() - read_bytes if read_bytes >= 0 else -1
+
+    uploaded = all(outcome['status'] == 'uploaded' for outcome in report)
+    received = all(drive_service.bytes_uploaded >= size_mb * 1024 * 1024
+                   for drive_service, _ in destinations)
+
+    print("{:<10}{:>12.2f}{:>16.1f}".format(
+        'fan-out' if fan_out else 'separate', elapsed,
+        read_bytes / 1024 / 1024 if read_bytes >= 0 else -1))
+
+    return uploaded and received
+
+
+def benchmark_replicas(size_mb, count, latency_ms, bandwidth_mbps):
+    print("Pushing a {} MB world to {} Drive accounts ({} ms, {} each)".format(
+        size_mb, count, latency_ms,
+        "{} Mbit/s".format(bandwidth_mbps) if bandwidth_mbps > 0
+        else "unlimited"))
+    print("{:<10}{:>12}{:>16}".format("mode", "push (s)", "read (MB)"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            results = [
+                run_replicas_scenario(
+                    directory, size_mb, count, latency_ms, bandwidth_mbps,
+                    fan_out)
+                for fan_out in (False, True)]
+        finally:
+            os.chdir(current_directory)
+
+    print("every destination received the world: {}".format(
+        "PASS" if all(results) else "FAIL"))
+
+
+def benchmark_retry():
+    error = json.dumps({'error': {'errors': [{'reason': 'backendError'}]}})
+    files = json.dumps({'files': []})
+
+    print("{:<28}{:>12}{:>10}".format("scenario", "round trips", "retries"))
+
+    results = [
+        run_http_retry_scenario("503, 429, 200", [
+            ({'status': '503'}, error),
+            ({'status': '429', 'retry-after': '0'}, error),
+            ({'status': '200'}, files)], 3, 2),
+        run_http_retry_scenario("404 is not retried", [
+            ({'status': '404'}, error)], 1, 0),
+        run_http_retry_scenario("gives up after 7 tries", [
+            ({'status': '503'}, error)] * 7, 7, 6),
+        run_http_retry_scenario("create is not retried on 503", [
+            ({'status': '503'}, error)], 1, 0, create=True),
+        run_http_retry_scenario("create is retried on 429", [
+            ({'status': '429', 'retry-after': '0'}, error),
+            ({'status': '200'}, json.dumps({'id': 'world'}))], 2, 1,
+            create=True)
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        current_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            results.append(run_batch_retry_scenario(directory))
+        finally:
+            os.chdir(current_directory)
+
+    print("all scenarios: {}".format("PASS" if all(results) else "FAIL"))
+
+
+SUITE_SCENARIOS = ['large_db', 'small_files', 'many_backups']
+
+# A step is a regression if it got this much slower than the baseline, and
+# by more than SUITE_NOISE_SECONDS. Request and byte counts do not depend on
+# the machine, so any increase counts.
+SUITE_TOLERANCE = 0.2
+SUITE_NOISE_SECONDS = 0.1
+
+
+class SuiteRecorder():
+    def __init__(self, drive_service):
+        self._drive_service = drive_service
+        self.results = []
+
+    def measure(self, scenario, step, updater, sync):
+        self._drive_service.reset_counters()
+        start = time.perf_counter()
+
+        sync()
+        # Expired backups are trashed in the background, but are part of the
+        # cost of a push.
+        updater.wait_for_pruning()
+
+        elapsed = time.perf_counter() - start
+        metrics_report = updater.get_last_metrics_report()
+
+        self.results.append({
+            'scenario': scenario,
+            'step': step,
+            'seconds': elapsed,
+            'requests': self._drive_service.request_count,
+            'bytes_uploaded': self._drive_service.bytes_uploaded,
+            'bytes_downloaded': self._drive_service.bytes_downloaded,
+            'phases': {phase: phase_report['seconds'] for phase, phase_report
+                       in metrics_report['phases'].items()}
+        })
+
+
+def clear_hash_cache():
+    # Updaters created afterwards start without any cached MD5.
+    if os.path.exists(HASH_CACHE_FILE_NAME):
+        os.remove(HASH_CACHE_FILE_NAME)
+
+
+def run_large_db_suite(recorder, drive_service, folder_id, directory,
+                       size_mb):
+    scenario = 'large_db'
+    saves_path = os.path.join(directory, 'large_db')
+    os.makedirs(saves_path)
+    world_path = os.path.join(saves_path, 'world.db')
+    create_sample_file(world_path, size_mb)
+    create_sample_file(os.path.join(saves_path, 'world.fwl'), 0)
+
+    def create_updater(path):
+        return ValheimSaveFileUpdater(
+            None, folder_id, path, 'world', drive_service)
+
+    updater = create_updater(saves_path)
+    recorder.measure(scenario, 'first push, cold cache', updater,
+                     updater.update_drive)
+    recorder.measure(scenario, 'unchanged, warm cache', updater,
+                     updater.update_drive)
+
+    clear_hash_cache()
+    updater = create_updater(saves_path)
+    recorder.measure(scenario, 'unchanged, cold cache', updater,
+                     updater.update_drive)
+
+    modify_sample_file(world_path, [0, size_mb * 1024 * 1024 // 2])
+    recorder.measure(scenario, 'changed, warm cache', updater,
+                     updater.update_drive)
+
+    other_saves_path = os.path.join(directory, 'large_db_pull')
+    os.makedirs(other_saves_path)
+    other_updater = create_updater(other_saves_path)
+    recorder.measure(scenario, 'pull to empty folder', other_updater,
+                     other_updater.update_local)
+
+    return read_all_md5_string(world_path) == \
+        read_all_md5_string(os.path.join(other_saves_path, 'world.db'))
+
+
+def run_small_files_suite(recorder, drive_service, folder_id, directory,
+                          file_count):
+    scenario = 'small_files'
+    saves_path = os.path.join(directory, 'small_files')
+    world_path = os.path.join(saves_path, 'world')
+    file_names = create_tree_world(world_path, file_count, 2048)
+
+    def create_updater(path):
+        return MinecraftSaveFileUpdater(
+            None, folder_id, path, 'world', drive_service)
+
+    updater = create_updater(saves_path)
+    recorder.measure(scenario, 'first push, cold cache', updater,
+                     updater.update_drive)
+    recorder.measure(scenario, 'unchanged, warm cache', updater,
+                     updater.update_drive)
+
+    clear_hash_cache()
+    updater = create_updater(saves_path)
+    recorder.measure(scenario, 'unchanged, cold cache', updater,
+                     updater.update_drive)
+
+    for file_name in file_names[-20:]:
+        modify_sample_file(os.path.join(world_path, file_name), [0])
+    recorder.measure(scenario, '20 changed, warm cache', updater,
+                     updater.update_drive)
+
+    other_saves_path = os.path.join(directory, 'small_files_pull')
+    other_updater = create_updater(other_saves_path)
+    recorder.measure(scenario, 'pull to empty folder', other_updater,
+                     other_updater.update_local)
+
+    return get_tree_md5s(world_path, file_names) == get_tree_md5s(
+        os.path.join(other_saves_path, 'world'), file_names)
+
+
+def run_many_backups_suite(recorder, drive_service, folder_id, directory,
+                           backup_count):
+    scenario = 'many_backups'
+    saves_path = os.path.join(directory, 'many_backups')
+    os.makedirs(saves_path)
+    world_path = os.path.join(saves_path, 'world.db')
+    create_sample_file(world_path, 1)
+    create_sample_file(os.path.join(saves_path, 'world.fwl'), 0)
+
+    def create_updater(path):
+        return ValheimSaveFileUpdater(
+            None, folder_id, path, 'world', drive_service)
+
+    updater = create_updater(saves_path)
+    updater.update_drive()
+
+    # Backups left by months of hourly saves, created directly on the fake
+    # Drive so that they cost no requests.
+    now = datetime.datetime.now()
+    for index in range(backup_count):
+        drive_service.create_file({
+            'name': get_backup_file_name('world.db', get_backup_time_string(
+                now - datetime.timedelta(hours=index + 1))),
+            'parents': [folder_id]
+        }, b'backup')
+
+    modify_sample_file(world_path, [0])
+    recorder.measure(scenario, 'changed, warm cache', updater,
+                     updater.update_drive)
+    recorder.measure(scenario, 'unchanged, warm cache', updater,
+                     updater.update_drive)
+    recorder.measure(scenario, 'status', updater, updater.get_sync_status)
+
+    clear_hash_cache()
+    other_saves_path = os.path.join(directory, 'many_backups_pull')
+    os.makedirs(other_saves_path)
+    other_updater = create_updater(other_saves_path)
+    recorder.measure(scenario, 'pull to empty folder', other_updater,
+                     other_updater.update_local)
+
+    return read_all_md5_string(world_path) == \
+        read_all_md5_string(os.path.join(other_saves_path, 'world.db'))
+
+
+def run_suite(directory, scenarios, settings):
+    drive_service = FakeDriveService()
+    drive_service.latency_seconds = settings['latency_ms'] / 1000
+    if settings['bandwidth_mbps'] > 0:
+        drive_service.bandwidth_bytes_per_second = \
+            settings['bandwidth_mbps'] * 1000 * 1000 / 8
+
+    recorder = SuiteRecorder(drive_service)
+    checks = {}
+
+    for scenario in scenarios:
+        folder_id = drive_service.files().create(
+            body={'name': scenario}).execute()['id']
+
+        if scenario == 'large_db':
+            checks[scenario] = run_large_db_suite(
+                recorder, drive_service, folder_id, directory,
+                settings['db_mb'])
+        elif scenario == 'small_files':
+            checks[scenario] = run_small_files_suite(
+                recorder, drive_service, folder_id, directory,
+                settings['files'])
+        elif scenario == 'many_backups':
+            checks[scenario] = run_many_backups_suite(
+                recorder, drive_service, folder_id, directory,
+                settings['backups'])
+
+    return recorder.results, checks
+
+
+def print_suite_results(results):
+    print("{:<14}{:<24}{:>10}{:>10}{:>14}{:>14}  {}".format(
+        "scenario", "step", "time (s)", "requests", "uploaded",
+        "downloaded", "phases (s)"))
+
+    for result in results:
+        phases = " ".join(
+            "{} {:.2f}".format(phase, seconds)
+            for phase, seconds in result['phases'].items() if seconds >= 0.01)
+        print("{:<14}{:<24}{:>10.2f}{:>10}{:>14}{:>14}  {}".format(
+            result['scenario'], result['step'], result['seconds'],
+            result['requests'], result['bytes_uploaded'],
+            result['bytes_downloaded'], phases))
+
+
+def compare_suite_results(results, baseline, tolerance):
+    # Prints how every step compares with the baseline and returns the
+    # number of regressions.
+    if baseline['settings'] != results['settings']:
+        print("The baseline was measured with other settings: {}".format(
+            baseline['settings']))
+
+    baseline_results = {(result['scenario'], result['step']): result
+                        for result in baseline['results']}
+
+    print("{:<14}{:<24}{:>10}{:>10}{:>9}{:>10}{:>10}  {}".format(
+        "scenario", "step", "base (s)", "time (s)", "change", "base req",
+        "requests", "verdict"))
+
+    regression_count = 0
+    for result in results['results']:
+        baseline_result = baseline_results.get(
+            (result['scenario'], result['step']))
+        if baseline_result is None:
+            continue
+
+        regressions = []
+        if result['seconds'] > baseline_result['seconds'] * (1 + tolerance) \
+                and result['seconds'] - baseline_result['seconds'] > \
+                SUITE_NOISE_SECONDS:
+            regressions.append('slower')
+        for key in ('requests', 'bytes_uploaded', 'bytes_downloaded'):
+            if result[key] > baseline_result[key]:
+                regressions.append('more ' + key.replace('_', ' '))
+
+        change = result['seconds'] / baseline_result['seconds'] - 1 \
+            if baseline_result['seconds'] > 0 else 0.0
+        print("{:<14}{:<24}{:>10.2f}{:>10.2f}{:>+8.0%}{:>10}{:>10}  {}".format(
+            result['scenario'], result['step'], baseline_result['seconds'],
+            result['seconds'], change, baseline_result['requests'],
+            result['requests'], ", ".join(regressions) or "ok"))
+
+        regression_count += len(regressions) > 0
+
+    return regression_count
+
+
+def get_fastest_results(runs):
+    # Keeps the fastest run of every step, which is the least disturbed by
+    # whatever else the machine was doing.
+    fastest_results = {}
+    for results in runs:
+        for result in results:
+            key = (result['scenario'], result['step'])
+            if key not in fastest_results or \
+                    result['seconds'] < fastest_results[key]['seconds']:
+                fastest_results[key] = result
+
+    return [fastest_results[(result['scenario'], result['step'])]
+            for result in runs[0]]
+
+
+def benchmark_suite(scenarios, settings, repeat, output_file_path,
+                    baseline_file_path, tolerance):
+    print("Running {} on a fake Drive with {} ms per request and {}".format(
+        ", ".join(scenarios), settings['latency_ms'],
+        "{} Mbit/s".format(settings['bandwidth_mbps'])
+        if settings['bandwidth_mbps'] > 0 else "unlimited bandwidth"))
+
+    runs = []
+    checks = {}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            current_directory = os.getcwd()
+            os.chdir(directory)
+
+            try:
+                results, run_checks = run_suite(
+                    directory, scenarios, settings)
+            finally:
+                os.chdir(current_directory)
+
+        runs.append(results)
+        for scenario, matches in run_checks.items():
+            checks[scenario] = checks.get(scenario, True) and matches
+
+    results = get_fastest_results(runs)
+    print_suite_results(results)
+    for scenario, matches in checks.items():
+        print("{}: pulled saves match: {}".format(
+            scenario, "PASS" if matches else "FAIL"))
+
+    results = {
+        'settings': settings,
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'results': results
+    }
+
+    if output_file_path is not None:
+        with open(output_file_path, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print("Results written to {}".format(output_file_path))
+
+    if baseline_file_path is None:
+        return 0 if all(checks.values()) else 1
+
+    with open(baseline_file_path, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+
+    print()
+    regression_count = compare_suite_results(results, baseline, tolerance)
+    print("regressions against {}: {}".format(
+        baseline_file_path, regression_count))
+
+    return 0 if regression_count == 0 and all(checks.values()) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VDSU benchmarks")
+    subparsers = parser.add_subparsers(dest='command')
+
+    hash_parser = subparsers.add_parser(
+        'hash', help="compare save file hashing implementations")
+    hash_parser.add_argument('--size-mb', type=int, default=256)
+
+    transfer_parser = subparsers.add_parser(
+        'transfer', help="compare full and delta transfers on a fake Drive")
+    transfer_parser.add_argument('--size-mb', type=int, default=64)
+
+    startup_parser = subparsers.add_parser(
+        'startup', help="time from launch until the main window is visible")
+    startup_parser.add_argument('--runs', type=int, default=5)
+
+    dedup_parser = subparsers.add_parser(
+        'dedup', help="upload cost of rolling a save back to a backup")
+    dedup_parser.add_argument('--size-mb', type=int, default=64)
+
+    worlds_parser = subparsers.add_parser(
+        'worlds', help="sync many worlds one by one and as one batch")
+    worlds_parser.add_argument('--count', type=int, default=20)
+    worlds_parser.add_argument('--latency-ms', type=float, default=50)
+
+    tree_parser = subparsers.add_parser(
+        'tree', help="sync a Minecraft-like world of many small files")
+    tree_parser.add_argument('--count', type=int, default=10000)
+    tree_parser.add_argument('--changed', type=int, default=20)
+    tree_parser.add_argument('--latency-ms', type=float, default=0)
+
+    pack_parser = subparsers.add_parser(
+        'pack', help="sync many small save files one by one and as a pack")
+    pack_parser.add_argument('--characters', type=int, default=50)
+    pack_parser.add_argument('--latency-ms', type=float, default=50)
+
+    offline_parser = subparsers.add_parser(
+        'offline', help="queue saves while Drive is unreachable")
+    offline_parser.add_argument('--saves', type=int, default=20)
+
+    storage_parser = subparsers.add_parser(
+        'storage', help="compare Drive with a local directory as storage")
+    storage_parser.add_argument('--size-mb', type=int, default=256)
+    storage_parser.add_argument('--latency-ms', type=float, default=20)
+    storage_parser.add_argument('--bandwidth-mbps', type=float, default=100,
+                                help="0 for unlimited")
+
+    replicas_parser = subparsers.add_parser(
+        'replicas', help="push to several destinations one by one and "
+                         "with one fan-out push")
+    replicas_parser.add_argument('--size-mb', type=int, default=256)
+    replicas_parser.add_argument('--count', type=int, default=2)
+    replicas_parser.add_argument('--latency-ms', type=float, default=20)
+    replicas_parser.add_argument('--bandwidth-mbps', type=float, default=400,
+                                 help="0 for unlimited")
+
+    suite_parser = subparsers.add_parser(
+        'suite', help="time pushes and pulls of large, many-file and "
+                      "backup-heavy saves, optionally against a baseline")
+    suite_parser.add_argument('--scenario', action='append',
+                              dest='scenarios', choices=SUITE_SCENARIOS,
+                              help="run only this scenario; may be repeated")
+    suite_parser.add_argument('--db-mb', type=int, default=1024)
+    suite_parser.add_argument('--files', type=int, default=10000)
+    suite_parser.add_argument('--backups', type=int, default=2000)
+    suite_parser.add_argument('--latency-ms', type=float, default=0)
+    suite_parser.add_argument('--bandwidth-mbps', type=float, default=0,
+                              help="0 for unlimited")
+    suite_parser.add_argument('--repeat', type=int, default=1,
+                              help="run everything this many times and "
+                                   "keep the fastest time of each step")
+    suite_parser.add_argument('--output', metavar='FILE',
+                              help="store the results as JSON")
+    suite_parser.add_argument('--baseline', metavar='FILE',
+                              help="compare with results stored earlier")
+    suite_parser.add_argument('--tolerance', type=float,
+                              default=SUITE_TOLERANCE)
+
+    subparsers.add_parser(
+        'retry', help="check retries and batching against mocked failures")
+
+    hash_method_parser = subparsers.add_parser('_hash')
+    hash_method_parser.add_argument('method')
+    hash_method_parser.add_argument('file_path')
+    hash_method_parser.add_argument('cache_file_path')
+
+    args = parser.parse_args()
+
+    if args.command == 'hash':
+        benchmark_hash(args.size_mb)
+    elif args.command == 'transfer':
+        benchmark_transfer(args.size_mb)
+    elif args.command == 'startup':
+        benchmark_startup(args.runs)
+    elif args.command == 'dedup':
+        benchmark_dedup(args.size_mb)
+    elif args.command == 'worlds':
+        benchmark_worlds(args.count, args.latency_ms)
+    elif args.command == 'tree':
+        benchmark_tree(args.count, args.changed, args.latency_ms)
+    elif args.command == 'pack':
+        benchmark_pack(args.characters, args.latency_ms)
+    elif args.command == 'offline':
+        benchmark_offline(args.saves)
+    elif args.command == 'storage':
+        benchmark_storage(args.size_mb, args.latency_ms, args.bandwidth_mbps)
+    elif args.command == 'replicas':
+        benchmark_replicas(args.size_mb, args.count, args.latency_ms,
+                           args.bandwidth_mbps)
+    elif args.command == 'suite':
+        sys.exit(benchmark_suite(
+            args.scenarios or SUITE_SCENARIOS,
+            {
+                'db_mb': args.db_mb,
+                'files': args.files,
+                'backups': args.backups,
+                'latency_ms': args.latency_ms,
+                'bandwidth_mbps': args.bandwidth_mbps
+            },
+            args.repeat, args.output, args.baseline, args.tolerance))
+    elif args.command == 'retry':
+        benchmark_retry()
+    elif args.command == '_hash':
+        run_hash_method(args.method, args.file_path, args.cache_file_path)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
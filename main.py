@@ -1,58 +1,36 @@
-from ValheimSaveFileUpdater import ValheimSaveFileUpdater, TerrariaSaveFileUpdater
+from SyncConfig import create_config_file_if_not_exists, \
+    create_save_file_updater
+from TransferScheduler import get_failed_outcomes, get_queued_outcomes, \
+    is_cancelled
+from BackupRetention import BACKUPSTYLE_TIME, BACKUPSTYLE_OLD, \
+    BACKUPSTYLE_NOBACKUP
+from SyncWorker import start_sync_worker, AutoUpdateWatcher, \
+    SYNC_DIRECTION_LOCAL, SYNC_DIRECTION_DRIVE
 import sys
-import os
+import threading
 
 import configparser
 
 from MainUI import MainUI
 from ConfiguresUI import ConfiguresUI
 
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QMessageBox, \
-    QFileDialog
+    QFileDialog, QProgressBar, QPushButton, QLabel
 
-GAMEPRESET_VALHEIM = 0
-GAMEPRESET_MINECRAFT = 1
-GAMEPRESET_TERRARIA = 2
-GAMEPRESET_DIABLO2 = 3
+BYTES_PER_MB = 1024 * 1024
 
-BACKUPSTYLE_TIME = 0
-BACKUPSTYLE_OLD = 1
-BACKUPSTYLE_NOBACKUP = 2
 
+def get_progress_text(done_bytes, total_bytes, bytes_per_second, eta_seconds):
+    text = "{:.1f}/{:.1f} MB, {:.1f} MB/s".format(
+        done_bytes / BYTES_PER_MB,
+        total_bytes / BYTES_PER_MB,
+        bytes_per_second / BYTES_PER_MB)
 
-def get_default_config():
-    config = configparser.ConfigParser()
-    config['Main'] = {
-        'autoupdate': False
-    }
+    if eta_seconds >= 0:
+        text += ", ETA {}s".format(int(eta_seconds))
 
-    user_name = os.getlogin()
-    default_path = \
-        "C:\\Users\\{}\\AppData\\LocalLow\\IronGate\\Valheim\\worlds" \
-        .format(user_name)
-
-    config['General'] = {
-        'worldname': "None",
-        'drivefolderid': "None",
-        'gamepreset': 0,
-        'savefilepath': default_path,
-        'backupstyle': BACKUPSTYLE_TIME,
-        'minimizetosystemtrayonclose': 0
-    }
-
-    return config
-
-
-def config_file_exists():
-    return os.path.exists("config.ini")
-
-
-def create_config_file_if_not_exists():
-    config = configparser.ConfigParser()
-    if not config_file_exists():
-        with open("config.ini", "w", encoding="cp949") as config_file:
-            config = get_default_config()
-            config.write(config_file)
+    return text
 
 
 class ConfiguresWidget(QWidget):
@@ -123,37 +101,69 @@ class MainWindow(QMainWindow):
         self.ui.AutoUpdateCheckBox.stateChanged.connect(self.toggle_auto_update)
         self.ui.actionConfigures.triggered.connect(self.open_configures)
 
+        self.sync_thread = None
+        self.sync_worker = None
+
+        self.auto_update = False
+        self.auto_update_watcher = None
+        self.auto_update_pending = False
+
+        self.sync_progress_label = QLabel()
+        self.sync_progress_bar = QProgressBar()
+        self.sync_progress_bar.setMaximum(1000)
+        self.sync_cancel_button = QPushButton("Cancel")
+        self.sync_cancel_button.clicked.connect(self.cancel_sync)
+        self.ui.statusbar.addWidget(self.sync_progress_label)
+        self.ui.statusbar.addPermanentWidget(self.sync_progress_bar)
+        self.ui.statusbar.addPermanentWidget(self.sync_cancel_button)
+        self.set_sync_running(False)
+
         create_config_file_if_not_exists()
 
         self.config = configparser.ConfigParser()
 
         with open("config.ini", "r", encoding="utf-8") as config_file:
             self.config.read_file(config_file)
-            self.auto_update = self.config['Main']['autoupdate']
+            auto_update = self.config['Main'].getboolean('autoupdate')
             self.world_name = self.config['General']['worldname']
             self.game_preset = int(self.config['General']['gamepreset'])
             self.drive_folder_id = self.config['General']['drivefolderid']
             self.save_file_path = self.config['General']['savefilepath']
             self.backup_style = self.config['General']['backupstyle']
 
-            if self.game_preset == GAMEPRESET_VALHEIM:
-                self.save_file_updater = ValheimSaveFileUpdater(
-                    "credentials.json",
-                    self.drive_folder_id,
-                    self.save_file_path,
-                    self.world_name)
-            elif self.game_preset == GAMEPRESET_TERRARIA:
-                self.save_file_updater = TerrariaSaveFileUpdater(
-                    "credentials.json",
-                    self.drive_folder_id,
-                    self.save_file_path,
-                    self.world_name)
+            self.save_file_updater = create_save_file_updater(self.config)
+
+        self.ui.AutoUpdateCheckBox.setChecked(auto_update)
+
+        # Runs once the event loop starts, after the window is visible.
+        QTimer.singleShot(0, self.prepare_storage)
+
+    def prepare_storage(self):
+        # Loads and refreshes the credentials and builds the Drive client, or
+        # checks the storage directory, off the GUI thread, so the first sync
+        # does not pay for it.
+        def prepare():
+            try:
+                self.save_file_updater.prepare_storage()
+            except Exception as exception:
+                print("Could not prepare storage: {}".format(exception))
+
+            # Uploads queued while Drive was unreachable in an earlier run.
+            self.save_file_updater.start_draining_upload_queue()
+
+        threading.Thread(target=prepare, daemon=True).start()
 
     def open_configures(self):
         self._configures_widget = ConfiguresWidget()
         self._configures_widget.show()
 
     def update_local(self):
+        self.start_sync(SYNC_DIRECTION_LOCAL)
+
+    def update_drive(self):
+        self.start_sync(SYNC_DIRECTION_DRIVE)
+
+    def start_sync(self, direction):
         if len(self.save_file_path) < 1 or self.save_file_path == "None":
             QMessageBox.question(
                 self,
@@ -162,44 +172,174 @@ class MainWindow(QMainWindow):
                 QMessageBox.Cancel)
             return
 
-        self.save_file_updater.update_local()
-        QMessageBox.question(
-            self,
-            'Finished',
-            'Local Save file updated',
-            QMessageBox.Cancel)
+        if self.sync_worker is not None:
+            if direction == SYNC_DIRECTION_DRIVE:
+                self.auto_update_pending = True
+            return
 
-    def update_drive(self):
-        if len(self.save_file_path) < 1 or self.save_file_path == "None":
+        self.sync_thread, self.sync_worker = start_sync_worker(
+            self.save_file_updater, direction, self)
+        self.sync_worker.progressChanged.connect(self.show_sync_progress)
+        self.sync_worker.finished.connect(self.finish_sync)
+        self.sync_worker.failed.connect(self.fail_sync)
+
+        self.set_sync_running(True)
+
+    def cancel_sync(self):
+        if self.sync_worker is not None:
+            self.sync_worker.cancel()
+            self.sync_cancel_button.setEnabled(False)
+
+    def set_sync_running(self, running):
+        self.ui.UpdateLocalFileButton.setEnabled(not running)
+        self.ui.UpdateDriveFileButton.setEnabled(not running)
+        self.sync_progress_bar.setVisible(running)
+        self.sync_cancel_button.setVisible(running)
+        self.sync_cancel_button.setEnabled(running)
+
+        if running:
+            self.sync_progress_bar.setValue(0)
+            self.sync_progress_label.setText("Syncing...")
+        else:
+            self.sync_thread = None
+            self.sync_worker = None
+
+    def show_sync_progress(self, done_bytes, total_bytes,
+                           bytes_per_second, eta_seconds):
+        if total_bytes > 0:
+            self.sync_progress_bar.setValue(
+                int(1000 * done_bytes / total_bytes))
+
+        self.sync_progress_label.setText(get_progress_text(
+            done_bytes, total_bytes, bytes_per_second, eta_seconds))
+
+    def finish_sync(self, direction, report):
+        self.set_sync_running(False)
+        self.sync_progress_label.setText("")
+
+        if self.auto_update and self.start_pending_auto_update():
+            return
+
+        if self.auto_update and direction == SYNC_DIRECTION_DRIVE:
+            # Background uploads should not pop up a dialog after every save.
+            self.sync_progress_label.setText("Drive Save file updated")
+            if len(get_queued_outcomes(report)) > 0:
+                self.sync_progress_label.setText(
+                    "Drive is unreachable; the save will be uploaded later")
+            if len(get_failed_outcomes(report)) == 0:
+                return
+
+        if is_cancelled(report):
+            self.sync_progress_label.setText("Sync cancelled")
+            return
+
+        if self.show_failed_outcomes(report):
+            return
+
+        if len(get_queued_outcomes(report)) > 0:
             QMessageBox.question(
                 self,
-                'Error',
-                'Local Save File Path is empty',
+                'Offline',
+                'Google Drive is unreachable. The save will be uploaded '
+                'once the connection is back.',
                 QMessageBox.Cancel)
             return
 
-        self.save_file_updater.update_drive()
+        if direction == SYNC_DIRECTION_LOCAL:
+            message = 'Local Save file updated'
+        else:
+            message = 'Drive Save file updated'
+
         QMessageBox.question(
             self,
             'Finished',
-            'Drive Save file updated',
+            message,
+            QMessageBox.Cancel)
+
+    def fail_sync(self, direction, message):
+        self.set_sync_running(False)
+        self.sync_progress_label.setText("")
+
+        if self.auto_update and self.start_pending_auto_update():
+            return
+
+        QMessageBox.question(
+            self,
+            'Error',
+            message,
             QMessageBox.Cancel)
 
+    def show_failed_outcomes(self, report):
+        failed_outcomes = get_failed_outcomes(report)
+        if len(failed_outcomes) == 0:
+            return False
+
+        QMessageBox.question(
+            self,
+            'Error',
+            '\n'.join('{}: {}'.format(outcome['name'], outcome['error'])
+                      for outcome in failed_outcomes),
+            QMessageBox.Cancel)
+
+        return True
+
     def toggle_auto_update(self):
-        if self.auto_update:
-            self.disable_auto_update()
-        else:
+        if self.ui.AutoUpdateCheckBox.isChecked():
             self.enable_auto_update()
+        else:
+            self.disable_auto_update()
+
+        # Configures may have saved other settings since the window read the
+        # file, so only this one is written back, and only if it changed.
+        config = configparser.ConfigParser()
+        with open("config.ini", "r", encoding="utf-8") as config_file:
+            config.read_file(config_file)
+
+        if config['Main'].getboolean('autoupdate') == self.auto_update:
+            return
+
+        config['Main']['autoupdate'] = str(self.auto_update)
+        with open("config.ini", "w", encoding="utf-8") as config_file:
+            config.write(config_file)
 
     def enable_auto_update(self):
+        if self.auto_update:
+            return
+
         self.auto_update = True
+        self.auto_update_watcher = AutoUpdateWatcher(
+            self.save_file_updater.get_local_directory_path(),
+            self.save_file_updater.get_local_file_paths(),
+            self)
+        self.auto_update_watcher.saveSettled.connect(self.update_drive)
+        self.auto_update_watcher.start()
 
     def disable_auto_update(self):
+        if not self.auto_update:
+            return
+
         self.auto_update = False
+        self.auto_update_pending = False
+        self.auto_update_watcher.stop()
+        self.auto_update_watcher.deleteLater()
+        self.auto_update_watcher = None
+
+    def start_pending_auto_update(self):
+        # Saves that settled while a sync was running are coalesced into a
+        # single follow-up upload.
+        if not self.auto_update_pending:
+            return False
+
+        self.auto_update_pending = False
+        self.update_drive()
+
+        return True
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    window.save_file_updater.close()
+    sys.exit(exit_code)
@@ -1,3 +1,13 @@
+import os
 import subprocess
+import sys
 
-subprocess.call("env\\Scripts\\pythonw.exe main.py")
\ No newline at end of file
+if sys.platform == 'win32':
+    python = os.path.join('env', 'Scripts', 'pythonw.exe')
+else:
+    python = os.path.join('env', 'bin', 'python')
+
+if not os.path.exists(python):
+    python = sys.executable
+
+subprocess.call([python, 'main.py'])
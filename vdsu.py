@@ -0,0 +1,236 @@
+import argparse
+import signal
+import sys
+import threading
+
+from DriveService import AuthorizationRequiredError
+from SyncConfig import CONFIG_FILE_NAME, CLIENT_SECRET_FILE_NAME, \
+    load_config, create_multi_world_sync
+from SaveFileWatcher import SaveFileWatcher, SETTLE_SECONDS, POLL_SECONDS
+from MultiWorldSync import WORLD_STATUS_OK, WORLD_STATUS_CONFLICT
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_CONFIG_ERROR = 2
+EXIT_CONFLICT = 3
+
+
+def print_report(report, indent=''):
+    for outcome in report:
+        line = "{}{:<32}{:<12}{:>8.2f}s".format(
+            indent, outcome['name'], outcome['status'], outcome['elapsed'])
+        if outcome['error'] is not None:
+            line += "  {}".format(outcome['error'])
+        print(line)
+
+
+def print_summaries(summaries):
+    for summary in summaries:
+        counts = ", ".join("{} {}".format(count, status) for status, count
+                           in sorted(summary['counts'].items()))
+        line = "{:<24}{:<12}{:>8.2f}s  {}".format(
+            summary['name'], summary['status'], summary['elapsed'], counts)
+        if summary['error'] is not None:
+            line += "  {}".format(summary['error'])
+        print(line)
+
+        print_report(summary['report'], '  ')
+
+
+def get_exit_code(summaries):
+    statuses = set(summary['status'] for summary in summaries)
+    if statuses <= {WORLD_STATUS_OK}:
+        return EXIT_OK
+    if statuses <= {WORLD_STATUS_OK, WORLD_STATUS_CONFLICT}:
+        return EXIT_CONFLICT
+
+    return EXIT_FAILED
+
+
+def push(multi_world_sync, args):
+    summaries = multi_world_sync.update_drive()
+    print_summaries(summaries)
+    # Old backups are trashed in the background; a cron run must not exit
+    # before that is done.
+    multi_world_sync.wait_for_pruning()
+
+    return get_exit_code(summaries)
+
+
+def pull(multi_world_sync, args):
+    summaries = multi_world_sync.update_local()
+    print_summaries(summaries)
+
+    return get_exit_code(summaries)
+
+
+def sync(multi_world_sync, args):
+    summaries = multi_world_sync.sync()
+    print_summaries(summaries)
+    multi_world_sync.wait_for_pruning()
+
+    return get_exit_code(summaries)
+
+
+def status(multi_world_sync, args):
+    summaries = multi_world_sync.get_sync_status()
+
+    print("{:<24}{:<32}{:<12}{:<34}{}".format(
+        "world", "file", "status", "local md5", "drive modified"))
+    for summary in summaries:
+        if summary['error'] is not None:
+            print("{:<24}{}".format(summary['name'], summary['error']))
+
+        for file_status in summary['report']:
+            print("{:<24}{:<32}{:<12}{:<34}{}".format(
+                summary['name'],
+                file_status['name'],
+                file_status['status'],
+                file_status['local_md5'] or '-',
+                file_status['drive_modified_time'] or '-'))
+
+    return get_exit_code(summaries)
+
+
+def watch(multi_world_sync, args):
+    stopped = threading.Event()
+
+    def on_save_settled():
+        # Worlds whose saves did not change cost one hash cache lookup each.
+        summaries = multi_world_sync.update_drive()
+        print_summaries(summaries)
+        multi_world_sync.wait_for_pruning()
+
+        # The watcher tries again after the next settle window.
+        if get_exit_code(summaries) != EXIT_OK:
+            raise RuntimeError("Push failed")
+
+    def stop(signal_number, frame):
+        stopped.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    file_paths = []
+    for world_name, save_file_updater in \
+            multi_world_sync.get_save_file_updaters():
+        file_paths.extend(save_file_updater.get_local_file_paths())
+        print("Watching {} in {}".format(
+            world_name, save_file_updater.get_local_directory_path()))
+
+    save_file_watcher = SaveFileWatcher(
+        file_paths,
+        on_save_settled,
+        settle_seconds=args.settle_seconds,
+        poll_seconds=args.poll_seconds)
+
+    # Saves queued while Drive was unreachable go up as soon as it is back.
+    multi_world_sync.start_draining_upload_queues()
+
+    if args.push_first:
+        on_save_settled()
+
+    save_file_watcher.start()
+
+    # Waking up now and then keeps signals responsive on Windows.
+    while not stopped.wait(1.0):
+        pass
+
+    save_file_watcher.stop()
+
+    return EXIT_OK
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m vdsu',
+        description="Sync game saves with Google Drive without the GUI. "
+                    "The settings come from the same config.ini as the GUI.")
+    parser.add_argument('--config', default=CONFIG_FILE_NAME,
+                        help="path of config.ini")
+    parser.add_argument('--credentials', default=CLIENT_SECRET_FILE_NAME,
+                        help="OAuth client secret file, only needed with "
+                             "--login")
+    parser.add_argument('--login', action='store_true',
+                        help="sign in with a browser if the Google "
+                             "credentials are missing or revoked, instead "
+                             "of failing")
+    parser.add_argument('--world', action='append', dest='worlds',
+                        metavar='NAME',
+                        help="only sync this world; may be repeated")
+    parser.add_argument('--metrics', dest='metrics_file_path',
+                        metavar='FILE',
+                        help="write the metrics of every sync to FILE, as "
+                             "JSON lines or, for a .prom file, for the "
+                             "Prometheus textfile collector")
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('push', help="upload changed saves to Drive")
+    subparsers.add_parser('pull', help="download changed saves from Drive")
+    subparsers.add_parser(
+        'sync', help="send each save the way it changed since the last sync; "
+                     "saves changed on both sides are left as conflicts")
+    subparsers.add_parser('status', help="compare local saves with Drive")
+
+    watch_parser = subparsers.add_parser(
+        'watch', help="push saves whenever the game has written them")
+    watch_parser.add_argument('--settle-seconds', type=float,
+                              default=SETTLE_SECONDS)
+    watch_parser.add_argument('--poll-seconds', type=float,
+                              default=POLL_SECONDS)
+    watch_parser.add_argument('--push-first', action='store_true',
+                              help="push once before watching")
+
+    return parser
+
+
+COMMANDS = {
+    'push': push,
+    'pull': pull,
+    'sync': sync,
+    'status': status,
+    'watch': watch
+}
+
+
+def main(argv=None):
+    parser = get_argument_parser()
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return EXIT_CONFIG_ERROR
+
+    try:
+        config = load_config(args.config)
+        multi_world_sync = create_multi_world_sync(
+            config, args.credentials, world_names=args.worlds,
+            metrics_file_path=args.metrics_file_path)
+    except (OSError, KeyError, ValueError) as exception:
+        print("Could not load {}: {}".format(args.config, exception),
+              file=sys.stderr)
+        return EXIT_CONFIG_ERROR
+
+    if len(multi_world_sync) == 0:
+        print("No world matches {}".format(", ".join(args.worlds)),
+              file=sys.stderr)
+        return EXIT_CONFIG_ERROR
+
+    # Unattended runs must not wait for a browser nobody is watching.
+    multi_world_sync.set_interactive_authorization(args.login)
+
+    try:
+        try:
+            multi_world_sync.prepare_storage()
+        except AuthorizationRequiredError as exception:
+            print("Could not sign in: {}; run once with --login".format(
+                exception), file=sys.stderr)
+            return EXIT_CONFIG_ERROR
+
+        return COMMANDS[args.command](multi_world_sync, args)
+    finally:
+        multi_world_sync.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())